@@ -6,15 +6,35 @@ Gemini 2.5 FlashAgent
 
 import os
 import json
-import base64
+import asyncio
 import time
-from typing import Dict, List, Optional, Union
-from openai import OpenAI
+import uuid
+from typing import Dict, List, Optional, Tuple, Union
 import datetime
 
+from config import PERFORMANCE_CONFIG
+from core.llm_cache import (
+    cached_chat_completion, cached_chat_completion_async,
+    streamed_chat_completion, streamed_chat_completion_async,
+)
+from core.llm_client import get_openai_client
+from core.llm_retry import CONTENT, TRANSPORT, RetryPolicy, classify_error, retry_after_seconds
+from core.image_payload import prepare_image_data_url
+from core.prompt_cache import system_message
+from core.prompt_budget import estimate_messages_tokens, get_token_usage_log, split_to_budget, warn_if_over_budget
+from core.structured_output import (
+    IncrementalJSONParser, ParseResult, is_response_format_error, parse_json_tolerant, response_format_params,
+)
+from utils.logger import emit_task_event, print_info
+
 
 class BaseGeminiAgent:
     """Gemini 2.5 Flash Agent"""
+
+    # 子类可声明输出的 JSON Schema（PERFORMANCE_CONFIG["llm_response_format"] 为 json_schema 时随请求发送）
+    response_schema: Optional[Dict] = None
+    # 流式输出时逐个推送的数组字段（每生成完一个元素就写入任务日志并推送给前端）
+    stream_fields: Tuple[str, ...] = ("assembly_steps", "additional_steps")
     
     def __init__(
         self,
@@ -39,10 +59,7 @@ class BaseGeminiAgent:
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEYapi_key")
 
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=self.api_key
-        )
+        self.client = get_openai_client(self.api_key)
 
         # 保存传入的model_name（如果有的话），否则每次调用时从环境变量读取
         self._model_name_override = model_name
@@ -63,26 +80,69 @@ class BaseGeminiAgent:
             base64URL
         """
         try:
-            with open(image_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode('ascii')
-                # 
-                if image_path.lower().endswith('.png'):
-                    return f"data:image/png;base64,{encoded_string}"
-                elif image_path.lower().endswith(('.jpg', '.jpeg')):
-                    return f"data:image/jpeg;base64,{encoded_string}"
-                else:
-                    return f"data:image/png;base64,{encoded_string}"
+            # 图片预处理（灰度/调色板、限制长边）后编码，按文件记忆化：同一张图纸被多个Agent/多次重试发送时只处理一次
+            return prepare_image_data_url(image_path)
         except Exception as e:
             print(f"  : {image_path}")
             print(f"   : {str(e)}")
             raise
     
+    def call_gemini_chunked(
+        self,
+        items: List,
+        build_prompt,
+        list_fields: Tuple[str, ...],
+        images: Optional[Union[str, List[str]]] = None
+    ) -> Dict:
+        """
+        按 token 预算分批调用（内容超预算时拆分而不是截断），合并各批返回的数组字段
+
+        Args:
+            items: 可拆分的输入（如装配步骤）
+            build_prompt: build_prompt(批次) -> (system_prompt, user_query)
+            list_fields: 各批结果中需要合并的数组字段
+            images: 每批都发送的图片
+
+        Returns:
+            同 call_gemini；result 为 {字段: 合并后的数组}，另含 batches / failed_batches。
+            至少一批成功即视为成功。
+        """
+        image_count = len(self._normalize_images(images))
+        text_budget = max(
+            PERFORMANCE_CONFIG["prompt_token_budget"] // 4,
+            PERFORMANCE_CONFIG["prompt_token_budget"] - image_count * PERFORMANCE_CONFIG["prompt_image_tokens"]
+        )
+        batches = split_to_budget(items, lambda batch: "".join(build_prompt(batch)), text_budget)
+        if len(batches) == 1:
+            return self.call_gemini(*build_prompt(items), images)
+
+        print(f"[{self.agent_name}] 🧮 输入超过预算，拆分为 {len(batches)} 批: {[len(b) for b in batches]}")
+        merged = {field: [] for field in list_fields}
+        errors = []
+        for batch in batches:
+            result = self.call_gemini(*build_prompt(batch), images)
+            if not result["success"]:
+                errors.append(result.get("error"))
+                continue
+            for field in list_fields:
+                value = result["result"].get(field)
+                if isinstance(value, list):
+                    merged[field].extend(value)
+        if len(errors) == len(batches):
+            return {"success": False, "error": errors[0], "result": None}
+        return {
+            "success": True,
+            "result": merged,
+            "batches": len(batches),
+            "failed_batches": len(errors)
+        }
+
     def call_gemini_with_retry(
         self,
         system_prompt: str,
         user_query: str,
         images: Optional[Union[str, List[str]]] = None,
-        max_retries: int = 3
+        max_retries: Optional[int] = None
     ) -> Dict:
         """
         带重试机制的Gemini调用
@@ -91,7 +151,7 @@ class BaseGeminiAgent:
             system_prompt: 系统提示词
             user_query: 用户查询
             images: 图片路径
-            max_retries: 最大重试次数（默认3次）
+            max_retries: 最大尝试次数（默认读取 PERFORMANCE_CONFIG["llm_retry_max_attempts"]）
 
         Returns:
             {
@@ -100,44 +160,33 @@ class BaseGeminiAgent:
                 "raw_response": str
             }
         """
-        for attempt in range(max_retries):
+        policy = RetryPolicy.from_config(max_retries)
+        for attempt in range(policy.max_attempts):
             print(f"\n{'='*60}")
             if attempt > 0:
-                print(f"🔄 第{attempt + 1}次尝试（共{max_retries}次）")
+                print(f"🔄 第{attempt + 1}次尝试（共{policy.max_attempts}次）")
             print(f"{'='*60}")
 
-            result = self.call_gemini(system_prompt, user_query, images)
-
-            if result["success"]:
-                # 检查JSON是否有效
-                parsed = result["result"]
-                if parsed and not parsed.get("parse_error") and not parsed.get("raw_content"):
-                    print(f"✅ 调用成功，JSON解析正常")
-                    return result
-                else:
-                    print(f"⚠️ JSON解析失败，准备重试...")
-                    if attempt < max_retries - 1:
-                        print(f"⏳ 等待2秒后重试...")
-                        time.sleep(2)
-            else:
-                print(f"⚠️ API调用失败: {result.get('error')}")
-                if attempt < max_retries - 1:
-                    print(f"⏳ 等待2秒后重试...")
-                    time.sleep(2)
+            # 重试时跳过缓存读取，避免再次拿到同一个无效响应
+            result = self.call_gemini(system_prompt, user_query, images, refresh_cache=attempt > 0)
+            if result["success"] and self._is_valid_result(result["result"]):
+                print(f"✅ 调用成功，JSON解析正常")
+                return result
 
-        # 所有重试都失败
-        print(f"\n❌ 重试{max_retries}次后仍然失败")
-        return {
-            "success": False,
-            "error": f"重试{max_retries}次后仍然失败",
-            "result": None
-        }
+            delay = self._next_retry_delay(policy, attempt, result)
+            if delay is None:
+                break
+            time.sleep(delay)
+
+        return self._retry_exhausted(policy)
 
     def call_gemini(
         self,
         system_prompt: str,
         user_query: str,
-        images: Optional[Union[str, List[str]]] = None
+        images: Optional[Union[str, List[str]]] = None,
+        refresh_cache: bool = False,
+        allow_response_format: bool = True
     ) -> Dict:
         """
         Gemini 2.5 Flash
@@ -146,6 +195,8 @@ class BaseGeminiAgent:
             system_prompt: 
             user_query: 
             images: 
+            refresh_cache: 跳过LLM缓存读取并覆盖缓存
+            allow_response_format: 是否请求结构化输出（模型拒绝 response_format 后以 False 重试一次）
             
         Returns:
             {
@@ -154,24 +205,155 @@ class BaseGeminiAgent:
                 "raw_response": str  # 
             }
         """
-        # 
-        image_paths = []
-        if images:
-            if isinstance(images, str):
-                image_paths = [images]
-            else:
-                image_paths = images
+        image_paths = self._normalize_images(images)
+        messages = self._build_messages(system_prompt, user_query, image_paths)
         
-        # 
-        user_content = []
-        
-        # 
-        user_content.append({
+        try:
+            estimated_tokens = self._log_call(messages, image_paths)
+
+            # API（相同输入命中缓存时不再请求；只缓存能解析出JSON的响应）
+            request = dict(
+                model=self.model_name,
+                messages=messages,
+                temperature=self.temperature,
+                validate=self._is_valid_response,
+                refresh=refresh_cache,
+                extra_headers=self._extra_headers(),
+                **(response_format_params(self.model_name, self.response_schema, self.agent_name)
+                   if allow_response_format else {})
+            )
+            if PERFORMANCE_CONFIG["llm_streaming"]:
+                # 流式：步骤边生成边推送，格式明显错误时提前中止
+                response = streamed_chat_completion(self.client, on_text=self._stream_parser().feed, **request)
+            else:
+                response = cached_chat_completion(self.client, **request)
+            get_token_usage_log().record(self.agent_name, estimated_tokens, response.usage)
+            return self._handle_response(system_prompt, user_query, len(image_paths), response.content)
+
+        except Exception as e:
+            if allow_response_format and is_response_format_error(self.model_name, e):
+                # 模型不支持 response_format：去掉该参数重新请求一次（之后不再请求）
+                return self.call_gemini(
+                    system_prompt, user_query, images, refresh_cache, allow_response_format=False
+                )
+            return self._handle_failure(e)
+
+    async def call_gemini_async(
+        self,
+        client,
+        system_prompt: str,
+        user_query: str,
+        images: Optional[Union[str, List[str]]] = None,
+        refresh_cache: bool = False,
+        allow_response_format: bool = True
+    ) -> Dict:
+        """
+        call_gemini 的异步版本（经进程级限流器 aslot 发出，可在同一事件循环内并发多个请求）
+
+        Args:
+            client: AsyncOpenAI 客户端（core.llm_client.async_openai_client）
+            其他参数与返回值同 call_gemini
+        """
+        image_paths = self._normalize_images(images)
+        messages = self._build_messages(system_prompt, user_query, image_paths)
+
+        try:
+            estimated_tokens = self._log_call(messages, image_paths)
+            request = dict(
+                model=self.model_name,
+                messages=messages,
+                temperature=self.temperature,
+                validate=self._is_valid_response,
+                refresh=refresh_cache,
+                extra_headers=self._extra_headers(),
+                **(response_format_params(self.model_name, self.response_schema, self.agent_name)
+                   if allow_response_format else {})
+            )
+            if PERFORMANCE_CONFIG["llm_streaming"]:
+                response = await streamed_chat_completion_async(client, on_text=self._stream_parser().feed, **request)
+            else:
+                response = await cached_chat_completion_async(client, **request)
+            get_token_usage_log().record(self.agent_name, estimated_tokens, response.usage)
+            return self._handle_response(system_prompt, user_query, len(image_paths), response.content)
+
+        except Exception as e:
+            if allow_response_format and is_response_format_error(self.model_name, e):
+                return await self.call_gemini_async(
+                    client, system_prompt, user_query, images, refresh_cache, allow_response_format=False
+                )
+            return self._handle_failure(e)
+
+    async def call_gemini_with_retry_async(
+        self,
+        client,
+        system_prompt: str,
+        user_query: str,
+        images: Optional[Union[str, List[str]]] = None,
+        max_retries: Optional[int] = None
+    ) -> Dict:
+        """call_gemini_with_retry 的异步版本（重试等待不阻塞事件循环）"""
+        policy = RetryPolicy.from_config(max_retries)
+        for attempt in range(policy.max_attempts):
+            if attempt > 0:
+                print(f"🔄 第{attempt + 1}次尝试（共{policy.max_attempts}次）")
+
+            result = await self.call_gemini_async(
+                client, system_prompt, user_query, images, refresh_cache=attempt > 0
+            )
+            if result["success"] and self._is_valid_result(result["result"]):
+                print(f"✅ 调用成功，JSON解析正常")
+                return result
+
+            delay = self._next_retry_delay(policy, attempt, result)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+        return self._retry_exhausted(policy)
+
+    def _next_retry_delay(self, policy: RetryPolicy, attempt: int, result: Dict) -> Optional[float]:
+        """
+        根据失败类别决定是否重试
+
+        - content（JSON无效）/ transport / rate_limit：按退避时间重试
+        - fatal（参数/鉴权错误）/ circuit_open（模型熔断）：立即放弃
+
+        Returns:
+            下次重试前的等待秒数；None 表示不再重试
+        """
+        if result["success"]:
+            error_kind = CONTENT
+            print(f"⚠️ JSON解析失败")
+        else:
+            error_kind = result.get("error_kind", TRANSPORT)
+            print(f"⚠️ API调用失败 ({error_kind}): {result.get('error')}")
+
+        if not policy.should_retry(attempt, error_kind):
+            return None
+        delay = policy.delay(attempt, result.get("retry_after"))
+        print(f"⏳ 等待{delay:.1f}秒后重试...")
+        return delay
+
+    def _retry_exhausted(self, policy: RetryPolicy) -> Dict:
+        print(f"\n❌ 重试{policy.max_attempts}次后仍然失败")
+        return {
+            "success": False,
+            "error": f"重试{policy.max_attempts}次后仍然失败",
+            "result": None
+        }
+
+    def _normalize_images(self, images: Optional[Union[str, List[str]]]) -> List[str]:
+        if not images:
+            return []
+        return [images] if isinstance(images, str) else list(images)
+
+    def _build_messages(self, system_prompt: str, user_query: str, image_paths: List[str]) -> List[Dict]:
+        """构建 system + user（文本 + 图片）消息"""
+        user_content = [{
             "type": "text",
             "text": user_query
-        })
+        }]
         
-        # 
         for img_path in image_paths:
             if img_path.startswith('http'):
                 image_url = img_path
@@ -183,113 +365,136 @@ class BaseGeminiAgent:
                 "image_url": {"url": image_url}
             })
         
-        # 
-        messages = [
-            {
-                "role": "system",
-                "content": system_prompt
-            },
+        return [
+            system_message(system_prompt, self.model_name),  # 静态前缀在最前，可命中提示词缓存
             {
                 "role": "user",
                 "content": user_content
             }
         ]
-        
-        try:
-            print(f"\n[{self.agent_name}] Calling AI Model")
-            print(f"   Model: {self.model_name}")
-            print(f"   Images: {len(image_paths)}")
-            print(f"   Temperature: {self.temperature}")
-
-            # API
-            completion = self.client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "https://mecagent.com",
-                    "X-Title": "MecAgent"  # 
-                },
-                model=self.model_name,
-                messages=messages,
-                temperature=self.temperature
-            )
-            
-            #
-            response_content = completion.choices[0].message.content
-
-            print(f"[{self.agent_name}] Success")
-
-            # ✅ 先保存原始响应，再解析JSON
-            try:
-                parsed_result = self._parse_json_response(response_content)
-            except Exception as parse_error:
-                # 即使解析失败，也保存原始响应用于调试
-                self._save_debug_output(
-                    system_prompt=system_prompt,
-                    user_query=user_query,
-                    image_count=len(image_paths),
-                    response=response_content,
-                    parsed={"parse_error": str(parse_error)}
-                )
-                raise parse_error
 
-            #
+    def _stream_parser(self) -> IncrementalJSONParser:
+        """本次调用的增量解析器（每个元素带同一个 call_id，重试时前端可丢弃上一次的步骤）"""
+        call_id = uuid.uuid4().hex[:8]
+
+        def on_item(field: str, index: int, item) -> None:
+            if not isinstance(item, dict):
+                return
+            title = item.get("title") or item.get("action") or item.get("step_id") or ""
+            print_info(f"[{self.agent_name}] 📝 {field}[{index}] {title}")
+            emit_task_event({
+                "type": "step",
+                "agent": self.agent_name,
+                "call_id": call_id,
+                "field": field,
+                "index": index,
+                "step": item,
+            })
+
+        return IncrementalJSONParser(self.stream_fields, on_item)
+
+    def _extra_headers(self) -> Dict[str, str]:
+        return {
+            "HTTP-Referer": "https://mecagent.com",
+            "X-Title": "MecAgent"  # 
+        }
+
+    def _log_call(self, messages: List[Dict], image_paths: List[str]) -> int:
+        """打印调用信息，返回估算的输入 token 数"""
+        estimated_tokens = estimate_messages_tokens(messages)
+        print(f"\n[{self.agent_name}] Calling AI Model")
+        print(f"   Model: {self.model_name}")
+        print(f"   Images: {len(image_paths)}")
+        print(f"   Temperature: {self.temperature}")
+        print(f"   Estimated prompt tokens: {estimated_tokens}")
+        warn_if_over_budget(self.agent_name, estimated_tokens)
+        return estimated_tokens
+
+    def _handle_response(self, system_prompt: str, user_query: str, image_count: int, response_content: str) -> Dict:
+        """解析响应并保存调试输出"""
+        print(f"[{self.agent_name}] Success")
+
+        # ✅ 先保存原始响应，再解析JSON（截断/夹杂文字的响应在本地修复，避免整次重新请求）
+        try:
+            parse = self._parse_structured(response_content)
+            parsed_result = self._to_result_dict(parse, response_content)
+        except Exception as parse_error:
+            # 即使解析失败，也保存原始响应用于调试
             self._save_debug_output(
                 system_prompt=system_prompt,
                 user_query=user_query,
-                image_count=len(image_paths),
+                image_count=image_count,
                 response=response_content,
-                parsed=parsed_result
+                parsed={"parse_error": str(parse_error)}
             )
+            raise parse_error
 
-            return {
-                "success": True,
-                "result": parsed_result,
-                "raw_response": response_content
-            }
+        #
+        self._save_debug_output(
+            system_prompt=system_prompt,
+            user_query=user_query,
+            image_count=image_count,
+            response=response_content,
+            parsed=parsed_result
+        )
 
-        except Exception as e:
-            print(f"[{self.agent_name}] Failed: {str(e)}")
-            print(f"\n⚠️ 提示：检查 debug_output 目录查看原始响应")
-            return {
-                "success": False,
-                "error": str(e),
-                "result": None
-            }
+        if parse.repaired and parse.ok:
+            print(f"[{self.agent_name}] ⚠️ {parse.summary()}")
+
+        return {
+            "success": True,
+            "result": parsed_result,
+            "raw_response": response_content,
+            "truncated": parse.truncated,
+            "recovered": parse.recovered
+        }
+
+    def _handle_failure(self, error: Exception) -> Dict:
+        print(f"[{self.agent_name}] Failed: {str(error)}")
+        print(f"\n⚠️ 提示：检查 debug_output 目录查看原始响应")
+        return {
+            "success": False,
+            "error": str(error),
+            "error_kind": classify_error(error),
+            "retry_after": retry_after_seconds(error),
+            "result": None
+        }
     
+    def _is_valid_response(self, response_content: str) -> bool:
+        """响应能完整解析为JSON对象时才写入缓存（截断后修复的响应不缓存）"""
+        try:
+            parse = self._parse_structured(response_content)
+            return not parse.truncated and self._is_valid_result(self._to_result_dict(parse, response_content))
+        except Exception:
+            return False
+
+    @staticmethod
+    def _is_valid_result(parsed: Optional[Dict]) -> bool:
+        return bool(parsed) and not parsed.get("parse_error") and not parsed.get("raw_content")
+
+    @staticmethod
+    def _parse_structured(response_content: str) -> ParseResult:
+        """容错解析（去掉代码块/多余文字/尾逗号，截断时保留完整的元素）"""
+        return parse_json_tolerant(response_content, expect="object")
+
+    @staticmethod
+    def _to_result_dict(parse: ParseResult, response_content: str) -> Dict:
+        if parse.ok and isinstance(parse.value, dict):
+            return parse.value
+        return {"raw_content": response_content, "parse_error": parse.error or "响应不是JSON对象"}
+
     def _parse_json_response(self, response_content: str) -> Dict:
         """
-        JSON
-        
+        解析JSON响应
+
         Args:
-            response_content: 
-            
+            response_content: 模型返回的原始文本
+
         Returns:
-            JSON
+            JSON对象；无法解析时为 {"raw_content": ..., "parse_error": ...}
         """
-        try:
-            # 
-            json_start = response_content.find('{')
-            json_end = response_content.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                json_str = response_content[json_start:json_end]
-                return json.loads(json_str)
-            else:
-                return {"raw_content": response_content}
-        except json.JSONDecodeError as e:
-            # JSON```json
-            if "```json" in response_content:
-                json_start = response_content.find("```json") + 7
-                json_end = response_content.find("```", json_start)
-                if json_end > json_start:
-                    json_str = response_content[json_start:json_end].strip()
-                    try:
-                        return json.loads(json_str)
-                    except:
-                        return {"raw_content": response_content, "parse_error": str(e)}
-                else:
-                    return {"raw_content": response_content, "parse_error": str(e)}
-            else:
-                return {"raw_content": response_content, "parse_error": str(e)}
-    
+        return self._to_result_dict(self._parse_structured(response_content), response_content)
+
     def _save_debug_output(
         self,
         system_prompt: str,
@@ -312,9 +517,9 @@ class BaseGeminiAgent:
         output_dir = "debug_output"
         os.makedirs(output_dir, exist_ok=True)
         
-        # agent
+        # agent（并发调用时同一秒内可能有多次输出，追加随机后缀避免互相覆盖）
         safe_name = self.agent_name.replace(" ", "_").replace("/", "_")
-        output_file = os.path.join(output_dir, f"{safe_name}_{timestamp}.json")
+        output_file = os.path.join(output_dir, f"{safe_name}_{timestamp}_{uuid.uuid4().hex[:6]}.json")
         
         result_data = {
             "agent_name": self.agent_name,
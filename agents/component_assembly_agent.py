@@ -5,9 +5,11 @@ Agent 3:
 """
 
 import re
-from typing import Dict, List
+from typing import Dict, List, Optional
 from agents.base_gemini_agent import BaseGeminiAgent
-from prompts.agent_3_component_assembly import build_component_assembly_prompt
+from config import PERFORMANCE_CONFIG
+from core.step_delta import splice_steps
+from prompts.agent_3_component_assembly import build_component_assembly_prompt, build_component_gap_fill_prompt
 
 
 class ComponentAssemblyAgent(BaseGeminiAgent):
@@ -50,7 +52,8 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
         bom_mapping_table: List[Dict] = None,  # ✅ 新增：BOM映射宽表
         check_coverage: bool = True,  # ✅ 新增：是否检查BOM覆盖率
         min_coverage: float = 0.95,  # ✅ 新增：最低覆盖率要求（95%）
-        max_retries: int = 2  # ✅ 新增：最大重试次数
+        max_retries: int = 2,  # ✅ 新增：最大重试次数
+        repair_mode: str = None
     ) -> Dict:
         """
         生成组件装配步骤（带BOM覆盖率检查和重试机制）
@@ -64,6 +67,8 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
             check_coverage: 是否检查BOM覆盖率
             min_coverage: 最低覆盖率要求（默认95%）
             max_retries: 最大重试次数（默认2次）
+            repair_mode: 覆盖率不足时的重试方式：incremental（只补充缺失零件的步骤）
+                或 regenerate（重新生成全部步骤）；默认读取 PERFORMANCE_CONFIG["coverage_repair_mode"]
 
         Returns:
             {
@@ -82,6 +87,12 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
         print(f" 图片数: {len(component_images)}")
         print(f" 零件数: {total_bom_count}")
 
+        repair_mode = repair_mode or PERFORMANCE_CONFIG["coverage_repair_mode"]
+        component_code = component_plan.get("component_code")
+        assembly_steps = []
+        parsed = None
+        uncovered_parts = []
+
         # 尝试生成（带重试）
         for attempt in range(max_retries + 1):
             if attempt > 0:
@@ -89,15 +100,26 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
                 print(f"🔄 BOM覆盖率不足，开始第{attempt}次重试...")
                 print(f"{'='*60}")
 
-            # 构建提示词
-            system_prompt, user_query = build_component_assembly_prompt(
-                component_plan=component_plan,
-                parts_list=parts_list
-            )
+            repaired = None
+            if attempt > 0 and repair_mode == "incremental" and assembly_steps:
+                # 增量补全：只为未覆盖的BOM项生成新增步骤，按 display_order 插入
+                repaired = self._fill_coverage_gaps(
+                    component_plan, component_images, assembly_steps, uncovered_parts,
+                    bom_to_mesh_mapping, bom_mapping_table
+                )
+
+            if repaired is not None:
+                assembly_steps = repaired
+            else:
+                # 构建提示词
+                system_prompt, user_query = build_component_assembly_prompt(
+                    component_plan=component_plan,
+                    parts_list=parts_list
+                )
 
-            # 如果是重试，添加反馈信息
-            if attempt > 0 and check_coverage:
-                feedback = f"""
+                # 如果是重试，添加反馈信息
+                if attempt > 0 and check_coverage and uncovered_parts:
+                    feedback = f"""
 
 ⚠️ 重要提醒：上一次生成的步骤BOM覆盖率只有{coverage_rate:.1%}，未达到{min_coverage:.0%}的要求。
 
@@ -105,29 +127,26 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
 {uncovered_bom_list}
 
 请重新生成装配步骤，确保100%覆盖所有BOM项。每个BOM项都必须在某个步骤的parts_used中出现。
-                """
-                user_query = user_query + feedback
-
-            # 调用AI生成步骤（使用重试机制）
-            result = self.call_gemini_with_retry(
-                system_prompt=system_prompt,
-                user_query=user_query,
-                images=component_images,
-                max_retries=3  # JSON解析失败时重试3次
-            )
-
-            if not result["success"]:
-                print(f"\n❌ 生成失败: {result.get('error')}")
-                continue
-
-            parsed = result["result"]
-            assembly_steps = parsed.get("assembly_steps", [])
-
-            # ✅ 使用BOM映射宽表添加mesh_id
-            if bom_mapping_table:
-                assembly_steps = self._add_mesh_ids_from_table(assembly_steps, bom_mapping_table)
-            elif bom_to_mesh_mapping:
-                assembly_steps = self._add_mesh_ids(assembly_steps, bom_to_mesh_mapping)
+                    """
+                    user_query = user_query + feedback
+
+                # 调用AI生成步骤（使用重试机制）
+                result = self.call_gemini_with_retry(
+                    system_prompt=system_prompt,
+                    user_query=user_query,
+                    images=component_images,
+                    max_retries=3  # JSON解析失败时重试3次
+                )
+
+                if not result["success"]:
+                    print(f"\n❌ 生成失败: {result.get('error')}")
+                    continue
+
+                parsed = result["result"]
+                assembly_steps = parsed.get("assembly_steps", [])
+
+                # ✅ 使用BOM映射宽表添加mesh_id
+                assembly_steps = self._attach_mesh_ids(assembly_steps, bom_to_mesh_mapping, bom_mapping_table)
 
             print(f"\n✅ 生成结果:")
             print(f"   - 步骤数: {len(assembly_steps)}")
@@ -150,7 +169,7 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
                     print(f"  ✅ BOM覆盖率达标")
                     return {
                         "success": True,
-                        "component_code": component_plan.get("component_code"),
+                        "component_code": component_code,
                         "component_name": component_name,
                         "assembly_steps": assembly_steps,
                         "raw_result": parsed
@@ -159,9 +178,13 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
                     # 找出未覆盖的BOM
                     all_bom_seqs = {str(i+1) for i in range(total_bom_count)}
                     uncovered_seqs = all_bom_seqs - covered_bom_seqs
-                    uncovered_bom_list = "\n".join([
-                        f"  - BOM序号{seq}: {parts_list[int(seq)-1].get('name', 'N/A')}"
+                    uncovered_parts = [
+                        {**parts_list[int(seq)-1], "seq": seq}
                         for seq in sorted(uncovered_seqs, key=int)
+                    ]
+                    uncovered_bom_list = "\n".join([
+                        f"  - BOM序号{part['seq']}: {part.get('name', 'N/A')}"
+                        for part in uncovered_parts
                     ])
 
                     print(f"  ⚠️ 有 {len(uncovered_seqs)} 个BOM未覆盖")
@@ -174,7 +197,7 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
                         print(uncovered_bom_list)
                         return {
                             "success": True,  # 仍然返回成功，但覆盖率不足
-                            "component_code": component_plan.get("component_code"),
+                            "component_code": component_code,
                             "component_name": component_name,
                             "assembly_steps": assembly_steps,
                             "raw_result": parsed,
@@ -184,7 +207,7 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
                 # 不检查覆盖率，直接返回
                 return {
                     "success": True,
-                    "component_code": component_plan.get("component_code"),
+                    "component_code": component_code,
                     "component_name": component_name,
                     "assembly_steps": assembly_steps,
                     "raw_result": parsed
@@ -199,6 +222,65 @@ class ComponentAssemblyAgent(BaseGeminiAgent):
             "assembly_steps": []
         }
     
+    def _fill_coverage_gaps(
+        self,
+        component_plan: Dict,
+        component_images: List[str],
+        assembly_steps: List[Dict],
+        uncovered_parts: List[Dict],
+        bom_to_mesh_mapping: Dict = None,
+        bom_mapping_table: List[Dict] = None
+    ) -> Optional[List[Dict]]:
+        """
+        增量补全BOM覆盖率：已有步骤只以紧凑形式作为上下文，模型只返回新增步骤
+
+        Returns:
+            插入新增步骤后的完整步骤列表；调用失败或没有可用的新增步骤时返回 None（回退为全量重新生成）
+        """
+        print(f"  🧩 增量补全 {len(uncovered_parts)} 个未覆盖的BOM项（保留已有 {len(assembly_steps)} 个步骤）")
+        system_prompt, user_query = build_component_gap_fill_prompt(
+            component_plan=component_plan,
+            existing_steps=assembly_steps,
+            missing_parts=uncovered_parts
+        )
+        result = self.call_gemini_with_retry(
+            system_prompt=system_prompt,
+            user_query=user_query,
+            images=component_images,
+            max_retries=3
+        )
+        if not result["success"]:
+            print(f"  ⚠️ 增量补全失败，改为重新生成全部步骤: {result.get('error')}")
+            return None
+
+        additions = result["result"].get("additional_steps")
+        if not isinstance(additions, list) or not additions:
+            print(f"  ⚠️ 增量补全没有返回新增步骤，改为重新生成全部步骤")
+            return None
+
+        additions = self._attach_mesh_ids(
+            [step for step in additions if isinstance(step, dict)], bom_to_mesh_mapping, bom_mapping_table
+        )
+        prefix = component_plan.get("component_code") or "component"
+        merged, report = splice_steps(assembly_steps, additions, prefix)
+        print(f"  ✅ 插入 {report['inserted']} 个新增步骤")
+        if report["unknown_anchors"]:
+            print(f"  ⚠️ 未知的插入位置（已追加到末尾）: {report['unknown_anchors']}")
+        return merged if report["inserted"] else None
+
+    def _attach_mesh_ids(
+        self,
+        assembly_steps: List[Dict],
+        bom_to_mesh_mapping: Dict = None,
+        bom_mapping_table: List[Dict] = None
+    ) -> List[Dict]:
+        """优先使用BOM映射宽表添加node_name，否则按BOM代号添加mesh_id"""
+        if bom_mapping_table:
+            return self._add_mesh_ids_from_table(assembly_steps, bom_mapping_table)
+        if bom_to_mesh_mapping:
+            return self._add_mesh_ids(assembly_steps, bom_to_mesh_mapping)
+        return assembly_steps
+
     def _add_mesh_ids_from_table(
         self,
         assembly_steps: List[Dict],
@@ -6,11 +6,14 @@ FAQ
 
 from typing import Dict, List
 from agents.base_gemini_agent import BaseGeminiAgent
+from core.step_delta import ensure_step_ids, merge_step_deltas
 from prompts.agent_6_safety_faq import build_safety_faq_prompt
 
 
 class SafetyFAQAgent(BaseGeminiAgent):
     """FAQ"""
+
+    stream_fields = ("safety_additions",)
     
     def __init__(self, api_key: str = None):
         super().__init__(
@@ -26,6 +29,9 @@ class SafetyFAQAgent(BaseGeminiAgent):
         """
         新逻辑：为每个装配步骤添加安全警告和FAQ（如果该步骤有安全风险）
 
+        模型只返回 safety_additions（按 step_id 的安全警告），
+        在本地合并到原步骤；未知 step_id 的记录会被拒绝。
+
         Args:
             assembly_steps: Agent 5增强后的装配步骤（已包含焊接信息）
 
@@ -33,31 +39,37 @@ class SafetyFAQAgent(BaseGeminiAgent):
             {
                 "success": bool,
                 "enhanced_steps": [...],  # 增强后的装配步骤（包含安全警告）
-                "faq_items": [...]        # 全局FAQ列表
+                "faq_items": [...],       # 全局FAQ列表
+                "rejected_step_ids": [...]  # 模型返回但不存在的 step_id
             }
         """
+        assembly_steps = ensure_step_ids(assembly_steps, "step")
         print(f"\n{'='*80}")
         print(f"  Agent 6: 安全专家 - 为装配步骤添加安全警告和FAQ")
         print(f"{'='*80}")
         print(f" 📋 装配步骤数量: {len(assembly_steps)}")
 
-        # 构建prompt
-        system_prompt, user_query = build_safety_faq_prompt(
-            assembly_steps=assembly_steps
-        )
-
-        # 调用Gemini
-        result = self.call_gemini(
-            system_prompt=system_prompt,
-            user_query=user_query,
+        # 调用Gemini（步骤过多超出token预算时按步骤分批，各批的增量按step_id合并）
+        result = self.call_gemini_chunked(
+            items=assembly_steps,
+            build_prompt=build_safety_faq_prompt,
+            list_fields=("safety_additions", "faq_items"),
             images=None
         )
 
         if result["success"]:
             parsed = result["result"]
 
-            # 获取增强后的步骤和FAQ
-            enhanced_steps = parsed.get("enhanced_steps", [])
+            # 合并增量（safety_additions）到原步骤
+            enhanced_steps, merge_report = merge_step_deltas(
+                assembly_steps,
+                parsed.get("safety_additions", []),
+                field="safety_warnings",
+                validate=lambda value: isinstance(value, list) and all(isinstance(w, str) for w in value)
+            )
+            rejected_step_ids = merge_report["unknown_step_ids"] + merge_report["invalid_step_ids"]
+            if rejected_step_ids:
+                print(f" ⚠️ 已拒绝 {len(rejected_step_ids)} 条无效安全记录: {rejected_step_ids}")
             faq_items = parsed.get("faq_items", [])
 
             # 统计有安全警告的步骤数量
@@ -91,6 +103,7 @@ class SafetyFAQAgent(BaseGeminiAgent):
                 "safety_steps_count": safety_steps_count,
                 "coverage_rate": coverage_rate,
                 "total_warnings": total_warnings,
+                "rejected_step_ids": rejected_step_ids,
                 "raw_result": parsed
             }
         else:
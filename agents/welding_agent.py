@@ -6,11 +6,14 @@ Agent 5:
 
 from typing import Dict, List
 from agents.base_gemini_agent import BaseGeminiAgent
+from core.step_delta import ensure_step_ids, merge_step_deltas
 from prompts.agent_5_welding import build_welding_prompt
 
 
 class WeldingAgent(BaseGeminiAgent):
     """"""
+
+    stream_fields = ("welding_additions",)
     
     def __init__(self, api_key: str = None):
         super().__init__(
@@ -27,6 +30,9 @@ class WeldingAgent(BaseGeminiAgent):
         """
         新逻辑：为每个装配步骤添加焊接要点（如果该步骤涉及焊接）
 
+        模型只返回 welding_additions（按 step_id 的焊接信息），
+        在本地合并到原步骤；未知 step_id 的记录会被拒绝。
+
         Args:
             all_images: PDF图纸列表
             assembly_steps: Agent 3或Agent 4生成的装配步骤
@@ -34,30 +40,38 @@ class WeldingAgent(BaseGeminiAgent):
         Returns:
             {
                 "success": bool,
-                "enhanced_steps": [...]  # 增强后的装配步骤（包含焊接信息）
+                "enhanced_steps": [...],  # 增强后的装配步骤（包含焊接信息）
+                "rejected_step_ids": [...]  # 模型返回但不存在的 step_id
             }
         """
+        assembly_steps = ensure_step_ids(assembly_steps, "step")
         print(f"\n{'='*80}")
         print(f" Agent 5: 焊接工艺专家 - 为装配步骤添加焊接要点")
         print(f"{'='*80}")
         print(f" 📷 图纸数量: {len(all_images)}")
         print(f" 📋 装配步骤数量: {len(assembly_steps)}")
 
-        # 构建prompt
-        system_prompt, user_query = build_welding_prompt(assembly_steps)
-
-        # 调用Gemini
-        result = self.call_gemini(
-            system_prompt=system_prompt,
-            user_query=user_query,
+        # 调用Gemini（步骤过多超出token预算时按步骤分批，各批的增量按step_id合并）
+        result = self.call_gemini_chunked(
+            items=assembly_steps,
+            build_prompt=build_welding_prompt,
+            list_fields=("welding_additions",),
             images=all_images
         )
 
         if result["success"]:
             parsed = result["result"]
 
-            # 获取增强后的步骤
-            enhanced_steps = parsed.get("enhanced_steps", [])
+            # 合并增量（welding_additions）到原步骤
+            enhanced_steps, merge_report = merge_step_deltas(
+                assembly_steps,
+                parsed.get("welding_additions", []),
+                field="welding",
+                validate=lambda value: isinstance(value, dict)
+            )
+            rejected_step_ids = merge_report["unknown_step_ids"] + merge_report["invalid_step_ids"]
+            if rejected_step_ids:
+                print(f" ⚠️ 已拒绝 {len(rejected_step_ids)} 条无效焊接记录: {rejected_step_ids}")
 
             # 统计焊接步骤数量
             welding_steps_count = sum(
@@ -90,6 +104,7 @@ class WeldingAgent(BaseGeminiAgent):
                 "welding_steps_count": welding_steps_count,
                 "coverage_rate": coverage_rate,
                 "total_welding_points": total_welding_points,
+                "rejected_step_ids": rejected_step_ids,
                 "raw_result": parsed
             }
         else:
@@ -54,6 +54,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("shutdown")
+def close_llm_clients():
+    """关闭共享的LLM客户端连接池"""
+    from core.llm_client import close_openai_clients
+    close_openai_clients()
+
+@app.on_event("startup")
+def start_tessellation_workers():
+    """预启动STEP转换子进程，首个任务无需等待 trimesh/cascadio 导入"""
+    from processors.step_tessellation import prestart_workers
+    prestart_workers()
+
+@app.on_event("shutdown")
+def stop_tessellation_workers():
+    """停止STEP转换调度线程与常驻子进程"""
+    from processors.step_tessellation import shutdown_tessellation
+    shutdown_tessellation()
+
 # ============ 健康检查端点 ============
 @app.get("/api/health")
 async def health_check():
@@ -85,6 +103,8 @@ class GenerationRequest(BaseModel):
     config: GenerationConfig
     pdf_files: List[str]
     model_files: List[str]
+    resume_from: Optional[int] = None  # 重跑已有任务：从第N步(1-8)开始，之前的步骤复用检查点
+    use_llm_cache: bool = True  # False 时本任务不读写LLM响应缓存
 
 # 版本管理请求模型
 class SaveDraftRequest(BaseModel):
@@ -299,9 +319,15 @@ async def generate_manual(request: GenerationRequest):
     task_id = pdf_base
     task_dir = OUTPUT_DIR / task_id
 
-    # 防止同名任务覆盖已有输出
-    if task_dir.exists():
-        raise HTTPException(status_code=400, detail=f"任务 {task_id} 已存在，请更换 PDF 文件名或清理旧任务后再试")
+    resume_from = request.resume_from
+    if resume_from is not None and not 1 <= resume_from <= 8:
+        raise HTTPException(status_code=400, detail="resume_from 必须在 1-8 之间")
+
+    # 防止同名任务覆盖已有输出（指定 resume_from 时在原任务目录上重跑）
+    if task_dir.exists() and resume_from is None:
+        raise HTTPException(status_code=400, detail=f"任务 {task_id} 已存在，请更换 PDF 文件名、清理旧任务或指定 resume_from 重跑")
+    if tasks.get(task_id, {}).get("status") == "processing":
+        raise HTTPException(status_code=409, detail=f"任务 {task_id} 正在处理中")
 
     try:
         # 创建任务目录
@@ -348,6 +374,10 @@ async def generate_manual(request: GenerationRequest):
 
         # 直接调用gemini_pipeline（在后台线程中）
         import threading
+        from utils.logger import begin_task_run
+
+        # ✅ 登记本次运行：resume 重跑复用 task_id，上一次运行的延迟清理不能删除本次的事件缓冲区
+        run_token = begin_task_run(task_id)
 
         def run_pipeline():
             try:
@@ -378,13 +408,15 @@ async def generate_manual(request: GenerationRequest):
                     api_key=api_key,
                     output_dir=str(task_dir),
                     product_name=product_name,  # ✅ 传入产品名称
-                    model_name=model_name  # ✅ 传入模型名称
+                    model_name=model_name,  # ✅ 传入模型名称
+                    use_llm_cache=request.use_llm_cache
                 )
 
                 # 运行pipeline
                 result = pipeline.run(
                     pdf_dir=str(pdf_dir),
-                    step_dir=str(step_dir)
+                    step_dir=str(step_dir),
+                    resume_from=resume_from
                 )
 
                 # 更新任务状态（区分成功/失败）
@@ -402,6 +434,12 @@ async def generate_manual(request: GenerationRequest):
                 tasks[task_id]["status"] = "failed"
                 tasks[task_id]["error"] = str(e)
                 tasks[task_id]["updated_at"] = beijing_now()
+            finally:
+                # ✅ 留出时间让已连接的 SSE/WebSocket 推送完剩余事件，再释放事件缓冲区
+                from utils.logger import clear_task_events
+                cleanup = threading.Timer(60, clear_task_events, args=(task_id, run_token))
+                cleanup.daemon = True
+                cleanup.start()
 
         # 在后台线程中运行
         thread = threading.Thread(target=run_pipeline)
@@ -411,7 +449,8 @@ async def generate_manual(request: GenerationRequest):
             "success": True,
             "task_id": task_id,
             "status": "processing",
-            "message": "任务已启动"
+            "resume_from": resume_from,
+            "message": "任务已启动" if resume_from is None else f"任务已启动（从第 {resume_from} 步重跑）"
         }
 
     except Exception as e:
@@ -432,13 +471,14 @@ async def stream_task_logs(task_id: str):
         """生成 SSE 事件"""
         try:
             # ✅ 导入日志获取函数
-            from utils.logger import get_task_logs
+            from utils.logger import get_task_events, get_task_logs
 
             # 发送初始连接消息
             yield f"data: {json.dumps({'type': 'connected', 'task_id': task_id, 'message': '已连接到任务流'})}\n\n"
 
             last_status = None
             last_log_count = 0
+            last_event_seq = 0
 
             while True:
                 if task_id in tasks:
@@ -453,6 +493,11 @@ async def stream_task_logs(task_id: str):
                             yield f"data: {json.dumps({'type': 'log', 'task_id': task_id, 'message': log})}\n\n"
                         last_log_count = len(logs)
 
+                    # ✅ 推送流式生成的步骤等结构化事件
+                    for event in get_task_events(task_id, after_seq=last_event_seq):
+                        yield f"data: {json.dumps({**event, 'task_id': task_id}, ensure_ascii=False)}\n\n"
+                        last_event_seq = event["seq"]
+
                     # 发送进度更新
                     yield f"data: {json.dumps({'type': 'progress', 'task_id': task_id, 'progress': task.get('progress', 0), 'status': current_status})}\n\n"
 
@@ -501,6 +546,9 @@ async def websocket_endpoint(websocket: WebSocket, task_id: str):
             "timestamp": beijing_now().isoformat()
         })
 
+        from utils.logger import get_task_events
+        last_event_seq = 0
+
         # 保持连接并监听任务状态变化
         while True:
             try:
@@ -508,6 +556,11 @@ async def websocket_endpoint(websocket: WebSocket, task_id: str):
                 if task_id in tasks:
                     task = tasks[task_id]
 
+                    # 推送流式生成的步骤等结构化事件
+                    for event in get_task_events(task_id, after_seq=last_event_seq):
+                        await websocket.send_json({**event, "task_id": task_id, "timestamp": beijing_now().isoformat()})
+                        last_event_seq = event["seq"]
+
                     # 发送进度更新
                     await websocket.send_json({
                         "type": "progress",
@@ -1127,26 +1180,22 @@ class TestModelRequest(BaseModel):
 async def test_model(request: TestModelRequest):
     """测试模型连接"""
     try:
-        from openai import OpenAI
-
-        # 创建OpenAI客户端（OpenRouter兼容）
-        client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=request.openrouter_api_key
-        )
-
-        # 发送测试请求
-        completion = client.chat.completions.create(
-            extra_headers={
-                "HTTP-Referer": "https://mecagent.com",
-                "X-Title": "MecAgent Model Test"
-            },
-            model=request.model,
-            messages=[
-                {"role": "user", "content": "Hello, this is a test message. Please respond with 'OK'."}
-            ],
-            max_tokens=10
-        )
+        from core.llm_client import scoped_openai_client
+
+        # 请求中传入的密钥只用于本次测试：使用一次性客户端，结束后关闭连接池
+        with scoped_openai_client(request.openrouter_api_key) as client:
+            # 发送测试请求
+            completion = client.chat.completions.create(
+                extra_headers={
+                    "HTTP-Referer": "https://mecagent.com",
+                    "X-Title": "MecAgent Model Test"
+                },
+                model=request.model,
+                messages=[
+                    {"role": "user", "content": "Hello, this is a test message. Please respond with 'OK'."}
+                ],
+                max_tokens=10
+            )
 
         response_text = completion.choices[0].message.content
 
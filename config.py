@@ -18,6 +18,12 @@ API_CONFIG = {
         "base_url": "https://openrouter.ai/api/v1",
         "default_model": "google/gemini-2.5-flash-preview-09-2025",  # 默认模型
         "timeout": 300,  # 5分钟超时
+        "connect_timeout": float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10")),
+        # 共享连接池（所有Agent/任务复用，保持keep-alive避免重复TLS握手）
+        "pool_max_connections": int(os.getenv("OPENROUTER_POOL_MAX_CONNECTIONS", "32")),
+        "pool_max_keepalive": int(os.getenv("OPENROUTER_POOL_MAX_KEEPALIVE", "16")),
+        "keepalive_expiry": float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", "60")),
+        "sdk_max_retries": 0,  # 关闭 openai SDK 内置重试，统一由 core.llm_retry.RetryPolicy 处理
         "temperature": 0.1,  # 降低随机性
         "max_tokens": 8000,
     }
@@ -182,6 +188,16 @@ CACHE_CONFIG = {
     "directory": PROJECT_ROOT / ".cache",
     "max_size": 1024 * 1024 * 1024,  # 1GB
     "ttl": 24 * 3600,  # 24小时
+    # LLM响应缓存（相同模型/提示词/图片的请求直接复用上次结果）
+    "llm_responses_enable": os.getenv("LLM_CACHE", "true").lower() == "true",
+    "llm_responses_max_size": int(os.getenv("LLM_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),  # 512MB
+    # PDF页面渲染缓存（按PDF内容哈希/页码/DPI/格式，文件分类、BOM提取、视觉解析共用）
+    "page_renders_max_size": int(os.getenv("PAGE_RENDER_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))),  # 1GB
+    # 图片base64载荷的内存缓存上限
+    "image_payload_max_size": int(os.getenv("IMAGE_PAYLOAD_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),  # 256MB
+    # STEP→GLB转换缓存（按STEP内容哈希/缩放因子/转换器版本，命中时硬链接或复制到任务的glb_files）
+    "glb_conversions_enable": os.getenv("GLB_CACHE", "true").lower() == "true",
+    "glb_conversions_max_size": int(os.getenv("GLB_CACHE_MAX_BYTES", str(4 * 1024 * 1024 * 1024))),  # 4GB
 }
 
 # 安全配置
@@ -196,6 +212,73 @@ PERFORMANCE_CONFIG = {
     "max_concurrent_jobs": 2,  # 最大并发任务数
     "memory_limit": "8G",  # 内存限制
     "temp_cleanup": True,  # 自动清理临时文件
+    # 工作流阶段并发线程数（PDF支路与3D支路并发执行）
+    "pipeline_stage_workers": int(os.getenv("PIPELINE_STAGE_WORKERS", "3")),
+    # 步骤5中同时调用Agent 3的组件数
+    "component_agent_concurrency": int(os.getenv("COMPONENT_AGENT_CONCURRENCY", "4")),
+    # 步骤7焊接/安全增强方式：parallel（两个Agent基于同一批步骤并发，按step_id合并）
+    # 或 chained（安全Agent读取焊接增强后的步骤，旧行为）
+    "welding_safety_mode": os.getenv("WELDING_SAFETY_MODE", "parallel").lower(),
+    # LLM请求限流（进程级，所有任务共享）：令牌桶 + 根据429/5xx/首个分片延迟自适应的并发上限
+    "llm_requests_per_second": float(os.getenv("LLM_REQUESTS_PER_SECOND", "4")),
+    "llm_burst": int(os.getenv("LLM_BURST", "8")),
+    "llm_initial_concurrency": int(os.getenv("LLM_INITIAL_CONCURRENCY", "8")),
+    "llm_min_concurrency": int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+    "llm_max_concurrency": int(os.getenv("LLM_MAX_CONCURRENCY", "24")),
+    "llm_first_token_target": float(os.getenv("LLM_FIRST_TOKEN_TARGET", "30")),  # 秒，流式调用首个分片的等待上限
+    # LLM重试：指数退避 + 全抖动（遵循Retry-After）；按模型熔断
+    "llm_retry_max_attempts": int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3")),
+    "llm_retry_base_delay": float(os.getenv("LLM_RETRY_BASE_DELAY", "1")),
+    "llm_retry_max_delay": float(os.getenv("LLM_RETRY_MAX_DELAY", "30")),
+    "llm_breaker_failure_threshold": int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5")),
+    "llm_breaker_reset_timeout": float(os.getenv("LLM_BREAKER_RESET_TIMEOUT", "60")),
+    # PDF页面光栅化进程数（0 = min(CPU核数, 8)，1 = 在当前进程串行渲染）
+    "pdf_render_workers": int(os.getenv("PDF_RENDER_WORKERS", "0")),
+    # 待渲染页数不超过该值时不启用进程池（避免进程间通信开销大于渲染本身）
+    "pdf_render_min_parallel_pages": int(os.getenv("PDF_RENDER_MIN_PARALLEL_PAGES", "2")),
+    # BOM提取优先读取PDF文字层（本地解析），只有无法确定的页面/行才调用视觉模型
+    "bom_text_extraction": os.getenv("BOM_TEXT_EXTRACTION", "true").lower() == "true",
+    # 本地解析的行置信度低于该值时交给视觉模型补全
+    "bom_text_min_confidence": float(os.getenv("BOM_TEXT_MIN_CONFIDENCE", "0.7")),
+    # 页面分诊：本地给页面打标签（BOM/装配视图/详图/标题栏），跳过不含BOM的页面的视觉调用，
+    # 并让装配/焊接Agent只接收相关页面
+    "page_triage": os.getenv("PAGE_TRIAGE", "true").lower() == "true",
+    # BOM视觉提取时只发送定位到的BOM表区域（失败时发送整页），裁剪图长边的目标像素数
+    "bom_crop_enable": os.getenv("BOM_CROP_ENABLE", "true").lower() == "true",
+    "bom_crop_target_pixels": int(os.getenv("BOM_CROP_TARGET_PIXELS", "2400")),
+    # Agent 调用使用流式输出：步骤边生成边推送到任务日志/WebSocket，响应格式明显错误时提前中止并重试
+    "llm_streaming": os.getenv("LLM_STREAMING", "true").lower() == "true",
+    # Agent 请求结构化输出：json_object（要求输出JSON对象）/ json_schema（Agent 声明了 schema 时按其约束）/ off
+    # 模型拒绝 response_format 时自动去掉该参数重试
+    "llm_response_format": os.getenv("LLM_RESPONSE_FORMAT", "json_object").lower(),
+    # 提示词前缀缓存断点（cache_control）：auto（只对需要显式标注的 Anthropic/Gemini 模型）/ always / off
+    # 各Agent的 system 提示词为逐字节不变的静态前缀，可变数据都在用户消息中
+    "llm_prompt_cache": os.getenv("LLM_PROMPT_CACHE", "auto").lower(),
+    # Agent 3 BOM覆盖率不足时的重试方式：incremental（只为缺失零件生成新增步骤并插入）
+    # 或 regenerate（带反馈重新生成全部步骤，旧行为）
+    "coverage_repair_mode": os.getenv("COVERAGE_REPAIR_MODE", "incremental").lower(),
+    # 发送给视觉模型的图片预处理：线稿转灰度/调色板，限制长边，按体积选择 PNG-8 或 JPEG
+    "image_optimize": os.getenv("IMAGE_OPTIMIZE", "true").lower() == "true",
+    "image_max_long_edge": int(os.getenv("IMAGE_MAX_LONG_EDGE", "2048")),  # 0 = 不缩放
+    "image_line_drawing_mode": os.getenv("IMAGE_LINE_DRAWING_MODE", "true").lower() == "true",
+    "image_palette_colors": int(os.getenv("IMAGE_PALETTE_COLORS", "16")),
+    "image_jpeg_quality": int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+    # 提示词输入token预算：超出时可拆分的工作（焊接/安全步骤、AI匹配零件）分批发送，不截断
+    "prompt_token_budget": int(os.getenv("PROMPT_TOKEN_BUDGET", "48000")),
+    # 估算时每张图片按多少token计
+    "prompt_image_tokens": int(os.getenv("PROMPT_IMAGE_TOKENS", "1300")),
+    # BOM视觉提取时同时分析的页数
+    "bom_vision_page_concurrency": int(os.getenv("BOM_VISION_PAGE_CONCURRENCY", "4")),
+    # STEP→GLB网格化：全部STEP同时提交，每个转换在独立子进程中执行（崩溃/超时/超内存只影响该文件）
+    "step_tessellation_isolated": os.getenv("STEP_TESSELLATION_ISOLATED", "true").lower() == "true",
+    "step_tessellation_workers": int(os.getenv("STEP_TESSELLATION_WORKERS", "0")),  # 0 = min(CPU核数, 4)
+    "step_tessellation_timeout": float(os.getenv("STEP_TESSELLATION_TIMEOUT", "900")),  # 秒
+    "step_tessellation_memory_mb": int(os.getenv("STEP_TESSELLATION_MEMORY_MB", "8192")),  # 子进程地址空间上限，0 = 不限制
+    # 服务启动时预启动转换子进程（已导入 trimesh/cascadio）；每个子进程处理若干任务后回收
+    "step_tessellation_prefork": os.getenv("STEP_TESSELLATION_PREFORK", "true").lower() == "true",
+    "step_tessellation_worker_max_jobs": int(os.getenv("STEP_TESSELLATION_WORKER_MAX_JOBS", "20")),
+    # 阶段检查点：输入指纹未变化时复用已有产物（output_dir/checkpoints）
+    "stage_checkpoints": os.getenv("STAGE_CHECKPOINTS", "true").lower() == "true",
 }
 
 # 开发配置
@@ -3,13 +3,20 @@ AI智能匹配器
 用于处理代码匹配失败的零件
 """
 
-import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
-from openai import OpenAI
 import sys
 import os
 from utils.time_utils import beijing_now
+from core.llm_cache import cached_chat_completion
+from core.llm_client import get_openai_client
+from core.llm_retry import RetryPolicy, classify_error, retry_after_seconds
+from core.prompt_cache import system_message
+from core.prompt_budget import estimate_tokens, get_token_usage_log, split_to_budget, warn_if_over_budget
+from core.structured_output import parse_json_tolerant
+from utils.logger import bind_task_context
+from config import PERFORMANCE_CONFIG
 
 # 添加项目根目录到路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -17,7 +24,6 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # 导入提示词
 from prompts.agent_2_bom_3d_matching import (
     build_ai_matching_prompt,
-    AI_MATCHING_SYSTEM_PROMPT
 )
 
 
@@ -30,10 +36,7 @@ class AIBOMMatcher:
         if not self.api_key:
             raise ValueError("需要设置OPENROUTER_API_KEY环境变量或传入api_key参数")
 
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://openrouter.ai/api/v1"
-        )
+        self.client = get_openai_client(self.api_key)
         self.model = "google/gemini-2.5-flash-preview-09-2025"  # 和其他agent使用相同的模型
         # 记录任务ID用于调试文件命名
         self.task_id = task_id or os.getenv("TASK_ID", "unknown_task")
@@ -41,6 +44,7 @@ class AIBOMMatcher:
         self.batch_threshold = 200  # 超过这个数量的未匹配3D零件就分批
         self.batch_size = 100       # 单批上限
         self.min_batch_size = 20    # 截断重试时的最小批大小（避免无限拆分）
+        self.batch_concurrency = 4  # 同时请求的批数（总并发另受进程级限流器约束）
     
     def match_unmatched_parts(
         self,
@@ -144,47 +148,67 @@ class AIBOMMatcher:
         # 使用提示词文件构建prompt
         system_prompt, user_query = build_ai_matching_prompt(parts, unmatched_bom)
 
+        # 超出token预算时按零件分批（BOM全部保留，不截断）
+        estimated_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_query)
+        budget = PERFORMANCE_CONFIG["prompt_token_budget"]
+        if estimated_tokens > budget and len(parts) > 1:
+            base_tokens = estimate_tokens(system_prompt) + estimate_tokens(build_ai_matching_prompt([], unmatched_bom)[1])
+            if base_tokens < budget:
+                batches = split_to_budget(
+                    parts, lambda batch: system_prompt + build_ai_matching_prompt(batch, unmatched_bom)[1], budget
+                )
+                print(f"      🧮 估算输入 {estimated_tokens} tokens 超过预算 {budget}，按零件拆分为 {len(batches)} 批")
+                results: List[Dict] = []
+                for batch_no, batch_parts in enumerate(batches, start=1):
+                    results.extend(self._match_all_at_once(
+                        batch_parts, bom_data, safe_task, ts_str, f"{batch_label or '1'}-t{batch_no}", allow_split=allow_split
+                    ))
+                return results
+            warn_if_over_budget("AI匹配", estimated_tokens, budget)
+
         print(f"      🤖 他开始调用Gemini 2.5 Flash进行深度分析...")
         print(f"      ⏱️  请稍候，Gemini速度很快...")
         sys.stdout.flush()
 
-        # 调用AI（带重试机制）
-        max_retries = 3
-        retry_delay = 5  # 秒
+        # 调用AI（带重试机制：指数退避 + 抖动，参数/鉴权错误和熔断不重试）
+        policy = RetryPolicy.from_config()
 
         try:
             import time
             start_time = time.time()
 
-            last_error = None
-            for attempt in range(max_retries):
+            for attempt in range(policy.max_attempts):
                 try:
                     if attempt > 0:
                         print(f"      🔄 第 {attempt + 1} 次重试...")
-                        time.sleep(retry_delay)
 
-                    response = self.client.chat.completions.create(
+                    response = cached_chat_completion(
+                        self.client,
                         model=self.model,  # 使用Gemini 2.5 Flash
                         messages=[
-                            {"role": "system", "content": system_prompt},
+                            system_message(system_prompt, self.model),
                             {"role": "user", "content": user_query}
                         ],
                         temperature=0.4,  # ✅ 提高到0.4，使用COT推理，追求100%匹配率
+                        validate=lambda text: bool(self._parse_response(text)),  # 解析不出结果的响应不缓存
                         # ✅ 不限制max_tokens，Gemini 2.5 Flash支持65.5K输出（COT需要更多token）
                         stream=False,
                         timeout=120  # ✅ 增加超时时间到120秒
                     )
                     break  # 成功则跳出重试循环
                 except Exception as retry_error:
-                    last_error = retry_error
-                    print(f"      ⚠️  请求失败 (尝试 {attempt + 1}/{max_retries}): {retry_error}")
-                    if attempt == max_retries - 1:
-                        raise last_error  # 最后一次重试也失败，抛出异常
+                    error_kind = classify_error(retry_error)
+                    print(f"      ⚠️  请求失败 (尝试 {attempt + 1}/{policy.max_attempts}, {error_kind}): {retry_error}")
+                    if not policy.should_retry(attempt, error_kind):
+                        raise  # 不可重试或已达上限，抛出异常
+                    delay = policy.delay(attempt, retry_after_seconds(retry_error))
+                    print(f"      ⏳ 等待 {delay:.1f} 秒后重试...")
+                    time.sleep(delay)
 
             elapsed = time.time() - start_time
-            choice = response.choices[0]
-            result_text = choice.message.content
-            finish_reason = getattr(choice, "finish_reason", None)
+            get_token_usage_log().record("AI匹配", estimated_tokens, response.usage)
+            result_text = response.content
+            finish_reason = response.finish_reason
 
             print(f"      📊 AI大脑返回了分析结果 ({len(result_text)} 字符, 耗时: {elapsed:.1f}秒, finish_reason={finish_reason})")
             import sys
@@ -210,6 +234,21 @@ class AIBOMMatcher:
             elif len(ai_results) < len(parts) and finish_reason and finish_reason != "stop":
                 truncated = True
 
+            if truncated and ai_results:
+                # 截断前的完整匹配项直接采用，只为没有结果的零件重新请求
+                answered = {r.get('node_name') for r in ai_results} | {r.get('geometry_name') for r in ai_results}
+                answered.discard(None)
+                done = [p for p in parts if p.get('node_name') in answered or p.get('geometry_name') in answered]
+                remaining = [p for p in parts if p not in done]
+                if done and remaining:
+                    print(f"      ♻️  保留截断前的 {len(done)} 个匹配结果，只重新请求剩余 {len(remaining)} 个零件")
+                    rest_results = self._match_all_at_once(
+                        remaining, bom_data, safe_task, ts_str, f"{batch_label or '1'}-r", allow_split=allow_split
+                    )
+                    return self._map_ai_results(done, ai_results) + rest_results
+                if done:
+                    truncated = False
+
             if truncated and allow_split and len(parts) > self.min_batch_size:
                 print(f"      ⚠️  检测到响应可能被截断，拆分本批继续处理（批次: {batch_label or '全量'}）")
                 mid = len(parts) // 2 or 1
@@ -263,24 +302,31 @@ class AIBOMMatcher:
         safe_task: str,
         ts_str: str
     ) -> List[Dict]:
-        """分批处理未匹配零件，防止单次响应过长被截断"""
-        results: List[Dict] = []
-        batch_no = 0
+        """分批处理未匹配零件，防止单次响应过长被截断（各批并发请求，结果按批次顺序合并）"""
         total_parts = len(parts)
-        for start in range(0, total_parts, self.batch_size):
-            batch_no += 1
+        batches = []
+        for batch_no, start in enumerate(range(0, total_parts, self.batch_size), start=1):
             end = min(start + self.batch_size, total_parts)
-            batch_parts = parts[start:end]
-            print(f"\n   📦 正在处理批次 {batch_no}: {len(batch_parts)} 个零件（范围 {start+1}-{end}/{total_parts}）")
-            batch_results = self._match_all_at_once(
-                batch_parts,
-                bom_data,
-                safe_task,
-                ts_str,
-                batch_label=str(batch_no),
-                allow_split=True
-            )
-            results.extend(batch_results)
+            batches.append((batch_no, parts[start:end]))
+            print(f"\n   📦 批次 {batch_no}: {end - start} 个零件（范围 {start+1}-{end}/{total_parts}）")
+
+        with ThreadPoolExecutor(max_workers=min(self.batch_concurrency, len(batches)) or 1,
+                                thread_name_prefix="ai-match") as executor:
+            futures = [
+                executor.submit(
+                    bind_task_context(self._match_all_at_once),
+                    batch_parts,
+                    bom_data,
+                    safe_task,
+                    ts_str,
+                    batch_label=str(batch_no),
+                    allow_split=True
+                )
+                for batch_no, batch_parts in batches
+            ]
+            results: List[Dict] = []
+            for future in futures:
+                results.extend(future.result())
         return results
 
     def _map_ai_results(self, parts: List[Dict], ai_results: List[Dict]) -> List[Dict]:
@@ -338,124 +384,30 @@ class AIBOMMatcher:
             for p in parts
         ]
     
-    def _build_prompt(self, parts: List[Dict], bom_data: List[Dict]) -> str:
-        """构建AI匹配的prompt"""
-        
-        # 限制BOM表大小（只发送前100项）
-        bom_sample = bom_data[:100] if len(bom_data) > 100 else bom_data
-        
-        prompt = f"""你是一个BOM-3D零件匹配专家。你的任务是将3D模型中的零件名称与BOM表中的项目进行匹配。
-
-## 背景
-- 3D零件名称可能有编码问题（乱码），但你可以通过产品代号、规格、关键词等线索进行匹配
-- BOM表包含：代号（code）、产品代号（product_code）、名称（name）等信息
-- 匹配依据：产品代号（优先）、规格（如M16、φ40等）、零件类型（螺栓、垫圈、方形板等）
-
-## BOM表（{len(bom_data)}项，显示前{len(bom_sample)}项）
-```json
-{json.dumps(bom_sample, ensure_ascii=False, indent=2)[:2000]}
-...
-```
-
-## 未匹配的3D零件（{len(parts)}个）
-```json
-{json.dumps([{'fixed_name': p['fixed_name'], 'geometry_name': p['geometry_name']} for p in parts], ensure_ascii=False, indent=2)}
-```
-
-## 匹配规则
-1. **优先匹配产品代号**：如果3D零件名称中包含产品代号（如T-SPV1830-EURO-09），优先匹配
-2. **规格匹配**：对于标准件（螺栓、垫圈等），通过规格（M16、φ40等）匹配
-3. **关键词匹配**：通过零件类型关键词（方形板、垫圈、螺栓等）辅助匹配
-4. **无法匹配**：如果BOM表中确实没有对应项，返回null
-
-## 输出格式
-返回JSON数组，每个元素包含：
-- geometry_name: 3D零件的原始名称（必须与输入完全一致）
-- bom_code: 匹配到的BOM代号（如"01.09.2556"），如果无法匹配则为null
-- confidence: 匹配置信度（0-1）
-- reasoning: 匹配理由（简短说明）
-
-请只返回JSON数组，不要其他解释。
-
-示例输出：
-[
-  {
-    "geometry_name": "T-SPV1830-EURO-09-Q235",
-    "bom_code": "01.09.2556",
-    "confidence": 0.95,
-    "reasoning": "产品代号完全匹配"
-  },
-  {
-    "geometry_name": "M16x60-GB/T5782-2000",
-    "bom_code": "02.03.0088",
-    "confidence": 0.85,
-    "reasoning": "规格M16匹配"
-  }
-]
-"""
-        return prompt
-    
     def _parse_response(self, response_text: str) -> List[Dict]:
-        """解析AI响应（参考dual_channel_parser的成熟方案）"""
-
-        # 移除markdown代码块标记（参考dual_channel_parser）
-        content = response_text.strip()
-
-        if content.startswith('```json'):
-            content = content[7:]  # 移除 ```json
-
-        if content.startswith('```'):
-            content = content[3:]  # 移除 ```
-
-        if content.endswith('```'):
-            content = content[:-3]  # 移除结尾的 ```
-
-        content = content.strip()
-
-        # 查找JSON的开始和结束
-        json_start = content.find('{')
-        json_end = content.rfind('}') + 1
-
-        if json_start >= 0 and json_end > json_start:
-            json_str = content[json_start:json_end]
-
-            # ✅ 自动修复常见的JSON格式错误
-            # 1. 移除数组/对象最后一个元素后的逗号（如 },\n] 或 },\n}）
-            json_str = re.sub(r',(\s*[\]}])', r'\1', json_str)
-
-            # 2. 移除控制字符
-            json_str = ''.join(char for char in json_str if ord(char) >= 32 or char in '\n\r\t')
-
-            # 尝试解析JSON
-            try:
-                parsed_result = json.loads(json_str)
-                print(f"      ✅ JSON解析成功")
-
-                # 如果返回的是对象，提取ai_matched_pairs字段
-                if isinstance(parsed_result, dict):
-                    if 'ai_matched_pairs' in parsed_result:
-                        return parsed_result['ai_matched_pairs']
-                    else:
-                        print(f"      ⚠️  JSON格式错误：缺少'ai_matched_pairs'字段")
-                        return []
-                # 如果直接返回数组
-                elif isinstance(parsed_result, list):
-                    return parsed_result
-                else:
-                    print(f"      ⚠️  JSON格式错误：期望对象或数组，得到 {type(parsed_result)}")
-                    return []
-
-            except json.JSONDecodeError as e:
-                error_msg = f"JSON解析失败: line {e.lineno} column {e.colno} (char {e.pos})"
-                print(f"      ⚠️  {error_msg}")
-                return []
-            except Exception as e:
-                print(f"      ⚠️  解析错误: {e}")
-                return []
+        """解析AI响应（容错：代码块/多余文字/尾逗号；截断时保留完整的匹配项）"""
+        parse = parse_json_tolerant(response_text)
+        if not parse.ok:
+            print(f"      ⚠️  {parse.error}")
+            return []
+        if parse.truncated:
+            print(f"      ⚠️  {parse.summary()}")
         else:
-            print(f"      ⚠️  未找到有效的JSON数据")
+            print(f"      ✅ JSON解析成功")
+
+        parsed_result = parse.value
+        # 如果返回的是对象，提取ai_matched_pairs字段
+        if isinstance(parsed_result, dict):
+            if 'ai_matched_pairs' in parsed_result:
+                return parsed_result['ai_matched_pairs']
+            print(f"      ⚠️  JSON格式错误：缺少'ai_matched_pairs'字段")
             return []
-    
+        # 如果直接返回数组
+        if isinstance(parsed_result, list):
+            return [item for item in parsed_result if isinstance(item, dict)]
+        print(f"      ⚠️  JSON格式错误：期望对象或数组，得到 {type(parsed_result)}")
+        return []
+
     def apply_ai_matches(
         self,
         cleaned_parts: List[Dict],
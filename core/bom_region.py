@@ -0,0 +1,156 @@
+"""BOM 表区域定位：根据文字位置和矢量表格线找出明细栏的外框，视觉模型只看这一块。"""
+
+from __future__ import annotations
+
+import statistics
+from collections import defaultdict
+from typing import List, Optional, Sequence, Tuple
+
+from core.bom_text_extractor import MIN_TEXT_WORDS, Word, column_bounds, find_header_anchors, group_rows, split_tables
+
+# (x0, y0, x1, y1)
+Box = Tuple[float, float, float, float]
+
+
+def _union(boxes: Sequence[Box]) -> Box:
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def _ruling_band(segments: Sequence[tuple], x0: float, x1: float, anchor_y: float, text_height: float) -> Optional[Tuple[float, float]]:
+    """
+    与表格等宽的水平线中，包含表头位置的连续一段的 y 范围
+
+    segments: [(x0, x1, y), ...]
+    """
+    width = x1 - x0
+    ys = sorted({
+        round(y, 1) for sx0, sx1, y in segments
+        if abs(sx0 - x0) <= 0.1 * width and (sx1 - sx0) >= 0.8 * width
+    })
+    if len(ys) < 2:
+        return None
+
+    gaps = [b - a for a, b in zip(ys, ys[1:])]
+    max_gap = max(3 * statistics.median(gaps), 4 * text_height)
+    # 按间距切分成若干段，取包含（或最靠近）表头的一段
+    bands, current = [], [ys[0]]
+    for y, gap in zip(ys[1:], gaps):
+        if gap > max_gap:
+            bands.append(current)
+            current = []
+        current.append(y)
+    bands.append(current)
+    band = min(bands, key=lambda b: 0 if b[0] <= anchor_y <= b[-1] else min(abs(b[0] - anchor_y), abs(b[-1] - anchor_y)))
+    return (band[0], band[-1]) if len(band) >= 2 else None
+
+
+def _word_band(rows, header_idx: int, x0: float, x1: float, text_height: float) -> Tuple[float, float]:
+    """没有表格线时：从表头向上下扩展，直到连续的行中断"""
+    y0 = y1 = rows[header_idx].y
+    for step in (-1, 1):
+        last_y = rows[header_idx].y
+        idx = header_idx + step
+        while 0 <= idx < len(rows):
+            row = rows[idx]
+            idx += step
+            if abs(row.y - last_y) > 4 * text_height:
+                break
+            if not any(x0 <= (w[0] + w[2]) / 2 <= x1 for w in row.words):
+                continue
+            last_y = row.y
+            y0, y1 = min(y0, row.y), max(y1, row.y)
+    return y0 - text_height, y1 + text_height
+
+
+def _grid_box(segments: Sequence[tuple]) -> Optional[Box]:
+    """无文字层时：最大一组等长、对齐的水平线（至少8条）构成的外框"""
+    groups = defaultdict(list)
+    for x0, x1, y in segments:
+        if x1 - x0 > 20:
+            groups[(round(x0), round(x1 - x0))].append((x0, x1, y))
+    if not groups:
+        return None
+    lines = max(groups.values(), key=len)
+    if len(lines) < 8:
+        return None
+    return (min(l[0] for l in lines), min(l[2] for l in lines), max(l[1] for l in lines), max(l[2] for l in lines))
+
+
+def locate_bom_region(
+    words: Sequence[Word],
+    horizontal_segments: Sequence[tuple],
+    vertical_lines: Sequence[float],
+    page_width: float,
+    page_height: float,
+    max_area_ratio: float = 0.6
+) -> Optional[Box]:
+    """
+    定位页面上的BOM表区域（多张并排的表取并集）
+
+    - 有文字层：按表头关键词定位列范围，再用等宽水平线（或连续文字行）确定上下边界
+    - 无文字层（词数少于 MIN_TEXT_WORDS）：取最大一组等长对齐的水平线
+    - 有文字层但未找到表头：返回 None（整页交给视觉模型）
+    - 结果四周留白后超过页面面积 max_area_ratio 时视为检测失败（裁剪无意义），返回 None
+    """
+    words = [w for w in words if str(w[4]).strip()]
+    boxes: List[Box] = []
+
+    if words:
+        rows = group_rows(words)
+        text_height = statistics.median([max(w[3] - w[1], 1.0) for w in words])
+        for i, row in enumerate(rows):
+            for anchors in split_tables(find_header_anchors(row.words)):
+                columns = column_bounds(anchors, vertical_lines)
+                x0, x1 = columns[0].x0, columns[-1].x1
+                band = _ruling_band(horizontal_segments, x0, x1, row.y, text_height)
+                y0, y1 = band if band else _word_band(rows, i, x0, x1, text_height)
+                y0, y1 = min(y0, row.y - text_height), max(y1, row.y + text_height)
+                boxes.append((x0, y0, x1, y1))
+
+    # 表格线兜底只用于无文字层的页面；有文字层但没识别到表头时返回 None，整页交给视觉模型
+    if not boxes and len(words) < MIN_TEXT_WORDS:
+        grid = _grid_box(horizontal_segments)
+        if grid:
+            boxes.append(grid)
+    if not boxes:
+        return None
+
+    x0, y0, x1, y1 = _union(boxes)
+    pad = 0.01 * max(page_width, page_height)
+    box = (max(0.0, x0 - pad), max(0.0, y0 - pad), min(page_width, x1 + pad), min(page_height, y1 + pad))
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if area <= 0 or area > max_area_ratio * page_width * page_height:
+        return None
+    return box
+
+
+def crop_dpi(box: Box, target_pixels: int, min_dpi: int = 144, max_dpi: int = 432) -> int:
+    """裁剪区域的渲染分辨率：长边约 target_pixels 像素，限制在 [min_dpi, max_dpi]"""
+    long_edge = max(box[2] - box[0], box[3] - box[1])
+    dpi = int(target_pixels / long_edge * 72) if long_edge > 0 else min_dpi
+    return max(min_dpi, min(max_dpi, dpi))
+
+
+def page_bom_region(page, max_area_ratio: float = 0.6) -> Optional[Box]:
+    """从 fitz 页面读取文字与表格线后定位BOM区域"""
+    words = [(w[0], w[1], w[2], w[3], w[4]) for w in page.get_text("words")]
+    horizontal, vertical = [], []
+    try:
+        drawings = page.get_drawings()
+    except Exception:
+        drawings = []
+    for drawing in drawings:
+        for item in drawing.get("items", []):
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) < 0.5:
+                    horizontal.append((min(p1.x, p2.x), max(p1.x, p2.x), p1.y))
+                elif abs(p1.x - p2.x) < 0.5:
+                    vertical.append(round(p1.x, 1))
+            elif item[0] == "re":
+                rect = item[1]
+                horizontal.extend([(rect.x0, rect.x1, rect.y0), (rect.x0, rect.x1, rect.y1)])
+                vertical.extend([round(rect.x0, 1), round(rect.x1, 1)])
+    return locate_bom_region(
+        words, horizontal, sorted(set(vertical)), page.rect.width, page.rect.height, max_area_ratio
+    )
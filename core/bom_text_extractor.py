@@ -0,0 +1,385 @@
+"""基于 PDF 文字层的本地 BOM 表提取：按词坐标定位表头/列边界/行，输出与视觉提取相同的字段。"""
+
+from __future__ import annotations
+
+import re
+import statistics
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# (x0, y0, x1, y1, text)
+Word = Tuple[float, float, float, float, str]
+
+# 表头关键词（按顺序匹配，已匹配的字符不再参与后续匹配，避免"产品代号"被识别为"代号"）
+# 物料代码即零件代号（PART_CODE）；"代号"列是图纸代号，只在没有物料代码列时用于查找零件代号
+HEADER_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("seq", ("序号",)),
+    ("code", ("物料代码", "物料编码", "图号")),
+    ("product_code", ("产品代号", "代号", "规格型号", "规格", "型号")),
+    ("name", ("名称",)),
+    ("quantity", ("数量",)),
+    ("material", ("材料",)),
+    ("unit_weight", ("单重", "单件")),
+    ("weight", ("总重", "总计")),
+    ("remark", ("备注",)),
+)
+
+PART_CODE = re.compile(r"\d{2}(?:\.\d+){2,}")
+_INT = re.compile(r"^\d+$")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+# 文字层词数少于该值时视为扫描件/文字转曲，交给视觉模型
+MIN_TEXT_WORDS = 20
+
+
+@dataclass
+class _Row:
+    y: float
+    words: List[Word]
+
+
+@dataclass
+class _Column:
+    key: str
+    x0: float
+    x1: float
+
+    @property
+    def center(self) -> float:
+        return (self.x0 + self.x1) / 2
+
+
+@dataclass
+class BOMPageResult:
+    """
+    单页提取结果
+
+    status:
+    - resolved：找到表头且所有行置信度达标、序号连续
+    - partial：找到表格但有低置信度行或序号缺口（需视觉补全 unresolved_seqs）
+    - needs_vision：无文字层/未找到表头但页面上有零件代号
+    - no_bom：文字层完整且没有BOM表
+    """
+
+    page_index: int
+    status: str
+    rows: List[Dict] = field(default_factory=list)
+    unresolved_seqs: List[str] = field(default_factory=list)
+    word_count: int = 0
+
+
+# ---------- 行/列 ----------
+def group_rows(words: Sequence[Word]) -> List[_Row]:
+    """按 y 中心聚类成行"""
+    if not words:
+        return []
+    heights = [w[3] - w[1] for w in words if w[3] > w[1]]
+    tolerance = (statistics.median(heights) if heights else 5.0) * 0.5
+
+    rows: List[_Row] = []
+    for word in sorted(words, key=lambda w: (w[1] + w[3]) / 2):
+        center = (word[1] + word[3]) / 2
+        if rows and abs(center - rows[-1].y) <= tolerance:
+            row = rows[-1]
+            row.words.append(word)
+            row.y = sum((w[1] + w[3]) / 2 for w in row.words) / len(row.words)
+        else:
+            rows.append(_Row(center, [word]))
+    for row in rows:
+        row.words.sort(key=lambda w: w[0])
+    return rows
+
+
+def find_header_anchors(row_words: List[Word]) -> List[_Column]:
+    """在一行中查找表头关键词，返回各关键词覆盖的 x 范围（词可能按单字拆分）"""
+    text = ""
+    owners: List[int] = []
+    for idx, word in enumerate(row_words):
+        text += word[4]
+        owners.extend([idx] * len(word[4]))
+
+    used = [False] * len(text)
+    anchors: List[_Column] = []
+    for key, keywords in HEADER_KEYWORDS:
+        for keyword in keywords:
+            for match in re.finditer(re.escape(keyword), text):
+                start, end = match.span()
+                if any(used[start:end]):
+                    continue
+                for i in range(start, end):
+                    used[i] = True
+                covered = [row_words[owners[i]] for i in range(start, end)]
+                anchors.append(_Column(key, min(w[0] for w in covered), max(w[2] for w in covered)))
+    anchors.extend(_unknown_anchors(row_words, owners, used, anchors))
+    anchors.sort(key=lambda c: c.center)
+    return anchors
+
+
+def _unknown_anchors(row_words: List[Word], owners: List[int], used: List[bool], anchors: List[_Column]) -> List[_Column]:
+    """
+    表头中未识别的词单独成列（相邻的单字拆分词合并），避免被相邻列吸收
+
+    只考虑位于已识别表头之间的词，表头行右侧的标题栏文字不参与。
+    """
+    if not anchors:
+        return []
+    lo = min(a.x0 for a in anchors)
+    hi = max(a.x1 for a in anchors)
+    untouched = set(range(len(row_words)))
+    for i, flag in enumerate(used):
+        if flag:
+            untouched.discard(owners[i])
+
+    unknown: List[_Column] = []
+    prev: Optional[Word] = None
+    for idx, word in enumerate(row_words):
+        if idx not in untouched or not (lo < word[0] and word[2] < hi):
+            prev = None
+            continue
+        height = max(word[3] - word[1], 1.0)
+        if prev is not None and word[0] - prev[2] < 0.5 * height:
+            unknown[-1].x1 = word[2]
+        else:
+            unknown.append(_Column(f"unknown_{idx}", word[0], word[2]))
+        prev = word
+    return unknown
+
+
+def split_tables(anchors: List[_Column]) -> List[List[_Column]]:
+    """同一行出现多个"序号"时（并排的多张表），以每个序号为起点拆分"""
+    tables: List[List[_Column]] = []
+    for anchor in anchors:
+        if anchor.key == "seq" or not tables:
+            tables.append([])
+        tables[-1].append(anchor)
+    return [
+        t for t in tables
+        if {"seq", "name"} <= {c.key for c in t} and {"code", "product_code"} & {c.key for c in t}
+    ]
+
+
+def column_bounds(anchors: List[_Column], vertical_lines: Sequence[float]) -> List[_Column]:
+    """由表头位置与竖直表格线确定各列边界（无表格线时取相邻表头的中点）"""
+    def ruling_between(left: float, right: float, target: float) -> Optional[float]:
+        candidates = [x for x in vertical_lines if left <= x <= right]
+        return min(candidates, key=lambda x: abs(x - target)) if candidates else None
+
+    boundaries = []
+    for a, b in zip(anchors, anchors[1:]):
+        midpoint = (a.x1 + b.x0) / 2
+        boundaries.append(ruling_between(a.x1, b.x0, midpoint) or midpoint)
+
+    first, last = anchors[0], anchors[-1]
+    first_half = (boundaries[0] - first.center) if boundaries else (first.x1 - first.x0)
+    last_half = (last.center - boundaries[-1]) if boundaries else (last.x1 - last.x0)
+    left = ruling_between(first.center - 2 * first_half, first.x0, first.center - first_half)
+    right = ruling_between(last.x1, last.center + 2 * last_half, last.center + last_half)
+    edges = [left or first.center - first_half] + boundaries + [right or last.center + last_half]
+
+    return [_Column(anchor.key, edges[i], edges[i + 1]) for i, anchor in enumerate(anchors)]
+
+
+def _cell_text(words: List[Word]) -> str:
+    """拼接单元格内的词：间距很小（单字拆分）时不加空格"""
+    text = ""
+    prev = None
+    for word in words:
+        if prev is not None:
+            gap = word[0] - prev[2]
+            height = max(prev[3] - prev[1], 1.0)
+            text += "" if gap < 0.25 * height else " "
+        text += word[4]
+        prev = word
+    return text.strip()
+
+
+def _row_cells(row: _Row, columns: List[_Column]) -> Optional[Dict[str, str]]:
+    """把一行的词分配到各列；该行没有落在表格范围内的词时返回 None"""
+    cells: Dict[str, List[Word]] = {c.key: [] for c in columns}
+    found = False
+    for word in row.words:
+        center = (word[0] + word[2]) / 2
+        for column in columns:
+            if column.x0 <= center < column.x1:
+                cells[column.key].append(word)
+                found = True
+                break
+    return {key: _cell_text(ws) for key, ws in cells.items()} if found else None
+
+
+# ---------- 行解析 ----------
+def _parse_number(text: str) -> Optional[float]:
+    match = _NUMBER.search(text.replace(",", ""))
+    return float(match.group(0)) if match else None
+
+
+def _parse_row(cells: Dict[str, str]) -> Tuple[Optional[Dict], float]:
+    """返回 (BOM行, 置信度)；序号不是整数时返回 (None, 0)"""
+    seq = cells.get("seq", "")
+    if not _INT.match(seq):
+        return None, 0.0
+
+    confidence = 1.0
+    code_match = PART_CODE.search(cells.get("code", "")) or PART_CODE.search(cells.get("product_code", ""))
+    if not code_match:
+        confidence -= 0.5
+
+    quantity_text = cells.get("quantity", "")
+    quantity = int(quantity_text) if _INT.match(quantity_text) else None
+    if quantity is None:
+        number = _parse_number(quantity_text)
+        quantity = int(number) if number is not None and number == int(number) else None
+        confidence -= 0.1 if quantity is not None else 0.4
+
+    name = cells.get("name", "")
+    if not name:
+        confidence -= 0.3
+
+    weight = _parse_number(cells.get("weight", "")) if cells.get("weight") else None
+    if weight is None and cells.get("unit_weight"):
+        weight = _parse_number(cells["unit_weight"])
+
+    item = {
+        "seq": seq,
+        "code": code_match.group(0) if code_match else "",
+        "product_code": cells.get("product_code", ""),
+        "name": name,
+        "quantity": quantity if quantity is not None else 1,
+        "weight": weight if weight is not None else 0.0,
+    }
+    return item, max(0.0, round(confidence, 2))
+
+
+def _walk_table(rows: List[_Row], header_idx: int, step: int, columns: List[_Column], text_height: float) -> List[Dict]:
+    """
+    从表头沿一个方向读取数据行，遇到连续两行非数据行或行距过大时停止
+
+    允许的最大行距：读到两行以上时为已读行距中位数的 2.5 倍，否则为字高的 4 倍。
+    """
+    items: List[Dict] = []
+    gaps: List[float] = []
+    misses = 0
+    last_y = rows[header_idx].y
+    idx = header_idx + step
+    while 0 <= idx < len(rows) and misses < 2:
+        row = rows[idx]
+        idx += step
+        max_gap = 2.5 * statistics.median(gaps) if len(gaps) >= 2 else 4 * text_height
+        if abs(row.y - last_y) > max_gap:
+            break
+        cells = _row_cells(row, columns)
+        if cells is None:
+            misses += 1
+            continue
+        item, confidence = _parse_row(cells)
+        if item is None:
+            # 无序号但有名称：上一行名称换行
+            if items and cells.get("name") and not cells.get("seq") and not cells.get("code"):
+                items[-1]["name"] = f"{items[-1]['name']}{cells['name']}"
+                items[-1]["confidence"] = round(max(0.0, items[-1]["confidence"] - 0.15), 2)
+                last_y = row.y
+                continue
+            misses += 1
+            continue
+        misses = 0
+        gaps.append(abs(row.y - last_y))
+        last_y = row.y
+        item["confidence"] = confidence
+        items.append(item)
+    return items
+
+
+def extract_page_bom(
+    words: Sequence[Word],
+    vertical_lines: Sequence[float] = (),
+    page_index: int = 0,
+    min_confidence: float = 0.7
+) -> BOMPageResult:
+    """
+    从单页的词坐标中提取BOM表
+
+    Args:
+        words: 页面文字层的词 (x0, y0, x1, y1, text)
+        vertical_lines: 竖直表格线的 x 坐标（来自 PDF 绘图指令，可为空）
+        page_index: 页码（从0开始）
+        min_confidence: 行置信度阈值，低于该值的行交给视觉模型
+    """
+    words = [w for w in words if w[4].strip()]
+    result = BOMPageResult(page_index=page_index, status="no_bom", word_count=len(words))
+    if len(words) < MIN_TEXT_WORDS:
+        result.status = "needs_vision"
+        return result
+
+    rows = group_rows(words)
+    text_height = statistics.median([max(w[3] - w[1], 1.0) for w in words])
+
+    items: List[Dict] = []
+    header_rows = set()
+    for i, row in enumerate(rows):
+        for anchors in split_tables(find_header_anchors(row.words)):
+            header_rows.add(i)
+            columns = column_bounds(anchors, vertical_lines)
+            # 国标明细栏表头在下方、序号向上递增；也兼容表头在上方的表格
+            items.extend(_walk_table(rows, i, -1, columns, text_height))
+            items.extend(_walk_table(rows, i, 1, columns, text_height))
+
+    if not header_rows:
+        code_tokens = sum(1 for w in words if PART_CODE.search(w[4]))
+        result.status = "needs_vision" if code_tokens >= 3 else "no_bom"
+        return result
+
+    # 同一序号只保留置信度最高的一行
+    best: Dict[str, Dict] = {}
+    for item in items:
+        current = best.get(item["seq"])
+        if current is None or item["confidence"] > current["confidence"]:
+            best[item["seq"]] = item
+    result.rows = sorted(best.values(), key=lambda it: int(it["seq"]))
+
+    unresolved = [it["seq"] for it in result.rows if it["confidence"] < min_confidence]
+    if result.rows:
+        seqs = {int(it["seq"]) for it in result.rows}
+        unresolved.extend(str(s) for s in range(min(seqs), max(seqs) + 1) if s not in seqs)
+    result.unresolved_seqs = sorted(set(unresolved), key=int)
+    if not result.rows:
+        result.status = "needs_vision"
+    elif result.unresolved_seqs:
+        result.status = "partial"
+    else:
+        result.status = "resolved"
+    return result
+
+
+# ---------- PDF ----------
+def _vertical_lines(page) -> List[float]:
+    """页面绘图指令中的竖直线段 x 坐标"""
+    xs = []
+    try:
+        drawings = page.get_drawings()
+    except Exception:
+        return xs
+    for drawing in drawings:
+        for item in drawing.get("items", []):
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.x - p2.x) < 0.5 and abs(p1.y - p2.y) > 2:
+                    xs.append(round(p1.x, 1))
+            elif item[0] == "re":
+                rect = item[1]
+                xs.extend([round(rect.x0, 1), round(rect.x1, 1)])
+    return sorted(set(xs))
+
+
+def extract_pdf_bom(pdf_path: str, min_confidence: float = 0.7) -> List[BOMPageResult]:
+    """逐页提取PDF文字层中的BOM表"""
+    import fitz  # PyMuPDF
+
+    results = []
+    with fitz.open(pdf_path) as doc:
+        for page_index, page in enumerate(doc):
+            words = [(w[0], w[1], w[2], w[3], w[4]) for w in page.get_text("words")]
+            # 只有可能含表头的页面才读取绘图指令（大图纸的绘图指令很多）
+            text = "".join(w[4] for w in words)
+            lines = _vertical_lines(page) if "序" in text and "号" in text else []
+            results.append(extract_page_bom(words, lines, page_index, min_confidence))
+    return results
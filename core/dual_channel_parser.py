@@ -28,6 +28,7 @@ import fitz  # PyMuPDF
 
 from pypdf import PdfReader
 
+from core.page_render import get_page_renderer
 from models.vision_model import Qwen3VLModel
 from utils.time_utils import beijing_strftime
 
@@ -124,19 +125,15 @@ class DualChannelParser:
         all_image_paths = []
         total_pages = 0
 
+        renderer = get_page_renderer()
         for pdf_path in pdf_paths:
             doc = fitz.open(pdf_path)
             total_pages += len(doc)
 
             for page_num in range(len(doc)):
-                page = doc[page_num]
-
-                # 高分辨率渲染
-                mat = fitz.Matrix(3, 3)  # 3倍缩放
-                pix = page.get_pixmap(matrix=mat)
-
+                # 高分辨率渲染（3倍缩放 = 216 DPI，经页面渲染缓存复用）
                 img_path = f"{temp_dir}/pdf{len(all_image_paths) + 1}_page{page_num + 1}.png"
-                pix.save(img_path)
+                renderer.export_page(pdf_path, page_num, 216, img_path, doc=doc)
                 all_image_paths.append(img_path)
 
             doc.close()
@@ -638,25 +635,19 @@ class DualChannelParser:
 
         for page_num in range(len(doc)):
 
-            page = doc[page_num]
-
             print(f"🖼️  转换第 {page_num + 1} 页为图片...")
 
 
 
-            # 高分辨率渲染
-
-            mat = fitz.Matrix(3, 3)  # 3倍缩放，约225DPI
-
-            pix = page.get_pixmap(matrix=mat)
+            # 高分辨率渲染（3倍缩放 = 216 DPI，经页面渲染缓存复用）
 
             img_path = f"{temp_dir}/page_{page_num + 1}.png"
 
-            pix.save(img_path)
+            get_page_renderer().export_page(pdf_path, page_num, 216, img_path, doc=doc)
 
             image_paths.append(img_path)
 
-            print(f"   ✅ 已保存: {img_path}, 尺寸: {pix.width}x{pix.height}")
+            print(f"   ✅ 已保存: {img_path}")
 
 
 
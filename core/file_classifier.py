@@ -6,10 +6,15 @@
 
 import os
 import re
+import json
+import time
 from pathlib import Path
 from typing import Dict, List, Tuple
 import fitz  # PyMuPDF
 
+from core.page_render import get_page_renderer
+from core.page_triage import label_entries, triage_pdf
+
 
 class FileClassifier:
     """"""
@@ -252,11 +257,15 @@ class FileClassifier:
         """
         result = {
             "product_images": [],
-            "component_images": {}
+            "component_images": {},
+            # 页面分诊标签（bom / assembly_view / detail / title_block / unknown），供后续阶段挑选页面
+            "page_labels": {"product": [], "components": {}}
         }
         
         output_base = Path(output_base_dir)
         output_base.mkdir(parents=True, exist_ok=True)
+
+        self._prerender_pdfs(file_hierarchy, output_base, dpi)
         
         # 
         if file_hierarchy["product"] and file_hierarchy["product"]["pdf"]:
@@ -267,6 +276,7 @@ class FileClassifier:
             print(f"\n : {Path(product_pdf).name}")
             images = self._pdf_to_images(product_pdf, str(product_dir), dpi)
             result["product_images"] = images
+            result["page_labels"]["product"] = label_entries(self._triage(product_pdf), images)
             print(f"     {len(images)} ")
         
         # 
@@ -281,10 +291,47 @@ class FileClassifier:
                 images = self._pdf_to_images(comp_pdf, str(comp_dir), dpi)
                 # ✅ 使用字符串key，保持与JSON序列化后的一致性
                 result["component_images"][str(comp_index)] = images
+                result["page_labels"]["components"][str(comp_index)] = label_entries(self._triage(comp_pdf), images)
                 print(f"     {len(images)} ")
         
         return result
     
+    def _triage(self, pdf_path: str):
+        """页面分诊；失败时返回 None（页面标记为 unknown）"""
+        try:
+            return triage_pdf(pdf_path)
+        except Exception as e:
+            print(f"⚠️ 页面分诊失败 {Path(pdf_path).name}: {str(e)}")
+            return None
+
+    def _prerender_pdfs(self, file_hierarchy: Dict, output_base: Path, dpi: int) -> None:
+        """
+        所有PDF的页面一次性交给多进程光栅化器并行渲染（结果进入页面渲染缓存）
+
+        逐页耗时写入 output_base/render_timings.json；失败时由 _pdf_to_images 逐页渲染兜底。
+        """
+        pdf_paths = []
+        if file_hierarchy["product"] and file_hierarchy["product"]["pdf"]:
+            pdf_paths.append(file_hierarchy["product"]["pdf"])
+        pdf_paths.extend(c["pdf"] for c in file_hierarchy["components"] if c["pdf"])
+        if not pdf_paths:
+            return
+
+        start = time.perf_counter()
+        try:
+            _, timings = get_page_renderer().render_batch([(pdf, dpi) for pdf in pdf_paths])
+        except Exception as e:
+            print(f"⚠️ 并行渲染PDF失败，改为逐页渲染: {str(e)}")
+            return
+        elapsed = time.perf_counter() - start
+
+        if timings:
+            page_seconds = sum(t["seconds"] for t in timings)
+            print(f"🖼️ 并行渲染 {len(timings)} 页: 墙钟 {elapsed:.1f}秒, 单页累计 {page_seconds:.1f}秒")
+        with open(output_base / "render_timings.json", "w", encoding="utf-8") as f:
+            json.dump({"dpi": dpi, "elapsed_seconds": round(elapsed, 3), "pages": timings},
+                      f, ensure_ascii=False, indent=2)
+
     def _pdf_to_images(
         self,
         pdf_path: str,
@@ -313,19 +360,14 @@ class FileClassifier:
             raise ValueError(f"无法打开PDF文件 {pdf_path}: {str(e)}")
 
         image_paths = []
+        renderer = get_page_renderer()
 
         try:
             for page_num in range(len(pdf_document)):
                 try:
-                    page = pdf_document[page_num]
-
-                    # 设置渲染参数
-                    mat = fitz.Matrix(dpi / 72, dpi / 72)
-                    pix = page.get_pixmap(matrix=mat)
-
-                    # 保存图片到统一目录结构
+                    # 从页面渲染缓存取图（同一PDF页面在各步骤间只光栅化一次）
                     image_path = image_dir / f"page_{page_num + 1:03d}.png"
-                    pix.save(str(image_path))
+                    renderer.export_page(pdf_path, page_num, dpi, image_path, doc=pdf_document)
                     image_paths.append(str(image_path))
                 except Exception as e:
                     print(f"⚠️ PDF {pdf_name} 第{page_num+1}页转换失败: {str(e)}")
@@ -18,6 +18,8 @@ import os
 import json
 import time
 import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, List, Optional
@@ -43,6 +45,23 @@ from core.file_classifier import FileClassifier
 from core.hierarchical_bom_matcher_v2 import HierarchicalBOMMatcher
 from core.manual_integrator_v2 import ManualIntegratorV2
 from core.simple_planner import SimplePlanner
+from core.llm_cache import cached_chat_completion_async, get_llm_cache
+from core.llm_client import async_openai_client
+from core.llm_limiter import get_llm_limiter
+from core.llm_retry import RetryPolicy, classify_error, retry_after_seconds
+from core.glb_cache import get_glb_cache
+from core.image_payload import get_image_optimizer
+from core.prompt_budget import estimate_messages_tokens, get_token_usage_log
+from core.prompt_cache import cached_text_part
+from core.structured_output import parse_json_tolerant
+from core.bom_region import crop_dpi, page_bom_region
+from core.bom_text_extractor import extract_pdf_bom
+from core.page_render import get_page_renderer
+from core.page_triage import ASSEMBLY_VIEW, BOM, DETAIL, select_page_images, triage_pdf
+from core.stage_checkpoint import StageCheckpointStore, hash_sources
+from core.stage_scheduler import Stage, StageScheduler
+from core.step_delta import ensure_step_ids, overlay_step_fields
+from config import PERFORMANCE_CONFIG
 
 # 6个Gemini Agent
 from agents.component_assembly_agent import ComponentAssemblyAgent
@@ -53,15 +72,58 @@ from agents.safety_faq_agent import SafetyFAQAgent
 # 日志工具
 from utils.logger import (
     print_step, print_substep, print_info,
-    print_success, print_error, print_warning
+    print_success, print_error, print_warning,
+    bind_task_context
 )
 from utils.time_utils import beijing_now
 
 
+# BOM视觉提取提示词（不含变量，来源PDF等信息放在提示词之后单独发送）
+BOM_VISION_PROMPT = """你是一个BOM表提取专家。请从这个工程图纸中提取BOM表（零件清单）。
+
+# 如何识别BOM表
+1. 必须有"代号"列，格式为XX.XX.XXXX（至少3段，如01.09.1140）
+2. 必须有"序号"列（数字1, 2, 3...）
+3. 必须有"名称"列（零件名称）
+4. 不要提取"工艺路线"表（只有2段如08.02）
+
+# 输出格式
+返回一个有效的JSON数组。不要markdown，不要解释，不要代码块。
+
+示例：
+[{"seq":"1","code":"01.09.1140","product_code":"S-AB1830(72IN)-MP1140-01","name":"刷辊组件-漆后","quantity":1,"weight":76.42}]
+
+# 字段映射
+- seq: 序号（字符串，如"1", "2", "3"）
+- code: 代号（字符串，XX.XX.XXXX格式，至少3段）
+- product_code: 产品代号/规格（字符串，如果没有则为空字符串""）
+- name: 名称（字符串，如果没有则为空字符串""）
+- quantity: 数量（整数）
+- weight: 总重（浮点数，优先使用总重，否则使用单重）
+
+# ⚠️ 重要规则（必须遵守）
+1. **必须提取所有行**：不要遗漏任何一行BOM数据，每一行都很重要
+2. **仔细检查表格边界**：BOM表可能跨越多行或多列，确保完整提取
+3. **注意表格分隔**：如果表格有分隔线或空行，继续检查下方是否还有数据
+4. 按seq序号排序（1, 2, 3...）
+5. 如果没有找到BOM表，返回[]
+6. 只返回有效的JSON，不要其他文本"""
+
+
 class GeminiAssemblyPipeline:
     """基于Gemini 2.5 Flash的6-Agent装配说明书生成工作流"""
 
-    def __init__(self, api_key: str, output_dir: str = "pipeline_output", product_name: str = "", model_name: str = None):
+    def __init__(
+        self,
+        api_key: str,
+        output_dir: str = "pipeline_output",
+        product_name: str = "",
+        model_name: str = None,
+        max_stage_workers: int = None,
+        component_concurrency: int = None,
+        use_llm_cache: bool = True,
+        welding_safety_mode: str = None
+    ):
         """
         初始化工作流
 
@@ -70,6 +132,10 @@ class GeminiAssemblyPipeline:
             output_dir: 输出目录
             product_name: 产品名称（用户输入）
             model_name: AI模型名称（可选，如果不提供则从环境变量读取）
+            max_stage_workers: 并发执行阶段的线程数（默认读取 PERFORMANCE_CONFIG）
+            component_concurrency: 步骤5中同时处理的组件数（默认读取 PERFORMANCE_CONFIG）
+            use_llm_cache: 是否复用LLM响应缓存（False 时本任务的调用全部重新请求）
+            welding_safety_mode: 步骤7焊接/安全增强方式 parallel | chained（默认读取 PERFORMANCE_CONFIG）
         """
         self.api_key = api_key
         self.output_dir = Path(output_dir)
@@ -102,8 +168,11 @@ class GeminiAssemblyPipeline:
 
         # 工作流状态
         self.start_time = None
-        self.current_step = 0
         self.total_steps = 8
+        self.max_stage_workers = max_stage_workers or PERFORMANCE_CONFIG["pipeline_stage_workers"]
+        self.component_concurrency = component_concurrency or PERFORMANCE_CONFIG["component_agent_concurrency"]
+        self.use_llm_cache = use_llm_cache
+        self.welding_safety_mode = welding_safety_mode or PERFORMANCE_CONFIG["welding_safety_mode"]
         
     def log_agent_call(self, agent_name: str, action: str, status: str = "running"):
         """记录Agent调用日志（生动的AI员工工作描述）"""
@@ -122,13 +191,18 @@ class GeminiAssemblyPipeline:
             import sys
             sys.stdout.flush()
     
-    def run(self, pdf_dir: str, step_dir: str) -> Dict:
+    def run(self, pdf_dir: str, step_dir: str, resume_from: Optional[int] = None) -> Dict:
         """
         运行完整的工作流
 
+        各阶段按输入/输出依赖关系由 StageScheduler 调度：
+        PDF支路（转图片、BOM提取）与3D支路（STEP转GLB）并发执行。
+        输入指纹未变化的阶段直接复用 checkpoints/ 下的产物。
+
         Args:
             pdf_dir: PDF文件目录
             step_dir: STEP文件目录
+            resume_from: 从第N步开始强制重跑（之前的步骤在指纹一致时复用检查点）
 
         Returns:
             工作流结果字典
@@ -138,79 +212,74 @@ class GeminiAssemblyPipeline:
         print_step("🚀 Gemini 6-Agent装配说明书生成工作流启动")
         print_info(f"📁 输出目录: {self.output_dir}")
         print_info(f"📋 总步骤数: {self.total_steps}")
+        if resume_from:
+            print_info(f"♻️  从第 {resume_from} 步开始重跑")
         print_info("")
 
-        try:
-            # ========== 支路1: PDF处理 ==========
-            # 步骤1: 文件分类 + PDF转图片
-            self.current_step = 1
-            file_hierarchy, image_hierarchy = self._step1_classify_and_convert(pdf_dir, step_dir)
-
-            # 步骤2: 从PDF提取BOM数据
-            self.current_step = 2
-            bom_data = self._step2_extract_bom_from_pdfs(file_hierarchy)
-
-            # 判定模式：组件或产品（单PDF/STEP场景互斥）
-            self.is_product_mode = self._determine_mode(file_hierarchy, bom_data)
-            mode_label = "产品模式" if self.is_product_mode else "组件模式"
-            print_info(f"🧭 判定结果: {mode_label}", indent=1)
-            import sys; sys.stdout.flush()
+        llm_cache = get_llm_cache()
+        if llm_cache is not None:
+            llm_cache.set_bypass(not self.use_llm_cache)
+            if not self.use_llm_cache:
+                print_info("💾 本任务已关闭LLM响应缓存")
 
-            # 步骤3: SimplePlanner - 按BOM序号规划
-            self.current_step = 3
-            planning_result = self._step3_vision_planning(image_hierarchy, bom_data, file_hierarchy)
-            
-            # ========== 支路2: 3D处理 ==========
-            # 步骤4: Agent 2 - BOM-3D匹配
-            self.current_step = 4
-            matching_result = self._step4_bom_3d_matching(
-                step_dir, bom_data, planning_result, file_hierarchy
-            )
-            
-            # ========== 主线路: Agent 3-6 ==========
-            # 步骤5: Agent 3 - 组件装配（可复用，产品模式下跳过）
-            component_results = []
-            if self.is_product_mode:
-                print_info("⏭️ 产品模式下跳过组件装配（Step5）", indent=1)
-                import sys; sys.stdout.flush()
-            else:
-                self.current_step = 5
-                component_results = self._step5_component_assembly(
-                    file_hierarchy, image_hierarchy, planning_result, matching_result
-                )
-            
-            # 步骤6: Agent 4 - 产品总装（仅产品模式）
-            if self.is_product_mode:
-                self.current_step = 6
-                product_result = self._step6_product_assembly(
-                    file_hierarchy, image_hierarchy, planning_result, matching_result
-                )
-            else:
-                product_result = {}
-
-            # 步骤7: Agent 5 & 6 - 焊接和安全（增强装配步骤）
-            self.current_step = 7
-            enhanced_component_results, enhanced_product_result = self._step7_welding_and_safety(
-                file_hierarchy, image_hierarchy, component_results, product_result
+        scheduler = None
+        try:
+            scheduler = StageScheduler(
+                self._build_stages(),
+                max_workers=self.max_stage_workers,
+                checkpoints=self._create_checkpoint_store(),
+                resume_from=resume_from
             )
+            context = scheduler.run({"pdf_dir": pdf_dir, "step_dir": step_dir})
+            final_manual = context["final_manual"]
+            stage_timings = self._save_stage_timings(scheduler)
+            llm_cache_stats = llm_cache.stats() if llm_cache is not None else None
+            limiter_metrics = get_llm_limiter().metrics()
+            image_payload_stats = get_image_optimizer().stats()
+            token_usage = get_token_usage_log().stats()
+            glb_cache_stats = get_glb_cache().stats()
 
-            # 步骤8: 整合最终手册
-            self.current_step = 8
-            final_manual = self._step8_integrate_manual(
-                planning_result, enhanced_component_results, enhanced_product_result,
-                matching_result, image_hierarchy  # ✅ 传入图片层级结构
-            )
-            
             # 计算总耗时
             elapsed_time = time.time() - self.start_time
             
             print_step("🎉 工作流完成")
             print_success(f"⏱️  总耗时: {elapsed_time:.1f}秒")
+            if llm_cache_stats:
+                print_info(f"💾 LLM缓存: 命中 {llm_cache_stats['hits']} 次, 未命中 {llm_cache_stats['misses']} 次")
+            print_info(
+                f"🚦 LLM限流: 并发上限 {limiter_metrics['concurrency_limit']}, "
+                f"429 {limiter_metrics['throttled']} 次, "
+                f"平均排队 {limiter_metrics['queue_wait_avg']:.2f}秒 (最长 {limiter_metrics['queue_wait_max']:.2f}秒)"
+            )
+            if image_payload_stats["images"]:
+                print_info(
+                    f"🖼️  图片载荷: {image_payload_stats['images']} 张 (记忆化命中 {image_payload_stats['memo_hits']}), "
+                    f"{image_payload_stats['original_bytes'] / 1024 / 1024:.1f}MB → "
+                    f"{image_payload_stats['sent_bytes'] / 1024 / 1024:.1f}MB"
+                )
+            if token_usage.get("calls"):
+                print_info(
+                    f"🧮 Token: {token_usage['calls']} 次调用, 估算输入 {token_usage['estimated_prompt_tokens']}, "
+                    f"实际输入 {token_usage.get('prompt_tokens', 0)} (缓存命中 {token_usage.get('cached_prompt_tokens', 0)}) "
+                    f"/ 输出 {token_usage.get('completion_tokens', 0)} "
+                    f"({token_usage.get('measured_calls', 0)} 次有用量数据)"
+                )
+            if glb_cache_stats["hits"] or glb_cache_stats["misses"]:
+                print_info(
+                    f"♻️  GLB转换缓存: 命中 {glb_cache_stats['hits']} 次, 未命中 {glb_cache_stats['misses']} 次, "
+                    f"复用 {glb_cache_stats['bytes_reused'] / 1024 / 1024:.1f}MB"
+                )
             print_success(f"📄 输出文件: {self.output_dir / 'assembly_manual.json'}")
             return {
                 "success": True,
                 "output_file": str(self.output_dir / "assembly_manual.json"),
                 "elapsed_time": elapsed_time,
+                "stage_timings": stage_timings,
+                "llm_cache": llm_cache_stats,
+                "llm_limiter": limiter_metrics,
+                "image_payload": image_payload_stats,
+                "token_usage": token_usage,
+                "glb_cache": glb_cache_stats,
                 "manual": final_manual
             }
 
@@ -220,8 +289,147 @@ class GeminiAssemblyPipeline:
             traceback.print_exc()
             return {
                 "success": False,
-                "error": str(e)
+                "error": str(e),
+                "stage_timings": self._save_stage_timings(scheduler) if scheduler else []
+            }
+
+    def _build_stages(self) -> List[Stage]:
+        """
+        声明工作流阶段及其输入/输出
+
+        - 支路1（PDF处理）：文件分类 → PDF转图片 / BOM提取 → 规划
+        - 支路2（3D处理）：文件分类 → STEP转GLB（只依赖STEP文件，与支路1并发）
+        - 主线路：BOM-3D匹配 → 组件装配 / 产品总装 → 焊接和安全 → 整合输出
+        """
+        return [
+            self._stage("classify", 1, self._step1_classify_files,
+                        inputs=["pdf_dir", "step_dir"], outputs=["file_hierarchy"]),
+            self._stage("pdf_to_images", 1, self._step1_convert_pdfs_to_images,
+                        inputs=["file_hierarchy"], outputs=["image_hierarchy"], version="2"),
+            self._stage("bom_extraction", 2, self._step2_extract_bom_from_pdfs,
+                        inputs=["file_hierarchy"], outputs=["bom_data"], version="3"),
+            self._stage("glb_conversion", 4, self._step4_convert_step_files,
+                        inputs=["step_dir", "file_hierarchy"], outputs=["glb_conversions"]),
+            # 模式判定开销很小且会设置 self.is_product_mode，不写检查点，每次都执行
+            self._stage("determine_mode", 3, self._stage_determine_mode,
+                        inputs=["bom_data", "file_hierarchy"], outputs=["product_mode"], checkpoint=False),
+            self._stage("planning", 3, self._stage_planning,
+                        inputs=["bom_data", "file_hierarchy", "product_mode"], outputs=["planning_result"]),
+            self._stage("bom_3d_matching", 4, self._step4_bom_3d_matching,
+                        inputs=["step_dir", "bom_data", "planning_result", "file_hierarchy", "glb_conversions"],
+                        outputs=["matching_result"]),
+            self._stage("component_assembly", 5, self._stage_component_assembly,
+                        inputs=["file_hierarchy", "image_hierarchy", "planning_result", "matching_result",
+                                "product_mode"],
+                        outputs=["component_results"],
+                        checkpoint_if=lambda results: all(r.get("success") for r in results)),
+            self._stage("product_assembly", 6, self._stage_product_assembly,
+                        inputs=["file_hierarchy", "image_hierarchy", "planning_result", "matching_result",
+                                "product_mode"],
+                        outputs=["product_result"],
+                        checkpoint_if=lambda result: not result or bool(result.get("success"))),
+            self._stage("welding_and_safety", 7, self._stage_welding_and_safety,
+                        inputs=["file_hierarchy", "image_hierarchy", "component_results", "product_result",
+                                "product_mode"],
+                        outputs=["enhanced_component_results", "enhanced_product_result"],
+                        version=f"1-{self.welding_safety_mode}"),
+            self._stage("integrate_manual", 8, self._stage_integrate_manual,
+                        inputs=["planning_result", "enhanced_component_results", "enhanced_product_result",
+                                "matching_result", "image_hierarchy"],
+                        outputs=["final_manual"]),
+        ]
+
+    def _stage(self, name: str, step_number: int, func, inputs: List[str], outputs: List[str], **kwargs) -> Stage:
+        """声明一个阶段（step_number 为日志 [N/8] 中的步骤号）"""
+        return Stage(name, func, inputs=inputs, outputs=outputs, step=step_number, **kwargs)
+
+    def _step_label(self, step_number: int) -> str:
+        """日志中的 [N/8] 标签：各阶段使用自己的步骤号（PDF/3D支路并发执行，不能共用实例状态）"""
+        return f"[{step_number}/{self.total_steps}]"
+
+    def _create_checkpoint_store(self) -> Optional[StageCheckpointStore]:
+        """
+        创建阶段检查点存储（output_dir/checkpoints）
+
+        全局指纹参数：模型名称、产品名称、提示词/Agent源码版本
+        """
+        if not PERFORMANCE_CONFIG.get("stage_checkpoints", True):
+            return None
+        prompt_sources = list((project_root / "prompts").glob("*.py")) + list((project_root / "agents").glob("*.py"))
+        return StageCheckpointStore(
+            self.output_dir / "checkpoints",
+            extra={
+                "model": self.model_name,
+                "product_name": self.product_name,
+                "prompt_version": hash_sources(prompt_sources),
             }
+        )
+
+    def _stage_determine_mode(self, bom_data: List[Dict], file_hierarchy: Dict) -> bool:
+        """判定组件/产品模式（单PDF/STEP场景互斥）"""
+        self.is_product_mode = self._determine_mode(file_hierarchy, bom_data)
+        mode_label = "产品模式" if self.is_product_mode else "组件模式"
+        print_info(f"🧭 判定结果: {mode_label}", indent=1)
+        import sys; sys.stdout.flush()
+        return self.is_product_mode
+
+    def _stage_planning(self, bom_data: List[Dict], file_hierarchy: Dict, product_mode: bool) -> Dict:
+        """按判定的模式执行规划（不等待PDF转图片）"""
+        return self._step3_vision_planning(None, bom_data, file_hierarchy)
+
+    def _stage_component_assembly(
+        self, file_hierarchy: Dict, image_hierarchy: Dict, planning_result: Dict, matching_result: Dict,
+        product_mode: bool
+    ) -> List[Dict]:
+        """步骤5（可复用，产品模式下跳过）"""
+        if self.is_product_mode:
+            print_info("⏭️ 产品模式下跳过组件装配（Step5）", indent=1)
+            import sys; sys.stdout.flush()
+            return []
+        return self._step5_component_assembly(file_hierarchy, image_hierarchy, planning_result, matching_result)
+
+    def _stage_product_assembly(
+        self, file_hierarchy: Dict, image_hierarchy: Dict, planning_result: Dict, matching_result: Dict,
+        product_mode: bool
+    ) -> Dict:
+        """步骤6（仅产品模式）"""
+        if not self.is_product_mode:
+            return {}
+        return self._step6_product_assembly(file_hierarchy, image_hierarchy, planning_result, matching_result)
+
+    def _stage_welding_and_safety(
+        self, file_hierarchy: Dict, image_hierarchy: Dict, component_results: List[Dict], product_result: Dict,
+        product_mode: bool
+    ) -> tuple:
+        """步骤7（输出类型随模式变化，因此依赖模式判定）"""
+        return self._step7_welding_and_safety(file_hierarchy, image_hierarchy, component_results, product_result)
+
+    def _stage_integrate_manual(
+        self,
+        planning_result: Dict,
+        enhanced_component_results: List[Dict],
+        enhanced_product_result: Dict,
+        matching_result: Dict,
+        image_hierarchy: Dict
+    ) -> Dict:
+        return self._step8_integrate_manual(
+            planning_result, enhanced_component_results, enhanced_product_result,
+            matching_result, image_hierarchy  # ✅ 传入图片层级结构
+        )
+
+    def _save_stage_timings(self, scheduler: StageScheduler) -> List[Dict]:
+        """保存各阶段的起止时间（stage_timings.json）"""
+        stage_timings = scheduler.timing_report()
+        try:
+            with open(self.output_dir / "stage_timings.json", "w", encoding="utf-8") as f:
+                json.dump(stage_timings, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print_warning(f"保存阶段耗时失败: {e}")
+
+        print_info("⏱️  阶段耗时:")
+        for timing in stage_timings:
+            print_info(f"   • {timing['name']}: {timing['status']} {timing['elapsed_seconds']:.1f}秒", indent=1)
+        return stage_timings
 
     def _determine_mode(self, file_hierarchy: Dict, bom_data: List[Dict]) -> bool:
         """
@@ -282,9 +490,9 @@ class GeminiAssemblyPipeline:
             return components[0].get("pdf")
         return None
     
-    def _step1_classify_and_convert(self, pdf_dir: str, step_dir: str = None) -> tuple:
-        """步骤1: 文件分类 + PDF转图片"""
-        print_substep(f"[{self.current_step}/{self.total_steps}] 📂 文件管理员")
+    def _step1_classify_files(self, pdf_dir: str, step_dir: str = None) -> Dict:
+        """步骤1a: 文件分类"""
+        print_substep(f"{self._step_label(1)} 📂 文件管理员")
 
         self.log_agent_call("文件管理", "查看文件夹里有哪些图纸", "running")
 
@@ -315,7 +523,16 @@ class GeminiAssemblyPipeline:
 
         sys.stdout.flush()
 
-        # PDF转图片
+        # 保存结果
+        with open(self.output_dir / "step1_file_hierarchy.json", "w", encoding="utf-8") as f:
+            json.dump(file_hierarchy, f, ensure_ascii=False, indent=2)
+
+        return file_hierarchy
+
+    def _step1_convert_pdfs_to_images(self, file_hierarchy: Dict) -> Dict:
+        """步骤1b: PDF转图片"""
+        import sys
+
         self.log_agent_call("文件管理", "把PDF转换成图片（AI需要看图片）", "running")
 
         images_dir = self.output_dir / "pdf_images"
@@ -335,17 +552,14 @@ class GeminiAssemblyPipeline:
         self.log_agent_call("文件管理", "整理好了所有图纸和图片", "success")
 
         # 保存结果
-        with open(self.output_dir / "step1_file_hierarchy.json", "w", encoding="utf-8") as f:
-            json.dump(file_hierarchy, f, ensure_ascii=False, indent=2)
-
         with open(self.output_dir / "step1_image_hierarchy.json", "w", encoding="utf-8") as f:
             json.dump(image_hierarchy, f, ensure_ascii=False, indent=2)
 
-        return file_hierarchy, image_hierarchy
-    
+        return image_hierarchy
+
     def _step2_extract_bom_from_pdfs(self, file_hierarchy: Dict) -> List[Dict]:
-        """步骤2: 从PDF提取BOM数据（使用Gemini Vision API）"""
-        print_substep(f"[{self.current_step}/{self.total_steps}] 📊 BOM数据分析员")
+        """步骤2: 从PDF提取BOM数据（优先读取PDF文字层，无法确定的页面再用Gemini Vision API）"""
+        print_substep(f"{self._step_label(2)} 📊 BOM数据分析员")
 
         self.log_agent_call("BOM分析", "从图纸中读取零件清单", "running")
 
@@ -365,15 +579,14 @@ class GeminiAssemblyPipeline:
         # 统计每个PDF的BOM数量
         pdf_bom_counts = {}
 
-        # 从每个PDF提取BOM（使用Gemini Vision API）
+        # 从每个PDF提取BOM（文字层优先，视觉模型兜底）
         for pdf_path in all_pdfs:
             pdf_name = Path(pdf_path).name
             print_info(f"   📖 正在阅读: {pdf_name}", indent=1)
             sys.stdout.flush()
 
             try:
-                # 使用Gemini Vision API提取BOM
-                bom_items = self._extract_bom_with_vision(pdf_path, pdf_name)
+                bom_items = self._extract_bom_from_pdf(pdf_path, pdf_name)
 
                 if bom_items:
                     all_bom_items.extend(bom_items)
@@ -441,148 +654,210 @@ class GeminiAssemblyPipeline:
             print_success(f"   ✅ BOM序号连续性检查通过 (seq {min_seq}-{max_seq})", indent=1)
             sys.stdout.flush()
 
-    def _extract_bom_with_vision(self, pdf_path: str, pdf_name: str) -> List[Dict]:
-        """使用Gemini Vision API从PDF中提取BOM表"""
-        import fitz
-        import base64
-        import io
-        from PIL import Image
-
-        # 将PDF转换为图片
-        doc = fitz.open(pdf_path)
-        images = []
-
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x缩放
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-            # 转换为base64
-            buffered = io.BytesIO()
-            img.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
-            images.append(img_base64)
-
-        doc.close()
-
-        # 构建Gemini Vision API请求（增强版提示词）
-        prompt = f"""你是一个BOM表提取专家。请从这个工程图纸中提取BOM表（零件清单）。
+    def _extract_bom_from_pdf(self, pdf_path: str, pdf_name: str) -> List[Dict]:
+        """
+        提取单个PDF的BOM：先用本地文字层提取器，只有本地无法确定的页面才调用视觉模型
 
-# 如何识别BOM表
-1. 必须有"代号"列，格式为XX.XX.XXXX（至少3段，如01.09.1140）
-2. 必须有"序号"列（数字1, 2, 3...）
-3. 必须有"名称"列（零件名称）
-4. 不要提取"工艺路线"表（只有2段如08.02）
+        - resolved 页：直接使用本地结果
+        - partial 页：保留置信度达标的本地行，其余序号用视觉结果补全
+        - needs_vision 页（扫描件/文字转曲/找不到表头）：页面分诊认为可能含BOM时使用视觉结果
+        - no_bom 页：跳过
+        """
+        if not PERFORMANCE_CONFIG["bom_text_extraction"]:
+            return self._extract_bom_with_vision(pdf_path, pdf_name)
 
-# 输出格式
-返回一个有效的JSON数组。不要markdown，不要解释，不要代码块。
+        min_confidence = PERFORMANCE_CONFIG["bom_text_min_confidence"]
+        try:
+            pages = extract_pdf_bom(pdf_path, min_confidence)
+        except Exception as e:
+            print_warning(f"      文字层读取失败，改用视觉模型: {e}", indent=1)
+            return self._extract_bom_with_vision(pdf_path, pdf_name)
 
-示例：
-[{{"seq":"1","code":"01.09.1140","product_code":"S-AB1830(72IN)-MP1140-01","name":"刷辊组件-漆后","quantity":1,"weight":76.42}}]
+        bom_candidates = set(self._bom_candidate_pages(pdf_path, len(pages)))
+        vision_pages = [
+            p.page_index for p in pages
+            if p.status == "partial" or (p.status == "needs_vision" and p.page_index in bom_candidates)
+        ]
+        resolved_count = sum(1 for p in pages if p.status == "resolved")
+        no_bom_count = sum(1 for p in pages if p.status == "no_bom")
+        print_info(
+            f"      文字层: {resolved_count} 页已解析, {no_bom_count} 页无BOM, {len(vision_pages)} 页需要视觉模型",
+            indent=1
+        )
+        vision_results = self._vision_bom_pages(pdf_path, pdf_name, vision_pages) if vision_pages else {}
 
-# 字段映射
-- seq: 序号（字符串，如"1", "2", "3"）
-- code: 代号（字符串，XX.XX.XXXX格式，至少3段）
-- product_code: 产品代号/规格（字符串，如果没有则为空字符串""）
-- name: 名称（字符串，如果没有则为空字符串""）
-- quantity: 数量（整数）
-- weight: 总重（浮点数，优先使用总重，否则使用单重）
+        all_bom_items = []
+        for page in pages:
+            local_rows = [dict(row, source_pdf=pdf_name) for row in page.rows]
+            if page.status == "resolved":
+                page_items = local_rows
+            elif page.status == "partial":
+                confident = [row for row in local_rows if row["confidence"] >= min_confidence]
+                confident_seqs = {str(row["seq"]) for row in confident}
+                vision_rows = [row for row in vision_results.get(page.page_index, [])
+                               if str(row.get("seq", "")) not in confident_seqs]
+                # 视觉模型没有返回结果时保留全部本地行
+                page_items = confident + vision_rows if vision_rows else local_rows
+            elif page.status == "needs_vision":
+                page_items = vision_results.get(page.page_index, [])
+            else:
+                page_items = []
+            all_bom_items.extend(sorted(page_items, key=self._seq_sort_key))
+        return all_bom_items
 
-# ⚠️ 重要规则（必须遵守）
-1. **必须提取所有行**：不要遗漏任何一行BOM数据，每一行都很重要
-2. **仔细检查表格边界**：BOM表可能跨越多行或多列，确保完整提取
-3. **注意表格分隔**：如果表格有分隔线或空行，继续检查下方是否还有数据
-4. 按seq序号排序（1, 2, 3...）
-5. 如果没有找到BOM表，返回[]
-6. 只返回有效的JSON，不要其他文本
+    def _bom_page_images(self, pdf_path: str, page_indices: List[int]) -> List[str]:
+        """
+        各页发送给视觉模型的图片（base64）
 
-来源PDF: {pdf_name}"""
+        能定位到BOM表区域时只裁剪该区域并提高分辨率（长边约 bom_crop_target_pixels 像素），
+        否则发送整页（2x缩放 = 144 DPI；已有更高DPI渲染时直接缩小复用）。
+        """
+        renderer = get_page_renderer()
+        regions = {}
+        if PERFORMANCE_CONFIG["bom_crop_enable"] and page_indices:
+            try:
+                import fitz
+                with fitz.open(pdf_path) as doc:
+                    for page_num in page_indices:
+                        regions[page_num] = page_bom_region(doc[page_num])
+            except Exception as e:
+                print_warning(f"      BOM区域定位失败，发送整页: {e}", indent=1)
+                regions = {}
 
-        all_bom_items = []
+        images = []
+        for page_num in page_indices:
+            box = regions.get(page_num)
+            if box:
+                dpi = crop_dpi(box, PERFORMANCE_CONFIG["bom_crop_target_pixels"])
+                print_info(f"      第 {page_num+1} 页: 裁剪BOM区域 {box[2]-box[0]:.0f}x{box[3]-box[1]:.0f}pt @ {dpi}DPI", indent=1)
+                images.append(renderer.region_base64(pdf_path, page_num, box, dpi))
+            else:
+                images.append(renderer.page_base64(pdf_path, page_num, 144))
+        return images
 
-        for i, img_base64 in enumerate(images):
-            print_info(f"      正在分析第 {i+1}/{len(images)} 页...", indent=1)
+    def _bom_candidate_pages(self, pdf_path: str, page_count: int) -> List[int]:
+        """页面分诊认为可能含BOM表的页码（分诊关闭或失败时返回全部页）"""
+        if not PERFORMANCE_CONFIG["page_triage"]:
+            return list(range(page_count))
+        try:
+            triage = triage_pdf(pdf_path)
+        except Exception as e:
+            print_warning(f"      页面分诊失败，分析全部页面: {e}", indent=1)
+            return list(range(page_count))
 
-            try:
-                # 调用Gemini Vision API
-                from openai import OpenAI
-                client = OpenAI(
-                    base_url="https://openrouter.ai/api/v1",
-                    api_key=self.api_key
-                )
+        candidates = [page.page_index for page in triage if page.may_have_bom]
+        skipped = len(triage) - len(candidates)
+        if skipped:
+            print_info(f"      页面分诊: {skipped}/{len(triage)} 页无BOM表，跳过视觉分析", indent=1)
+        return candidates
 
-                completion = client.chat.completions.create(
-                    extra_headers={
-                        "HTTP-Referer": "https://mecagent.com",
-                        "X-Title": "MecAgent BOM Extraction"
-                    },
-                    model=self.model_name,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {"url": f"data:image/png;base64,{img_base64}"}
-                                }
-                            ]
-                        }
-                    ],
-                    temperature=0.0,
-                    max_tokens=4096
-                )
+    @staticmethod
+    def _seq_sort_key(item: Dict):
+        seq = str(item.get("seq", ""))
+        return (0, int(seq), "") if seq.isdigit() else (1, 0, seq)
 
-                response = {"content": completion.choices[0].message.content}
+    def _extract_bom_with_vision(self, pdf_path: str, pdf_name: str) -> List[Dict]:
+        """使用Gemini Vision API从PDF的所有页面中提取BOM表"""
+        page_count = get_page_renderer().page_count(pdf_path)
+        page_results = self._vision_bom_pages(pdf_path, pdf_name, self._bom_candidate_pages(pdf_path, page_count))
 
-                # 解析响应
-                content = response.get("content", "").strip()
+        all_bom_items = []
+        for page_index in sorted(page_results):
+            all_bom_items.extend(page_results[page_index])
+        return all_bom_items
 
-                # 尝试提取JSON数组
-                import json
-                import re
+    def _vision_bom_pages(self, pdf_path: str, pdf_name: str, page_indices: List[int]) -> Dict[int, List[Dict]]:
+        """使用Gemini Vision API分析指定页面，返回 {页码: BOM列表}"""
+        images = self._bom_page_images(pdf_path, page_indices)
+
+        # 构建Gemini Vision API请求（增强版提示词；静态，各页/各PDF相同以命中提示词缓存）
+        prompt = BOM_VISION_PROMPT
+
+        # 各页并发分析（受进程级限流器约束）
+        page_results = asyncio.run(self._analyze_bom_pages_async(images, prompt, pdf_name, page_indices))
+        return dict(zip(page_indices, page_results))
+
+    async def _analyze_bom_pages_async(
+        self, images: List[str], prompt: str, pdf_name: str, page_indices: Optional[List[int]] = None
+    ) -> List[List[Dict]]:
+        """并发调用Gemini Vision分析各页，返回与 images 同序的BOM列表（page_indices 为各图对应的页码）"""
+        page_indices = page_indices if page_indices is not None else list(range(len(images)))
+        page_total = max(page_indices) + 1 if page_indices else 0
+        semaphore = asyncio.Semaphore(max(1, PERFORMANCE_CONFIG["bom_vision_page_concurrency"]))
+        retry_policy = RetryPolicy.from_config()
+
+        async with async_openai_client(self.api_key) as client:
+            async def _analyze(i: int, img_base64: str) -> List[Dict]:
+                async with semaphore:
+                    print_info(f"      正在分析第 {i+1}/{page_total} 页...", indent=1)
+                    for attempt in range(retry_policy.max_attempts):
+                        try:
+                            completion = await self._request_bom_page(client, prompt, img_base64, pdf_name)
+                            return self._parse_bom_page_response(completion.content or "", pdf_name, i)
+                        except Exception as e:
+                            error_kind = classify_error(e)
+                            if not retry_policy.should_retry(attempt, error_kind):
+                                print_warning(f"      第 {i+1} 页分析失败 ({error_kind}): {e}", indent=1)
+                                return []
+                            delay = retry_policy.delay(attempt, retry_after_seconds(e))
+                            print_warning(f"      第 {i+1} 页请求失败 ({error_kind})，{delay:.1f}秒后重试", indent=1)
+                            await asyncio.sleep(delay)
+                    return []
+
+            return await asyncio.gather(*[_analyze(i, img) for i, img in zip(page_indices, images)])
+
+    async def _request_bom_page(self, client, prompt: str, img_base64: str, pdf_name: str):
+        """单页BOM视觉请求"""
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    cached_text_part(prompt, self.model_name),  # 各页相同的提示词在前，可命中提示词缓存
+                    {"type": "text", "text": f"来源PDF: {pdf_name}"},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:image/png;base64,{img_base64}"}
+                    }
+                ]
+            }
+        ]
+        response = await cached_chat_completion_async(
+            client,
+            extra_headers={
+                "HTTP-Referer": "https://mecagent.com",
+                "X-Title": "MecAgent BOM Extraction"
+            },
+            model=self.model_name,
+            messages=messages,
+            temperature=0.0,
+            max_tokens=4096,
+            validate=lambda text: isinstance(parse_json_tolerant(text, expect="array").value, list)
+        )
+        get_token_usage_log().record("BOM视觉", estimate_messages_tokens(messages), response.usage)
+        return response
 
-                # 方法1: 直接解析
-                try:
-                    bom_items = json.loads(content)
-                    if isinstance(bom_items, list):
-                        # ✅ 添加source_pdf字段
-                        for item in bom_items:
-                            item["source_pdf"] = pdf_name
-                        all_bom_items.extend(bom_items)
-                        print_info(f"         找到 {len(bom_items)} 个零件", indent=1)
-                        continue
-                except:
-                    pass
-
-                # 方法2: 提取JSON数组
-                json_match = re.search(r'\[.*\]', content, re.DOTALL)
-                if json_match:
-                    try:
-                        bom_items = json.loads(json_match.group(0))
-                        if isinstance(bom_items, list):
-                            # ✅ 添加source_pdf字段
-                            for item in bom_items:
-                                item["source_pdf"] = pdf_name
-                            all_bom_items.extend(bom_items)
-                            print_info(f"         找到 {len(bom_items)} 个零件", indent=1)
-                            continue
-                    except:
-                        pass
-
-                print_info(f"         未找到BOM表", indent=1)
+    def _parse_bom_page_response(self, content: str, pdf_name: str, page_index: int) -> List[Dict]:
+        """解析单页BOM响应（JSON数组，容错解析；截断时保留完整的行），并标注 source_pdf"""
+        parse = parse_json_tolerant(content, expect="array")
+        bom_items = [item for item in parse.value if isinstance(item, dict)] if isinstance(parse.value, list) else None
+        if bom_items is not None and parse.truncated:
+            print_warning(f"         第 {page_index+1} 页响应被截断，保留了 {len(bom_items)} 个完整的行", indent=1)
 
-            except Exception as e:
-                print_warning(f"      第 {i+1} 页分析失败: {e}", indent=1)
-                continue
+        if bom_items is None:
+            print_info(f"         第 {page_index+1} 页未找到BOM表", indent=1)
+            return []
 
-        return all_bom_items
+        # ✅ 添加source_pdf字段
+        for item in bom_items:
+            item["source_pdf"] = pdf_name
+        print_info(f"         第 {page_index+1} 页找到 {len(bom_items)} 个零件", indent=1)
+        return bom_items
 
 
 
-    def _step3_vision_planning(self, image_hierarchy: Dict, bom_data: List[Dict], file_hierarchy: Dict) -> Dict:
+    def _step3_vision_planning(self, image_hierarchy: Optional[Dict], bom_data: List[Dict], file_hierarchy: Dict) -> Dict:
         """步骤3: SimplePlanner - 按BOM序号规划（替代Agent1）"""
-        print_substep(f"[{self.current_step}/{self.total_steps}] 🔍 装配规划师（SimplePlanner）")
+        print_substep(f"{self._step_label(3)} 🔍 装配规划师（SimplePlanner）")
 
         self.log_agent_call("装配规划", "按BOM序号自动生成装配规划", "running")
 
@@ -656,14 +931,36 @@ class GeminiAssemblyPipeline:
         sys.stdout.flush()
         return planning_result
 
-    def _step4_bom_3d_matching(
-        self, step_dir: str, bom_data: List[Dict], planning_result: Dict, file_hierarchy: Dict
-    ) -> Dict:
-        """步骤4: Agent 2 - BOM-3D匹配"""
-        print_substep(f"[{self.current_step}/{self.total_steps}] 🎨 3D模型工程师")
+    def _step4_convert_step_files(self, step_dir: str, file_hierarchy: Dict) -> Dict:
+        """步骤4a: STEP转GLB（只依赖STEP文件，与PDF支路并发执行）"""
+        print_substep(f"{self._step_label(4)} 🎨 3D模型工程师")
 
         self.log_agent_call("3D模型", "将STEP文件转换成网页能看的GLB格式", "running")
 
+        import sys
+        sys.stdout.flush()
+
+        glb_conversions = self.bom_matcher.convert_step_files(
+            step_dir=step_dir,
+            output_dir=str(self.output_dir / "glb_files"),
+            file_hierarchy=file_hierarchy
+        )
+
+        converted = sum(1 for r in glb_conversions["components"].values() if r.get("success"))
+        if glb_conversions.get("product") and glb_conversions["product"].get("success"):
+            converted += 1
+        print_success(f"🧊 他转换了 {converted} 个GLB模型", indent=1)
+        sys.stdout.flush()
+
+        return glb_conversions
+
+    def _step4_bom_3d_matching(
+        self, step_dir: str, bom_data: List[Dict], planning_result: Dict, file_hierarchy: Dict,
+        glb_conversions: Dict = None
+    ) -> Dict:
+        """步骤4b: Agent 2 - BOM-3D匹配"""
+        print_substep(f"{self._step_label(4)} 🎨 3D模型工程师")
+
         component_plans = planning_result.get("component_assembly_plan", [])
 
         import sys
@@ -676,7 +973,8 @@ class GeminiAssemblyPipeline:
             bom_data=bom_data,
             component_plans=component_plans,
             output_dir=str(self.output_dir / "glb_files"),
-            file_hierarchy=file_hierarchy  # ✅ 传入文件层级结构
+            file_hierarchy=file_hierarchy,  # ✅ 传入文件层级结构
+            glb_conversions=glb_conversions  # ✅ 复用转换阶段的GLB
         )
 
         if matching_result["success"]:
@@ -701,7 +999,7 @@ class GeminiAssemblyPipeline:
         self, file_hierarchy: Dict, image_hierarchy: Dict, planning_result: Dict, matching_result: Dict
     ) -> List[Dict]:
         """步骤5: Agent 3 - 组件装配"""
-        print_substep(f"[{self.current_step}/{self.total_steps}] 🔨 组件装配工程师")
+        print_substep(f"{self._step_label(5)} 🔨 组件装配工程师")
 
         component_plans = planning_result.get("component_assembly_plan", [])
         component_level_mappings = matching_result.get("component_level_mappings", {})
@@ -714,104 +1012,56 @@ class GeminiAssemblyPipeline:
             with open(bom_file, 'r', encoding='utf-8') as f:
                 bom_data = json.load(f)
 
-        component_results = []
-
         import sys
 
-        for i, comp_plan in enumerate(component_plans, 1):
-            comp_code = comp_plan.get("component_code", "")
-            comp_name = comp_plan.get("component_name", "")
-            comp_order = comp_plan.get("assembly_order", 0)
-
-            # ✅ 获取实际的组件图序号（从matching_result中获取）
-            drawing_index = comp_order  # 默认值
-            if comp_code in component_level_mappings:
-                drawing_index = component_level_mappings[comp_code].get("drawing_index", comp_order)
-
-            self.log_agent_call(
-                f"组件装配工 #{i}",
-                f"编写【{comp_name}】的装配步骤 (图纸序号={drawing_index})",
-                "running"
-            )
-            sys.stdout.flush()
-
-            # ✅ 使用实际的组件图序号获取图纸
-            component_images = image_hierarchy.get('component_images', {}).get(str(drawing_index), [])
+        # ✅ 各组件的Agent 3调用互相独立，使用有界线程池并发执行
+        max_workers = max(1, min(self.component_concurrency, len(component_plans) or 1))
+        print_info(f"⚙️  并发组件数: {max_workers}（共 {len(component_plans)} 个组件）", indent=1)
+        sys.stdout.flush()
 
-            if not component_images:
-                print_warning(f"未找到组件图{drawing_index}的图片", indent=1)
-                # ✅ 标记为跳过状态，确保前端卡片能收到完成信号
-                self.log_agent_call(
-                    f"组件装配工 #{i}",
-                    f"跳过了工作，因为缺少组件图片",
-                    "skipped"
+        results_by_index = {}
+        finished_count = 0
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="component") as executor:
+            futures = {
+                executor.submit(
+                    bind_task_context(self._process_single_component),
+                    i, comp_plan, file_hierarchy, image_hierarchy, component_level_mappings, bom_data
+                ): (i, comp_plan)
+                for i, comp_plan in enumerate(component_plans, 1)
+            }
+            for future in as_completed(futures):
+                i, comp_plan = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # ✅ 单个组件失败不影响其他组件
+                    comp_name = comp_plan.get("component_name", "")
+                    print_error(f"组件【{comp_name}】处理异常: {e}", indent=1)
+                    self.log_agent_call(f"组件装配工 #{i}", "装配步骤编写", "error")
+                    result = {
+                        "success": False,
+                        "error": str(e),
+                        "component_code": comp_plan.get("component_code", ""),
+                        "component_name": comp_name,
+                        "assembly_order": comp_plan.get("assembly_order", 0),
+                        "assembly_steps": []
+                    }
+                results_by_index[i] = result
+
+                finished_count += 1
+                status = "跳过" if result.get("skipped") else ("成功" if result.get("success") else "失败")
+                print_info(
+                    f"📈 组件进度: {finished_count}/{len(component_plans)} - "
+                    f"{result.get('component_name', '')} {status}",
+                    indent=1
                 )
                 sys.stdout.flush()
 
-                # ✅ 添加一个跳过的结果
-                component_results.append({
-                    "success": False,
-                    "skipped": True,
-                    "component_code": comp_code,
-                    "component_name": comp_name,
-                    "assembly_order": comp_order,
-                    "drawing_index": drawing_index,
-                    "reason": "缺少组件图片"
-                })
-                continue
-
-            # ✅ 使用实际的组件图序号获取BOM列表
-            # 从file_hierarchy中找到对应的组件图名称
-            comp_pdf_name = None
-            for comp in file_hierarchy.get("components", []):
-                if comp.get("index") == drawing_index:
-                    comp_pdf_name = comp.get("name", "")
-                    break
-
-            if not comp_pdf_name:
-                comp_pdf_name = f"组件图{drawing_index}"
-
-            component_bom = [
-                item for item in bom_data
-                if item.get("source_pdf", "").startswith(comp_pdf_name)
-            ]
-
-            # ✅ 获取组件的BOM-3D映射（宽表和旧格式都获取）
-            bom_to_mesh = None
-            bom_mapping_table = None
-
-            if comp_code in component_level_mappings:
-                bom_to_mesh = component_level_mappings[comp_code].get("bom_to_mesh", {})
-                bom_mapping_table = component_level_mappings[comp_code].get("bom_mapping_table", None)
-
-            # 调用Agent 3
-            print_info(f"   📖 他正在研究【{comp_name}】的图纸", indent=1)
-            print_info(f"   📋 组件BOM: {len(component_bom)} 个零件", indent=1)
-            sys.stdout.flush()
-
-            result = self.component_agent.process(
-                component_plan=comp_plan,
-                component_images=component_images,
-                parts_list=component_bom,  # ✅ 传入组件的BOM列表
-                bom_to_mesh_mapping=bom_to_mesh,  # 兼容旧代码
-                bom_mapping_table=bom_mapping_table  # ✅ 新增：传入BOM映射宽表
-            )
-
-            if result["success"]:
-                step_count = len(result.get("assembly_steps", []))
-                print_success(f"   ✅ 生成了 {step_count} 个装配步骤", indent=1)
-                sys.stdout.flush()
-                self.log_agent_call(f"组件装配工 #{i}", f"完成了【{comp_name}】的装配说明", "success")
-            else:
-                self.log_agent_call(f"组件装配工 #{i}", "装配步骤编写", "error")
-
-            # ✅ 添加组件代号、装配顺序和图纸序号到结果中（供后续步骤使用）
-            result["component_code"] = comp_code
-            result["component_name"] = comp_name
-            result["assembly_order"] = comp_order
-            result["drawing_index"] = drawing_index  # ✅ 新增：保存实际的组件图序号
-
-            component_results.append(result)
+        # ✅ 按装配顺序输出（顺序相同时按规划顺序），与串行执行时一致
+        component_results = [
+            results_by_index[i]
+            for i in sorted(results_by_index, key=lambda i: (results_by_index[i].get("assembly_order", 0), i))
+        ]
 
         # ✅ 输出步骤总结
         total_components = len(component_plans)
@@ -830,11 +1080,116 @@ class GeminiAssemblyPipeline:
 
         return component_results
 
+    def _process_single_component(
+        self,
+        i: int,
+        comp_plan: Dict,
+        file_hierarchy: Dict,
+        image_hierarchy: Dict,
+        component_level_mappings: Dict,
+        bom_data: List[Dict]
+    ) -> Dict:
+        """步骤5中的单个组件：调用Agent 3生成装配步骤（在线程池中执行）"""
+        import sys
+
+        comp_code = comp_plan.get("component_code", "")
+        comp_name = comp_plan.get("component_name", "")
+        comp_order = comp_plan.get("assembly_order", 0)
+
+        # ✅ 获取实际的组件图序号（从matching_result中获取）
+        drawing_index = comp_order  # 默认值
+        if comp_code in component_level_mappings:
+            drawing_index = component_level_mappings[comp_code].get("drawing_index", comp_order)
+
+        self.log_agent_call(
+            f"组件装配工 #{i}",
+            f"编写【{comp_name}】的装配步骤 (图纸序号={drawing_index})",
+            "running"
+        )
+        sys.stdout.flush()
+
+        # ✅ 使用实际的组件图序号获取图纸
+        component_images = image_hierarchy.get('component_images', {}).get(str(drawing_index), [])
+
+        if not component_images:
+            print_warning(f"未找到组件图{drawing_index}的图片", indent=1)
+            # ✅ 标记为跳过状态，确保前端卡片能收到完成信号
+            self.log_agent_call(
+                f"组件装配工 #{i}",
+                f"跳过了工作，因为缺少组件图片",
+                "skipped"
+            )
+            sys.stdout.flush()
+
+            # ✅ 返回一个跳过的结果
+            return {
+                "success": False,
+                "skipped": True,
+                "component_code": comp_code,
+                "component_name": comp_name,
+                "assembly_order": comp_order,
+                "drawing_index": drawing_index,
+                "reason": "缺少组件图片"
+            }
+
+        # ✅ 使用实际的组件图序号获取BOM列表
+        # 从file_hierarchy中找到对应的组件图名称
+        comp_pdf_name = None
+        for comp in file_hierarchy.get("components", []):
+            if comp.get("index") == drawing_index:
+                comp_pdf_name = comp.get("name", "")
+                break
+
+        if not comp_pdf_name:
+            comp_pdf_name = f"组件图{drawing_index}"
+
+        component_bom = [
+            item for item in bom_data
+            if item.get("source_pdf", "").startswith(comp_pdf_name)
+        ]
+
+        # ✅ 获取组件的BOM-3D映射（宽表和旧格式都获取）
+        bom_to_mesh = None
+        bom_mapping_table = None
+
+        if comp_code in component_level_mappings:
+            bom_to_mesh = component_level_mappings[comp_code].get("bom_to_mesh", {})
+            bom_mapping_table = component_level_mappings[comp_code].get("bom_mapping_table", None)
+
+        # 调用Agent 3
+        print_info(f"   📖 他正在研究【{comp_name}】的图纸", indent=1)
+        print_info(f"   📋 组件BOM: {len(component_bom)} 个零件", indent=1)
+        sys.stdout.flush()
+
+        result = self.component_agent.process(
+            component_plan=comp_plan,
+            component_images=self._select_images(image_hierarchy, component_images, (ASSEMBLY_VIEW, BOM)),
+            parts_list=component_bom,  # ✅ 传入组件的BOM列表
+            bom_to_mesh_mapping=bom_to_mesh,  # 兼容旧代码
+            bom_mapping_table=bom_mapping_table  # ✅ 新增：传入BOM映射宽表
+        )
+
+        if result["success"]:
+            step_count = len(result.get("assembly_steps", []))
+            print_success(f"   ✅ 生成了 {step_count} 个装配步骤", indent=1)
+            sys.stdout.flush()
+            self.log_agent_call(f"组件装配工 #{i}", f"完成了【{comp_name}】的装配说明", "success")
+        else:
+            self.log_agent_call(f"组件装配工 #{i}", "装配步骤编写", "error")
+
+        # ✅ 添加组件代号、装配顺序和图纸序号到结果中（供后续步骤使用）
+        result["component_code"] = comp_code
+        result["component_name"] = comp_name
+        result["assembly_order"] = comp_order
+        result["drawing_index"] = drawing_index  # ✅ 新增：保存实际的组件图序号
+
+        return result
+
     def _step6_product_assembly(
         self, file_hierarchy: Dict, image_hierarchy: Dict, planning_result: Dict, matching_result: Dict
     ) -> Dict:
         """步骤6: Agent 4 - 产品总装"""
-        print_substep(f"[{self.current_step}/{self.total_steps}] 🏗️ 产品总装工程师")
+        print_substep(f"{self._step_label(6)} 🏗️ 产品总装工程师")
 
         self.log_agent_call("产品总装", "规划如何把组件组装成最终产品", "running")
 
@@ -888,7 +1243,7 @@ class GeminiAssemblyPipeline:
 
         result = self.product_agent.process(
             product_plan=planning_result.get("product_assembly_plan", {}),
-            product_images=product_images,
+            product_images=self._select_images(image_hierarchy, product_images, (ASSEMBLY_VIEW, BOM)),
             components_list=planning_result.get("component_assembly_plan", []),
             product_bom=product_bom,  # ✅ 传入产品级BOM
             bom_to_mesh_mapping=product_bom_to_mesh,  # 兼容旧代码
@@ -917,118 +1272,152 @@ class GeminiAssemblyPipeline:
 
         新逻辑：
         1. Agent 5接收装配步骤+图片，为每个步骤添加焊接要点
-        2. Agent 6接收增强后的步骤，为每个步骤添加安全警告
+        2. Agent 6为每个步骤添加安全警告
         3. 返回增强后的组件和产品装配步骤
-        """
-        print_substep(f"[{self.current_step}/{self.total_steps}] ⚡ 焊接工程师 & 🛡️ 安全专员")
 
-        # ✅ 使用图片而不是PDF
-        all_images = []
-        all_images.extend(image_hierarchy.get('product_images', []))
-        for comp_images in image_hierarchy.get('component_images', {}).values():
-            all_images.extend(comp_images)
+        welding_safety_mode:
+        - parallel：Agent 5/6 基于同一批基础步骤并发执行，按 step_id 合并各自的字段
+        - chained：Agent 6 读取 Agent 5 增强后的步骤（旧行为）
+        """
+        print_substep(f"{self._step_label(7)} ⚡ 焊接工程师 & 🛡️ 安全专员")
 
         import sys
         sys.stdout.flush()
 
-        # ========== Agent 5: 焊接工程师 ==========
-        self.log_agent_call("焊接工程师", "为每个装配步骤添加焊接要点", "running")
-
-        # 处理组件装配步骤
-        enhanced_component_results = []
-        for comp_result in component_results:
+        # 收集需要增强的步骤：key -> (图片, 基础步骤)
+        # 焊接/安全 Agent 按 step_id 返回增量，先保证 step_id 唯一
+        targets = {}
+        final_component_results = []
+        for i, comp_result in enumerate(component_results):
+            comp_result = dict(comp_result)
+            final_component_results.append(comp_result)
             if not comp_result.get("success"):
-                enhanced_component_results.append(comp_result)
                 continue
 
-            assembly_steps = comp_result.get("assembly_steps", [])
-
             # ✅ 使用assembly_order来获取组件图片
             assembly_order = comp_result.get("assembly_order", "")
-            component_images = image_hierarchy.get('component_images', {}).get(str(assembly_order), [])
+            component_images = self._select_images(
+                image_hierarchy,
+                image_hierarchy.get('component_images', {}).get(str(assembly_order), []),
+                (ASSEMBLY_VIEW, DETAIL)
+            )
+            assembly_steps = ensure_step_ids(
+                comp_result.get("assembly_steps", []),
+                comp_result.get("component_code") or f"component_{assembly_order}"
+            )
+            comp_result["assembly_steps"] = assembly_steps
+            targets[f"component_{i}"] = (component_images, assembly_steps)
 
-            welding_result = self.welding_agent.process(
-                all_images=component_images,
-                assembly_steps=assembly_steps
+        final_product_result = product_result.copy()
+        if product_result.get("success"):
+            product_steps = ensure_step_ids(product_result.get("assembly_steps", []), "product")
+            final_product_result["assembly_steps"] = product_steps
+            product_images = self._select_images(
+                image_hierarchy, image_hierarchy.get('product_images', []), (ASSEMBLY_VIEW, DETAIL)
             )
+            targets["product"] = (product_images, product_steps)
 
-            # 将焊接要点嵌入到步骤中
-            if welding_result.get("success"):
-                enhanced_steps = welding_result.get("enhanced_steps", assembly_steps)
-                comp_result["assembly_steps"] = enhanced_steps
+        if self.welding_safety_mode == "chained":
+            enhanced_steps = self._enhance_steps_chained(targets)
+        else:
+            enhanced_steps = self._enhance_steps_parallel(targets)
 
-            enhanced_component_results.append(comp_result)
+        for i, comp_result in enumerate(final_component_results):
+            if f"component_{i}" in enhanced_steps:
+                comp_result["assembly_steps"] = enhanced_steps[f"component_{i}"]
+        if "product" in enhanced_steps:
+            final_product_result["assembly_steps"] = enhanced_steps["product"]
 
-        # 处理产品装配步骤
-        enhanced_product_result = product_result.copy()
-        if product_result.get("success"):
-            product_steps = product_result.get("assembly_steps", [])
-            product_images = image_hierarchy.get('product_images', [])
+        # ✅ 保存增强后的结果（合并成一个文件，避免生成空文件）
+        enhanced_result = {
+            "type": "product" if self.is_product_mode else "component",
+            "component_results": final_component_results,  # 组件模式时有数据，产品模式时为[]
+            "product_result": final_product_result  # 产品模式时有数据，组件模式时为{}
+        }
 
-            welding_result = self.welding_agent.process(
-                all_images=product_images,
-                assembly_steps=product_steps
-            )
+        with open(self.output_dir / "step7_enhanced_result.json", "w", encoding="utf-8") as f:
+            json.dump(enhanced_result, f, ensure_ascii=False, indent=2)
 
-            if welding_result.get("success"):
-                enhanced_steps = welding_result.get("enhanced_steps", product_steps)
-                enhanced_product_result["assembly_steps"] = enhanced_steps
+        return final_component_results, final_product_result
 
+    @staticmethod
+    def _select_images(image_hierarchy: Dict, images: List[str], labels: tuple) -> List[str]:
+        """按页面分诊标签挑选发送给Agent的图纸（焊接符号在视图上，BOM页对焊接无用）"""
+        return select_page_images(image_hierarchy, images, labels, enabled=PERFORMANCE_CONFIG["page_triage"])
+
+    def _run_welding(self, images: List[str], steps: List[Dict]) -> List[Dict]:
+        """Agent 5：失败时返回原步骤"""
+        welding_result = self.welding_agent.process(all_images=images, assembly_steps=steps)
+        if welding_result.get("success"):
+            return welding_result.get("enhanced_steps", steps)
+        return steps
+
+    def _run_safety(self, steps: List[Dict]) -> List[Dict]:
+        """Agent 6：失败时返回原步骤"""
+        safety_result = self.safety_agent.process(assembly_steps=steps)
+        if safety_result.get("success"):
+            return safety_result.get("enhanced_steps", steps)
+        return steps
+
+    def _enhance_steps_chained(self, targets: Dict[str, tuple]) -> Dict[str, List[Dict]]:
+        """串行：先为所有步骤添加焊接要点，再在焊接增强后的步骤上添加安全警告"""
+        import sys
+
+        # ========== Agent 5: 焊接工程师 ==========
+        self.log_agent_call("焊接工程师", "为每个装配步骤添加焊接要点", "running")
+        welded = {key: self._run_welding(images, steps) for key, (images, steps) in targets.items()}
         print_success(f"⚡ 焊接要点已嵌入到装配步骤中", indent=1)
         sys.stdout.flush()
         self.log_agent_call("焊接工程师", "完成焊接要点标注", "success")
 
         # ========== Agent 6: 安全专员 ==========
         self.log_agent_call("安全专员", "为每个装配步骤添加安全警告", "running")
+        enhanced = {key: self._run_safety(steps) for key, steps in welded.items()}
+        print_success(f"🛡️ 安全警告已嵌入到装配步骤中", indent=1)
+        sys.stdout.flush()
+        self.log_agent_call("安全专员", "完成安全警告标注", "success")
+        return enhanced
 
-        # 处理组件装配步骤
-        final_component_results = []
-        for comp_result in enhanced_component_results:
-            if not comp_result.get("success"):
-                final_component_results.append(comp_result)
-                continue
-
-            assembly_steps = comp_result.get("assembly_steps", [])
-
-            safety_result = self.safety_agent.process(
-                assembly_steps=assembly_steps
-            )
-
-            # 将安全警告嵌入到步骤中
-            if safety_result.get("success"):
-                enhanced_steps = safety_result.get("enhanced_steps", assembly_steps)
-                comp_result["assembly_steps"] = enhanced_steps
+    def _enhance_steps_parallel(self, targets: Dict[str, tuple]) -> Dict[str, List[Dict]]:
+        """
+        并发：所有组件/产品的焊接与安全调用基于同一批基础步骤同时执行
 
-            final_component_results.append(comp_result)
+        合并时 welding 字段只取自 Agent 5，safety_warnings 只取自 Agent 6，
+        结果与完成顺序无关；任一调用异常时该部分保留基础步骤。
+        """
+        import sys
 
-        # 处理产品装配步骤
-        final_product_result = enhanced_product_result.copy()
-        if enhanced_product_result.get("success"):
-            product_steps = enhanced_product_result.get("assembly_steps", [])
+        self.log_agent_call("焊接工程师", "为每个装配步骤添加焊接要点", "running")
+        self.log_agent_call("安全专员", "为每个装配步骤添加安全警告", "running")
 
-            safety_result = self.safety_agent.process(
-                assembly_steps=product_steps
-            )
+        jobs = {}
+        for key, (images, steps) in targets.items():
+            jobs[(key, "welding")] = (self._run_welding, (images, steps))
+            jobs[(key, "safety")] = (self._run_safety, (steps,))
+
+        outputs = {}
+        max_workers = max(1, min(self.component_concurrency * 2, len(jobs) or 1))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="enhance") as executor:
+            futures = {executor.submit(bind_task_context(func), *args): job for job, (func, args) in jobs.items()}
+            for future in as_completed(futures):
+                key, kind = futures[future]
+                try:
+                    outputs[(key, kind)] = future.result()
+                except Exception as e:
+                    print_error(f"{key} 的{'焊接' if kind == 'welding' else '安全'}增强异常: {e}", indent=1)
+                    outputs[(key, kind)] = targets[key][1]
 
-            if safety_result.get("success"):
-                enhanced_steps = safety_result.get("enhanced_steps", product_steps)
-                final_product_result["assembly_steps"] = enhanced_steps
+        enhanced = {}
+        for key, (_, steps) in targets.items():
+            merged = overlay_step_fields(steps, outputs[(key, "welding")], ("welding",))
+            enhanced[key] = overlay_step_fields(merged, outputs[(key, "safety")], ("safety_warnings",))
 
+        print_success(f"⚡ 焊接要点已嵌入到装配步骤中", indent=1)
         print_success(f"🛡️ 安全警告已嵌入到装配步骤中", indent=1)
         sys.stdout.flush()
+        self.log_agent_call("焊接工程师", "完成焊接要点标注", "success")
         self.log_agent_call("安全专员", "完成安全警告标注", "success")
-
-        # ✅ 保存增强后的结果（合并成一个文件，避免生成空文件）
-        enhanced_result = {
-            "type": "product" if self.is_product_mode else "component",
-            "component_results": final_component_results,  # 组件模式时有数据，产品模式时为[]
-            "product_result": final_product_result  # 产品模式时有数据，组件模式时为{}
-        }
-
-        with open(self.output_dir / "step7_enhanced_result.json", "w", encoding="utf-8") as f:
-            json.dump(enhanced_result, f, ensure_ascii=False, indent=2)
-
-        return final_component_results, final_product_result
+        return enhanced
 
     def _step8_integrate_manual(
         self,
@@ -1043,7 +1432,7 @@ class GeminiAssemblyPipeline:
 
         注意：component_results和product_result已经包含了焊接和安全信息
         """
-        print_substep(f"[{self.current_step}/{self.total_steps}] 📚 手册编辑员")
+        print_substep(f"{self._step_label(8)} 📚 手册编辑员")
 
         self.log_agent_call("手册编辑", "把所有工程师的成果整合成一本完整的说明书", "running")
 
@@ -0,0 +1,159 @@
+"""GLB 转换缓存：按 (STEP内容哈希, 缩放因子, 转换器版本) 缓存转换结果（GLB + parts_info），相同STEP再次上传/任务重新生成时直接复用。"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from config import CACHE_CONFIG
+from core.stage_checkpoint import hash_file
+from utils.logger import get_current_task
+
+_GLB_NAME = "model.glb"
+_META_NAME = "meta.json"
+# 不随缓存条目保存的字段（与本次调用的输出位置有关）
+_VOLATILE_FIELDS = ("output_path", "log", "cache_hit")
+
+
+def _place(source: Path, dest: Path) -> str:
+    """把 source 放到 dest：优先硬链接（同一文件系统），否则复制；返回方式"""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # 先删除旧文件：dest 可能是另一个缓存条目的硬链接，原地覆盖会破坏缓存
+    dest.unlink(missing_ok=True)
+    try:
+        os.link(source, dest)
+        return "link"
+    except OSError:
+        tmp = dest.with_name(dest.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, dest)
+        return "copy"
+
+
+class GlbConversionCache:
+    """
+    GLB 转换缓存
+
+    - 磁盘：{directory}/{key}/model.glb + meta.json（转换结果，含 parts_info）
+    - 命中时硬链接（跨文件系统时复制）到任务的 glb_files/ 目录
+    - 总大小超过 max_bytes 时按最近使用时间淘汰
+    - 同一 key 并发转换时只转换一次（key 锁）
+    - 按任务ID（utils.logger 的当前任务上下文）统计：命中、未命中、写入、复用的GLB字节数
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._counters: Dict[Optional[str], Counter] = {}
+        self._lock = threading.Lock()
+        self._total_bytes = sum(p.stat().st_size for p in self.directory.glob(f"*/{_GLB_NAME}"))
+
+    # ---------- 键 ----------
+    def step_digest(self, step_path: str) -> str:
+        """STEP 内容哈希（按路径+修改时间+大小记忆化）"""
+        stat = os.stat(step_path)
+        memo_key = (str(Path(step_path).resolve()), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(memo_key)
+        if digest is None:
+            digest = hash_file(Path(step_path))
+            with self._lock:
+                self._digests[memo_key] = digest
+        return digest
+
+    def make_key(self, step_path: str, scale_factor: float, version: str) -> str:
+        raw = f"{self.step_digest(step_path)}|{float(scale_factor)!r}|{version}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    # ---------- 读写 ----------
+    def fetch(self, key: str, output_path: str) -> Optional[Dict]:
+        """命中时把缓存的GLB放到 output_path，返回转换结果；未命中返回 None"""
+        entry = self.directory / key
+        glb, meta_path = entry / _GLB_NAME, entry / _META_NAME
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            method = _place(glb, Path(output_path))
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+
+        os.utime(meta_path)
+        self._count("hits")
+        self._count("bytes_reused", glb.stat().st_size)
+        return {**meta, "output_path": output_path, "cache_hit": True, "cache_placement": method}
+
+    def store(self, key: str, output_path: str, result: Dict) -> None:
+        """转换成功后写入缓存（GLB 与 output_path 共用同一文件或复制一份）"""
+        entry = self.directory / key
+        tmp_entry = self.directory / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            tmp_entry.mkdir(parents=True)
+            _place(Path(output_path), tmp_entry / _GLB_NAME)
+            meta = {k: v for k, v in result.items() if k not in _VOLATILE_FIELDS}
+            (tmp_entry / _META_NAME).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        self._count("stores")
+        self._account((entry / _GLB_NAME).stat().st_size)
+
+    # ---------- 统计 / 淘汰 ----------
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters.setdefault(get_current_task(), Counter())[name] += amount
+
+    def stats(self, task_id: Optional[str] = None) -> Dict[str, int]:
+        """指定任务的缓存统计（task_id 为 None 时取当前任务）"""
+        task_id = task_id if task_id is not None else get_current_task()
+        with self._lock:
+            counter = self._counters.get(task_id, Counter())
+            return {name: counter[name] for name in ("hits", "misses", "stores", "bytes_reused")}
+
+    def _account(self, size: int) -> None:
+        with self._lock:
+            self._total_bytes += size
+            if self._total_bytes <= self.max_bytes:
+                return
+            target = int(self.max_bytes * 0.9)
+            entries = sorted(
+                (p.parent for p in self.directory.glob(f"*/{_META_NAME}")),
+                key=lambda p: (p / _META_NAME).stat().st_mtime
+            )
+            for entry in entries:
+                if self._total_bytes <= target:
+                    break
+                try:
+                    size = (entry / _GLB_NAME).stat().st_size
+                    shutil.rmtree(entry)
+                    self._total_bytes -= size
+                except OSError:
+                    continue
+
+
+_cache: Optional[GlbConversionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_glb_cache() -> GlbConversionCache:
+    """进程内共享的GLB转换缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GlbConversionCache(CACHE_CONFIG["directory"] / "glb_conversions", CACHE_CONFIG["glb_conversions_max_size"])
+        return _cache
@@ -5,11 +5,14 @@
 """
 
 import json
+from concurrent.futures import as_completed
 from typing import Dict, List
 from pathlib import Path
 from processors.file_processor import ModelProcessor
 from processors.step_to_glb_converter import StepToGlbConverter
+from processors.step_tessellation import TessellationJob, default_runner, submit_conversions
 from core.bom_3d_matcher import match_bom_to_3d  # ✅ 使用完整版的匹配函数
+from core.scene_registry import SceneRegistry
 
 from utils.logger import print_step, print_substep, print_info, print_success, print_error, print_warning
 
@@ -28,7 +31,8 @@ class HierarchicalBOMMatcher:
         bom_data: List[Dict],
         component_plans: List[Dict],
         output_dir: str,
-        file_hierarchy: Dict = None
+        file_hierarchy: Dict = None,
+        glb_conversions: Dict = None
     ) -> Dict:
         """
         分层级处理STEP文件和BOM匹配
@@ -39,6 +43,7 @@ class HierarchicalBOMMatcher:
             component_plans: 组件规划列表（来自Agent 1）
             output_dir: GLB输出目录
             file_hierarchy: 文件层级结构（包含组件图的实际序号）
+            glb_conversions: convert_step_files 的结果（可选，缺失的文件在此现场转换）
 
         Returns:
             {
@@ -66,6 +71,9 @@ class HierarchicalBOMMatcher:
         component_level_mappings = {}
         product_level_mapping = {}
         glb_files = {}
+        inventory = {}
+        # 任务内场景注册表：每个GLB只解析一次，爆炸视图与GLB清单共用，清单生成后立即释放
+        scenes = SceneRegistry()
 
         # ========== 1. 处理组件级别 ==========
         print_substep("步骤1：处理组件级别的STEP文件")
@@ -86,10 +94,19 @@ class HierarchicalBOMMatcher:
                 for i, plan in enumerate(component_plans)
             ]
 
+        # 没有转换阶段的结果时，一次提交全部STEP并行网格化，先完成的组件先进入匹配
+        pending = {}
+        if glb_conversions is None:
+            planned = {plan.get("assembly_order") for plan in component_plans}
+            jobs = self._tessellation_jobs(
+                [c for c in components_from_files if c.get("index") in planned],
+                file_hierarchy, step_path, glb_output
+            )
+            pending = submit_conversions(jobs, self.step_converter)
+
         for comp_file_info in components_from_files:
             file_index = comp_file_info.get("index")  # 文件序号（组件图X 中的 X）
             file_name = comp_file_info.get("name", f"组件图{file_index}")
-            step_path_from_hierarchy = comp_file_info.get("step")
 
             # 查找对应的 AI 规划（通过 assembly_order 匹配）
             comp_plan = None
@@ -110,51 +127,26 @@ class HierarchicalBOMMatcher:
 
             print_info(f"\n处理组件: {comp_name} (文件序号={file_index}, 装配顺序={comp_order})")
 
-            # ✅ 优先使用 file_hierarchy 中记录的真实 STEP 路径
-            step_file = None
-            if step_path_from_hierarchy:
-                candidate = Path(step_path_from_hierarchy)
-                if candidate.exists():
-                    step_file = candidate
-
-            # 若未找到，再按历史命名回退
+            step_file = self._resolve_component_step(comp_file_info, step_path)
             if not step_file:
-                possible_names = [
-                    f"组件图{file_index}.STEP",
-                    f"组件图{file_index}.step",
-                    f"组件{file_index}.STEP",
-                    f"组件{file_index}.step",
-                    f"组件图{file_index}.stp",
-                    f"组件{file_index}.stp"
-                ]
-
-                for name in possible_names:
-                    candidate = step_path / name
-                    if candidate.exists():
-                        step_file = candidate
-                        break
-
-                if not step_file:
-                    print_warning(f"组件图{file_index}的STEP文件不存在（尝试了: {', '.join(possible_names)}）", indent=1)
-                    continue
+                print_warning(f"组件图{file_index}的STEP文件不存在", indent=1)
+                continue
 
             print_info(f"STEP文件: {step_file.name}", indent=1)
 
             # ✅ 使用文件序号命名GLB文件
             glb_file = glb_output / f"component_{file_index}.glb"
-            print_info(f"开始转换STEP -> GLB: {glb_file.name}", indent=1)
 
-            import sys
-            sys.stdout.flush()
-
-            convert_result = self.step_converter.convert(
-                step_path=str(step_file),
-                output_path=str(glb_file),
-                scale_factor=0.001  # mm -> m
-            )
+            # ✅ 优先复用转换阶段（与PDF支路并发执行）的结果
+            convert_result = (glb_conversions or {}).get("components", {}).get(file_index)
+            future = pending.get(("component", file_index))
+            if future is not None:
+                convert_result = future.result()
+            elif convert_result is None:
+                convert_result = self._convert_step(step_file, glb_file)
+            else:
+                print_info(f"复用已完成的GLB转换: {glb_file.name}", indent=1)
 
-            sys.stdout.flush()
-            
             if not convert_result["success"]:
                 print_error(f"GLB转换失败: {convert_result.get('error')}", indent=1)
                 continue
@@ -250,7 +242,8 @@ class HierarchicalBOMMatcher:
                 explosion_result = self.model_processor.generate_explosion_data(
                     glb_path=str(glb_file),
                     assembly_spec={},  # 组件级别暂时不需要装配规程
-                    output_dir=str(glb_output)
+                    output_dir=str(glb_output),
+                    scenes=scenes
                 )
 
                 if explosion_result["success"]:
@@ -286,6 +279,7 @@ class HierarchicalBOMMatcher:
                 # ✅ 使用组件代号作为 key，若缺失则使用 component_X
                 glb_key = comp_code or f"component_{file_index}"
                 glb_files[glb_key] = str(glb_file)
+                self._collect_inventory(scenes, inventory, glb_key, glb_file)
             else:
                 if not parts_list:
                     print_warning("没有提取到零件信息", indent=1)
@@ -294,50 +288,30 @@ class HierarchicalBOMMatcher:
                 # 即便未匹配成功，也记录 GLB，便于前端加载
                 glb_key = comp_code or f"component_{file_index}"
                 glb_files[glb_key] = str(glb_file)
+                self._collect_inventory(scenes, inventory, glb_key, glb_file)
         
         print_success(f"组件级别处理完成: {len(component_level_mappings)} 个组件")
         
         # ========== 2. 处理产品级别 ==========
         print_substep("步骤2：处理产品级别的STEP文件")
         
-        # 查找产品总图的STEP文件（优先使用 file_hierarchy 中的真实文件名）
-        product_step = None
         product_info = file_hierarchy.get("product") if isinstance(file_hierarchy, dict) else None
-        if isinstance(product_info, dict) and product_info.get("step"):
-            candidate = Path(product_info["step"])
-            if candidate.exists():
-                product_step = candidate
+        product_step = self._resolve_product_step(file_hierarchy, step_path)
 
-        # 回退：尝试多种可能的产品STEP文件名
-        if not product_step:
-            possible_product_names = [
-                "产品测试.STEP",
-                "产品总图.STEP",
-                "产品主图.STEP",
-                "产品测试.step",
-                "产品总图.step",
-                "产品主图.step",
-                "产品测试.stp",
-                "产品总图.stp",
-                "产品主图.stp",
-            ]
-            for name in possible_product_names:
-                candidate = step_path / name
-                if candidate.exists():
-                    product_step = candidate
-                    break
-
-        if product_step and product_step.exists():
+        if product_step:
             print_info(f"处理产品总图: {product_step.name}")
-            
-            # 转换为GLB
+
+            # 转换为GLB（优先复用转换阶段的结果）
             product_glb = glb_output / "product_total.glb"
-            convert_result = self.step_converter.convert(
-                step_path=str(product_step),
-                output_path=str(product_glb),
-                scale_factor=0.001
-            )
-            
+            convert_result = (glb_conversions or {}).get("product")
+            future = pending.get(("product", None))
+            if future is not None:
+                convert_result = future.result()
+            elif convert_result is None:
+                convert_result = self._convert_step(product_step, product_glb)
+            else:
+                print_info(f"复用已完成的GLB转换: {product_glb.name}", indent=1)
+
             if convert_result["success"]:
                 parts_list = convert_result.get("parts_info", [])
                 print_success(f"GLB转换成功: {len(parts_list)} 个零件", indent=1)
@@ -347,7 +321,8 @@ class HierarchicalBOMMatcher:
                 explosion_result = self.model_processor.generate_explosion_data(
                     glb_path=str(product_glb),
                     assembly_spec={},  # 产品级别暂时不需要装配规程
-                    output_dir=str(glb_output)
+                    output_dir=str(glb_output),
+                    scenes=scenes
                 )
 
                 if explosion_result["success"]:
@@ -472,6 +447,7 @@ class HierarchicalBOMMatcher:
                 }
 
                 glb_files["product_total"] = str(product_glb)
+                self._collect_inventory(scenes, inventory, "product_total", product_glb)
             else:
                 print_error(f"GLB转换失败: {convert_result.get('error')}", indent=1)
         else:
@@ -487,21 +463,15 @@ class HierarchicalBOMMatcher:
             print_info(f"产品级别: BOM {product_level_mapping['bom_matched_count']}/{product_level_mapping['total_bom_count']} ({product_level_mapping['matching_rate']*100:.1f}%)")
 
         # ========== 4. 生成 GLB 清单（step3_glb_inventory.json，用于调试） ==========
+        # 各GLB的清单已在处理时生成（复用爆炸视图加载的场景）
+        scenes.release_all()
+        scene_stats = scenes.stats()
+        print_info(
+            f"🧠 场景注册表: 解析 {scene_stats['loads']} 次, 复用 {scene_stats['reuses']} 次, "
+            f"峰值几何内存 {scene_stats['peak_bytes'] / 1024 / 1024:.1f}MB"
+        )
         try:
-            inventory = {}
-            print_info(f"开始生成 GLB 清单，共 {len(glb_files)} 个 GLB 文件...")
-            for key, glb_path in glb_files.items():
-                print_info(f"  处理 {key}: {glb_path}", indent=1)
-                inv = self.model_processor.generate_glb_inventory(
-                    glb_path=glb_path,
-                    output_path=None
-                )
-                if inv.get("success"):
-                    print_info(f"    ✅ 节点数: {inv.get('nodes_total', 0)}, 几何体数: {inv.get('geometry_total', 0)}", indent=1)
-                else:
-                    print_warning(f"    ⚠️ 生成失败: {inv.get('error', '未知错误')}", indent=1)
-                inventory[key] = inv
-
+            print_info(f"GLB 清单共 {len(inventory)} 个 GLB 文件")
             inventory_path = Path(output_dir).parent / "step3_glb_inventory.json"
             print_info(f"保存到: {inventory_path}")
             with open(inventory_path, "w", encoding="utf-8") as f:
@@ -518,9 +488,147 @@ class HierarchicalBOMMatcher:
             "success": True,
             "component_level_mappings": component_level_mappings,
             "product_level_mapping": product_level_mapping,
-            "glb_files": glb_files
+            "glb_files": glb_files,
+            "scene_registry": scene_stats
         }
     
+    def _collect_inventory(self, scenes: SceneRegistry, inventory: Dict, key: str, glb_path) -> None:
+        """生成单个GLB的节点/几何清单（复用已加载的场景），随后释放该场景"""
+        print_info(f"生成 GLB 清单 {key}: {glb_path}", indent=1)
+        inv = self.model_processor.generate_glb_inventory(glb_path=str(glb_path), output_path=None, scenes=scenes)
+        if inv.get("success"):
+            print_info(f"  ✅ 节点数: {inv.get('nodes_total', 0)}, 几何体数: {inv.get('geometry_total', 0)}", indent=1)
+        else:
+            print_warning(f"  ⚠️ 生成失败: {inv.get('error', '未知错误')}", indent=1)
+        inventory[key] = inv
+        scenes.release(str(glb_path))
+
+    def convert_step_files(self, step_dir: str, output_dir: str, file_hierarchy: Dict) -> Dict:
+        """
+        只做STEP -> GLB转换（不依赖BOM和规划，可与PDF支路并发执行）
+
+        Args:
+            step_dir: STEP文件目录
+            output_dir: GLB输出目录
+            file_hierarchy: 文件层级结构
+
+        Returns:
+            {
+                "components": {文件序号: convert_result},
+                "product": convert_result 或 None
+            }
+        """
+        step_path = Path(step_dir)
+        glb_output = Path(output_dir)
+        glb_output.mkdir(parents=True, exist_ok=True)
+
+        conversions = {"components": {}, "product": None}
+
+        jobs = self._tessellation_jobs(
+            (file_hierarchy or {}).get("components", []), file_hierarchy, step_path, glb_output
+        )
+        print_info(f"并行转换STEP -> GLB: {len(jobs)} 个文件", indent=1)
+        futures = submit_conversions(jobs, self.step_converter)
+        names = {job.key: Path(job.output_path).name for job in jobs}
+        keys = {future: key for key, future in futures.items()}
+
+        # 按完成顺序收集结果
+        for future in as_completed(futures.values()):
+            key = keys[future]
+            convert_result = future.result()
+            if convert_result.get("success"):
+                print_success(f"GLB转换完成: {names[key]}", indent=1)
+            else:
+                print_error(f"GLB转换失败: {names[key]} - {convert_result.get('error')}", indent=1)
+            if key[0] == "product":
+                conversions["product"] = convert_result
+            else:
+                conversions["components"][key[1]] = convert_result
+
+        return conversions
+
+    def _tessellation_jobs(self, components: List[Dict], file_hierarchy: Dict, step_path: Path, glb_output: Path) -> List[TessellationJob]:
+        """为组件与产品总图的STEP生成转换任务（找不到STEP文件的跳过）"""
+        jobs = []
+        for comp_file_info in components:
+            file_index = comp_file_info.get("index")
+            step_file = self._resolve_component_step(comp_file_info, step_path)
+            if step_file:
+                jobs.append(TessellationJob(
+                    ("component", file_index), str(step_file), str(glb_output / f"component_{file_index}.glb")
+                ))
+
+        product_step = self._resolve_product_step(file_hierarchy, step_path)
+        if product_step:
+            jobs.append(TessellationJob(("product", None), str(product_step), str(glb_output / "product_total.glb")))
+        return jobs
+
+    def _convert_step(self, step_file: Path, glb_file: Path) -> Dict:
+        """转换单个STEP文件"""
+        print_info(f"开始转换STEP -> GLB: {step_file.name} -> {glb_file.name}", indent=1)
+
+        import sys
+        sys.stdout.flush()
+
+        convert_result = self.step_converter.convert(
+            step_path=str(step_file),
+            output_path=str(glb_file),
+            scale_factor=0.001,  # mm -> m
+            runner=default_runner()
+        )
+
+        sys.stdout.flush()
+        return convert_result
+
+    def _resolve_component_step(self, comp_file_info: Dict, step_path: Path):
+        """查找组件的STEP文件：优先使用 file_hierarchy 中记录的真实路径，否则按历史命名回退"""
+        step_path_from_hierarchy = comp_file_info.get("step")
+        if step_path_from_hierarchy:
+            candidate = Path(step_path_from_hierarchy)
+            if candidate.exists():
+                return candidate
+
+        file_index = comp_file_info.get("index")
+        possible_names = [
+            f"组件图{file_index}.STEP",
+            f"组件图{file_index}.step",
+            f"组件{file_index}.STEP",
+            f"组件{file_index}.step",
+            f"组件图{file_index}.stp",
+            f"组件{file_index}.stp"
+        ]
+        for name in possible_names:
+            candidate = step_path / name
+            if candidate.exists():
+                return candidate
+        return None
+
+    def _resolve_product_step(self, file_hierarchy: Dict, step_path: Path):
+        """查找产品总图的STEP文件（优先使用 file_hierarchy 中的真实文件名）"""
+        product_info = file_hierarchy.get("product") if isinstance(file_hierarchy, dict) else None
+        if isinstance(product_info, dict) and product_info.get("step"):
+            candidate = Path(product_info["step"])
+            if candidate.exists():
+                return candidate
+
+        # 回退：尝试多种可能的产品STEP文件名
+        possible_product_names = [
+            "产品测试.STEP",
+            "产品总图.STEP",
+            "产品主图.STEP",
+            "产品测试.step",
+            "产品总图.step",
+            "产品主图.step",
+            "产品测试.stp",
+            "产品总图.stp",
+            "产品主图.stp",
+        ]
+        for name in possible_product_names:
+            candidate = step_path / name
+            if candidate.exists():
+                return candidate
+        return None
+
     def _get_component_bom(self, bom_data: List[Dict], comp_plan: Dict, drawing_index: int = None, file_name: str = "") -> List[Dict]:
         """
         获取组件的BOM数据（只包含组件内部的零件）
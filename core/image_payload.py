@@ -0,0 +1,183 @@
+"""多模态请求的图片载荷优化：线稿转灰度/调色板、限制长边、按体积选择 PNG-8 或 JPEG，并按任务统计节省的字节数。"""
+
+from __future__ import annotations
+
+import base64
+import io
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from config import CACHE_CONFIG, PERFORMANCE_CONFIG
+from core.page_render import PayloadLRU
+from utils.logger import get_current_task
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    """
+    图片处理参数（参与记忆化键）
+
+    max_long_edge: 长边像素上限（0 表示不缩放）
+    line_drawing: 检测到线稿（低饱和度、中间调很少）时转为灰度/调色板
+    palette_colors: 线稿 PNG-8 的调色板颜色数
+    jpeg_quality: JPEG 候选的质量
+    """
+
+    max_long_edge: int = 2048
+    line_drawing: bool = True
+    palette_colors: int = 16
+    jpeg_quality: int = 85
+
+    @classmethod
+    def from_config(cls, **overrides) -> "ImageProfile":
+        values = {
+            "max_long_edge": PERFORMANCE_CONFIG["image_max_long_edge"],
+            "line_drawing": PERFORMANCE_CONFIG["image_line_drawing_mode"],
+            "palette_colors": PERFORMANCE_CONFIG["image_palette_colors"],
+            "jpeg_quality": PERFORMANCE_CONFIG["image_jpeg_quality"],
+        }
+        values.update(overrides)
+        return cls(**values)
+
+
+def _is_line_drawing(img) -> bool:
+    """低饱和度且中间调像素很少的图片视为线稿（工程图纸）"""
+    sample = img.convert("RGB")
+    sample.thumbnail((256, 256))
+    saturation = sample.convert("HSV").getchannel("S")
+    histogram = saturation.histogram()
+    mean_saturation = sum(i * n for i, n in enumerate(histogram)) / max(1, sum(histogram))
+    if mean_saturation > 25:
+        return False
+    luminance = sample.convert("L").histogram()
+    midtones = sum(luminance[40:216]) / max(1, sum(luminance))
+    return midtones < 0.2
+
+
+def optimize_image_bytes(data: bytes, profile: ImageProfile) -> Tuple[str, bytes]:
+    """
+    返回 (mime, 编码后的字节)；取候选中体积最小的一个
+
+    未缩放时原始字节也作为候选，保证结果不会比原图大。
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        original_format = (source.format or "PNG").upper()
+        img = source.copy()
+
+    resized = False
+    if profile.max_long_edge and max(img.size) > profile.max_long_edge:
+        img.thumbnail((profile.max_long_edge, profile.max_long_edge), Image.LANCZOS)
+        resized = True
+
+    candidates = []
+
+    def encode(image, fmt: str, **kwargs) -> None:
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt, **kwargs)
+        candidates.append(("image/png" if fmt == "PNG" else "image/jpeg", buffer.getvalue()))
+
+    if profile.line_drawing and _is_line_drawing(img):
+        gray = img.convert("L")
+        encode(gray.quantize(colors=profile.palette_colors), "PNG", optimize=True)
+        encode(gray, "JPEG", quality=profile.jpeg_quality, optimize=True)
+    else:
+        rgb = img.convert("RGB")
+        encode(rgb, "PNG", optimize=True)
+        encode(rgb, "JPEG", quality=profile.jpeg_quality, optimize=True)
+
+    if not resized and original_format in ("PNG", "JPEG"):
+        candidates.append(("image/png" if original_format == "PNG" else "image/jpeg", data))
+
+    return min(candidates, key=lambda c: len(c[1]))
+
+
+class ImagePayloadOptimizer:
+    """
+    图片 → data URL（优化后）
+
+    - 按 (路径, 修改时间, 大小, 处理参数) 记忆化，同一张图纸被多个Agent/重试发送时只处理一次
+    - 按任务ID（utils.logger 的当前任务上下文，工作线程经 bind_task_context 继承）统计：图片数、记忆化命中、原始字节、发送字节
+    """
+
+    def __init__(self, max_bytes: int):
+        self._payloads = PayloadLRU(max_bytes)
+        self._counters: Dict[Optional[str], Counter] = {}
+        self._lock = threading.Lock()
+
+    def data_url(self, image_path: str, profile: Optional[ImageProfile] = None) -> str:
+        profile = profile or ImageProfile.from_config()
+        stat = os.stat(image_path)
+        key = (str(Path(image_path).resolve()), stat.st_mtime_ns, stat.st_size, profile)
+
+        cached = self._payloads.get(key)
+        if cached is not None:
+            self._count(stat.st_size, cached, hit=True)
+            return cached
+
+        with open(image_path, "rb") as f:
+            data = f.read()
+        url = self._encode(data, profile, Path(image_path).suffix.lower())
+        self._payloads.put(key, url)
+        self._count(stat.st_size, url, hit=False)
+        return url
+
+    @staticmethod
+    def _encode(data: bytes, profile: ImageProfile, suffix: str) -> str:
+        if PERFORMANCE_CONFIG["image_optimize"]:
+            try:
+                mime, data = optimize_image_bytes(data, profile)
+                return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+            except Exception:
+                pass  # 无法解码的图片按原样发送
+        mime = "image/jpeg" if suffix in (".jpg", ".jpeg") else "image/png"
+        return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+    # ---------- 统计 ----------
+    def _count(self, original_bytes: int, url: str, hit: bool) -> None:
+        # base64 前的字节数
+        sent_bytes = len(url) - url.index(",") - 1
+        sent_bytes = sent_bytes * 3 // 4
+        with self._lock:
+            counter = self._counters.setdefault(get_current_task(), Counter())
+            counter["images"] += 1
+            counter["memo_hits"] += int(hit)
+            counter["original_bytes"] += original_bytes
+            counter["sent_bytes"] += sent_bytes
+
+    def stats(self, task_id: Optional[str] = None) -> Dict[str, int]:
+        """指定任务的载荷统计（task_id 为 None 时取当前任务）"""
+        task_id = task_id if task_id is not None else get_current_task()
+        with self._lock:
+            counter = self._counters.get(task_id, Counter())
+            return {
+                "images": counter["images"],
+                "memo_hits": counter["memo_hits"],
+                "original_bytes": counter["original_bytes"],
+                "sent_bytes": counter["sent_bytes"],
+                "bytes_saved": counter["original_bytes"] - counter["sent_bytes"],
+            }
+
+
+_optimizer: Optional[ImagePayloadOptimizer] = None
+_optimizer_lock = threading.Lock()
+
+
+def get_image_optimizer() -> ImagePayloadOptimizer:
+    """进程内共享的图片载荷优化器"""
+    global _optimizer
+    with _optimizer_lock:
+        if _optimizer is None:
+            _optimizer = ImagePayloadOptimizer(CACHE_CONFIG["image_payload_max_size"])
+        return _optimizer
+
+
+def prepare_image_data_url(image_path: str, profile: Optional[ImageProfile] = None) -> str:
+    """图片文件的优化后 data URL（供各 Agent 发送图片时使用）"""
+    return get_image_optimizer().data_url(image_path, profile)
@@ -0,0 +1,385 @@
+"""LLMResponseCache: 基于内容哈希的 LLM 响应磁盘缓存（SQLite，按总大小 LRU 淘汰）及统一的请求入口。"""
+
+from __future__ import annotations
+
+import contextvars
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from config import CACHE_CONFIG
+from core.llm_limiter import get_llm_limiter
+from core.llm_retry import get_circuit_breaker, record_call_outcome
+from utils.logger import get_current_task, print_info
+
+# 不影响模型输出的请求参数，不参与缓存键
+_NON_KEY_PARAMS = {"extra_headers", "timeout", "stream"}
+
+# 当前任务是否关闭缓存（随任务上下文传递到阶段/组件工作线程，并发任务互不影响）
+_bypass: contextvars.ContextVar = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+@dataclass
+class LLMResponse:
+    content: str
+    finish_reason: Optional[str] = None
+    cached: bool = False
+    usage: Optional[Dict[str, int]] = None  # {"prompt_tokens", "completion_tokens", "cached_tokens"}；命中缓存时为 None
+
+
+class LLMResponseCache:
+    """
+    LLM 响应缓存
+
+    - 键：sha256(模型, 温度, 完整 messages（含 base64 图片）, 其他影响输出的参数)
+    - 值：模型返回的原始文本
+    - 总大小超过 max_bytes 时按最近访问时间淘汰到 90%
+    - 命中/未命中按任务ID（utils.logger 的当前任务上下文）计数；可按任务关闭缓存
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT, content TEXT, size INTEGER,"
+            " created_at REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        self._total_bytes = int(row[0])
+        self._counters: Dict[Optional[str], Counter] = {}
+
+    # ---------- 键 ----------
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], temperature: Optional[float], **params) -> str:
+        payload = {
+            "model": model,
+            "temperature": temperature,
+            "messages": messages,
+            "params": {k: v for k, v in params.items() if k not in _NON_KEY_PARAMS},
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ---------- 按任务关闭 ----------
+    @staticmethod
+    def set_bypass(bypass: bool = True) -> None:
+        """关闭/恢复当前任务上下文的缓存（关闭后既不读取也不写入）"""
+        _bypass.set(bypass)
+
+    @staticmethod
+    def is_bypassed() -> bool:
+        return _bypass.get()
+
+    # ---------- 读写 ----------
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self._count("hits")
+            return row[0]
+
+    def put(self, key: str, model: str, content: str) -> None:
+        size = len(content.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, size, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, content, size, now, now)
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._count("stores")
+            if self._total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._conn.commit()
+
+    def _evict(self, target_bytes: int) -> None:
+        """按 last_access 从旧到新删除，直到总大小不超过 target_bytes（调用方持锁）"""
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        for key, size in rows:
+            if self._total_bytes <= target_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_bytes -= size
+            self._count("evictions")
+
+    # ---------- 统计 ----------
+    def _count(self, name: str) -> None:
+        self._counters.setdefault(get_current_task(), Counter())[name] += 1
+
+    def stats(self, task_id: Optional[str] = None) -> Dict[str, int]:
+        """指定任务的命中统计（task_id 为 None 时取当前任务）"""
+        task_id = task_id if task_id is not None else get_current_task()
+        with self._lock:
+            counter = self._counters.get(task_id, Counter())
+            return {
+                "hits": counter["hits"],
+                "misses": counter["misses"],
+                "stores": counter["stores"],
+                "evictions": counter["evictions"],
+                "total_bytes": self._total_bytes,
+            }
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """进程内共享的缓存实例（CACHE_CONFIG 关闭时返回 None）"""
+    global _cache
+    if not CACHE_CONFIG.get("enable") or not CACHE_CONFIG.get("llm_responses_enable", True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache(
+                CACHE_CONFIG["directory"] / "llm_responses.sqlite3",
+                CACHE_CONFIG["llm_responses_max_size"]
+            )
+        return _cache
+
+
+def _lookup(model: str, messages: List[Dict[str, Any]], temperature: Optional[float], refresh: bool, params: Dict):
+    """返回 (缓存实例或None, 缓存键, 命中的响应或None)"""
+    cache = get_llm_cache()
+    if cache is None or cache.is_bypassed():
+        return None, None, None
+
+    key = cache.make_key(model, messages, temperature, **params)
+    if not refresh:
+        content = cache.get(key)
+        if content is not None:
+            print_info(f"💾 命中LLM缓存 ({model}, {len(content)} 字符)")
+            return cache, key, LLMResponse(content=content, finish_reason="stop", cached=True)
+    return cache, key, None
+
+
+def _store(cache, key, model: str, completion, validate) -> LLMResponse:
+    choice = completion.choices[0]
+    return _store_content(
+        cache, key, model, choice.message.content, getattr(choice, "finish_reason", None), validate,
+        _usage_dict(getattr(completion, "usage", None))
+    )
+
+
+def _field(obj, name: str):
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _usage_dict(usage) -> Optional[Dict[str, int]]:
+    """completion.usage → dict；cached_tokens 为命中供应商提示词缓存的输入 token（未返回时为 None）"""
+    if usage is None:
+        return None
+    details = _field(usage, "prompt_tokens_details")
+    cached = _field(details, "cached_tokens") if details is not None else None
+    if cached is None:
+        cached = _field(usage, "cache_read_input_tokens")
+    return {
+        "prompt_tokens": _field(usage, "prompt_tokens"),
+        "completion_tokens": _field(usage, "completion_tokens"),
+        "cached_tokens": cached,
+    }
+
+
+def _store_content(
+    cache, key, model: str, content: Optional[str], finish_reason: Optional[str], validate,
+    usage: Optional[Dict[str, int]] = None
+) -> LLMResponse:
+    # 截断的响应不缓存
+    if cache is not None and content and finish_reason != "length":
+        if validate is None or validate(content):
+            cache.put(key, model, content)
+
+    return LLMResponse(content=content, finish_reason=finish_reason, usage=usage)
+
+
+def cached_chat_completion(
+    client,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: Optional[float] = None,
+    validate: Optional[Callable[[str], bool]] = None,
+    refresh: bool = False,
+    **params
+) -> LLMResponse:
+    """
+    带缓存的 chat.completions.create
+
+    未命中缓存时先检查模型熔断器，再经进程级限流器（get_llm_limiter）发出请求。
+
+    Args:
+        client: OpenAI 客户端
+        validate: 返回 False 的响应不写入缓存（如JSON解析失败）
+        refresh: 跳过读取，强制请求并覆盖缓存（用于解析失败后的重试）
+        **params: 透传给 chat.completions.create 的其他参数
+
+    Returns:
+        LLMResponse
+    """
+    cache, key, hit = _lookup(model, messages, temperature, refresh, params)
+    if hit is not None:
+        return hit
+
+    request = dict(params)
+    if temperature is not None:
+        request["temperature"] = temperature
+    breaker = get_circuit_breaker(model)
+    breaker.before_call()
+    try:
+        with get_llm_limiter().slot():
+            completion = client.chat.completions.create(model=model, messages=messages, **request)
+    except Exception as e:
+        record_call_outcome(breaker, e)
+        raise
+    record_call_outcome(breaker, None)
+    return _store(cache, key, model, completion, validate)
+
+
+async def cached_chat_completion_async(
+    client,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: Optional[float] = None,
+    validate: Optional[Callable[[str], bool]] = None,
+    refresh: bool = False,
+    **params
+) -> LLMResponse:
+    """cached_chat_completion 的异步版本（client 为 AsyncOpenAI）"""
+    cache, key, hit = _lookup(model, messages, temperature, refresh, params)
+    if hit is not None:
+        return hit
+
+    request = dict(params)
+    if temperature is not None:
+        request["temperature"] = temperature
+    breaker = get_circuit_breaker(model)
+    breaker.before_call()
+    try:
+        async with get_llm_limiter().aslot():
+            completion = await client.chat.completions.create(model=model, messages=messages, **request)
+    except Exception as e:
+        record_call_outcome(breaker, e)
+        raise
+    record_call_outcome(breaker, None)
+    return _store(cache, key, model, completion, validate)
+
+
+def _consume_chunk(chunk, parts: List[str], on_text: Callable[[str], None], usage: Dict) -> Optional[str]:
+    """处理一个流式分片（最后一个分片可能只带 usage），返回其中的 finish_reason"""
+    if getattr(chunk, "usage", None) is not None:
+        usage.update(_usage_dict(chunk.usage))
+    if not getattr(chunk, "choices", None):
+        return None
+    choice = chunk.choices[0]
+    text = getattr(choice.delta, "content", None)
+    if text:
+        parts.append(text)
+        on_text(text)
+    return getattr(choice, "finish_reason", None)
+
+
+def streamed_chat_completion(
+    client,
+    model: str,
+    messages: List[Dict[str, Any]],
+    on_text: Callable[[str], None],
+    temperature: Optional[float] = None,
+    validate: Optional[Callable[[str], bool]] = None,
+    refresh: bool = False,
+    **params
+) -> LLMResponse:
+    """
+    流式版 cached_chat_completion：每收到一段文本回调 on_text(文本)
+
+    on_text 抛出异常时立即关闭流（不再等待剩余生成）并向上抛出，响应不缓存。
+    命中缓存时把完整响应一次性交给 on_text。
+    """
+    cache, key, hit = _lookup(model, messages, temperature, refresh, params)
+    if hit is not None:
+        on_text(hit.content)
+        return hit
+
+    request = dict(params, stream=True, stream_options={"include_usage": True})
+    if temperature is not None:
+        request["temperature"] = temperature
+    breaker = get_circuit_breaker(model)
+    breaker.before_call()
+    parts: List[str] = []
+    usage: Dict[str, int] = {}
+    finish_reason = None
+    try:
+        with get_llm_limiter().slot() as timing:
+            stream = client.chat.completions.create(model=model, messages=messages, **request)
+            try:
+                for chunk in stream:
+                    timing.first_token()
+                    finish_reason = _consume_chunk(chunk, parts, on_text, usage) or finish_reason
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+    except Exception as e:
+        record_call_outcome(breaker, e)
+        raise
+    record_call_outcome(breaker, None)
+    return _store_content(cache, key, model, "".join(parts), finish_reason, validate, usage or None)
+
+
+async def streamed_chat_completion_async(
+    client,
+    model: str,
+    messages: List[Dict[str, Any]],
+    on_text: Callable[[str], None],
+    temperature: Optional[float] = None,
+    validate: Optional[Callable[[str], bool]] = None,
+    refresh: bool = False,
+    **params
+) -> LLMResponse:
+    """streamed_chat_completion 的异步版本（client 为 AsyncOpenAI）"""
+    cache, key, hit = _lookup(model, messages, temperature, refresh, params)
+    if hit is not None:
+        on_text(hit.content)
+        return hit
+
+    request = dict(params, stream=True, stream_options={"include_usage": True})
+    if temperature is not None:
+        request["temperature"] = temperature
+    breaker = get_circuit_breaker(model)
+    breaker.before_call()
+    parts: List[str] = []
+    usage: Dict[str, int] = {}
+    finish_reason = None
+    try:
+        async with get_llm_limiter().aslot() as timing:
+            stream = await client.chat.completions.create(model=model, messages=messages, **request)
+            try:
+                async for chunk in stream:
+                    timing.first_token()
+                    finish_reason = _consume_chunk(chunk, parts, on_text, usage) or finish_reason
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    await close()
+    except Exception as e:
+        record_call_outcome(breaker, e)
+        raise
+    record_call_outcome(breaker, None)
+    return _store_content(cache, key, model, "".join(parts), finish_reason, validate, usage or None)
@@ -0,0 +1,120 @@
+"""进程内共享的 OpenRouter 客户端（连接池 + HTTP keep-alive）。"""
+
+from __future__ import annotations
+
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from config import API_CONFIG
+
+_clients: Dict[Tuple[str, str], OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def _pool_settings() -> Dict:
+    """按 API_CONFIG['openrouter'] 的连接池/超时配置生成 httpx 参数"""
+    cfg = API_CONFIG["openrouter"]
+    return {
+        "limits": httpx.Limits(
+            max_connections=cfg["pool_max_connections"],
+            max_keepalive_connections=cfg["pool_max_keepalive"],
+            keepalive_expiry=cfg["keepalive_expiry"],
+        ),
+        "timeout": httpx.Timeout(cfg["timeout"], connect=cfg["connect_timeout"]),
+    }
+
+
+def _build_http_client() -> httpx.Client:
+    return httpx.Client(**_pool_settings())
+
+
+def _resolve(api_key: Optional[str], base_url: Optional[str]) -> Tuple[str, str]:
+    api_key = api_key or os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ValueError("需要设置OPENROUTER_API_KEY环境变量或传入api_key参数")
+    return api_key, base_url or API_CONFIG["openrouter"]["base_url"]
+
+
+def _new_client(api_key: str, base_url: str) -> OpenAI:
+    return OpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        http_client=_build_http_client(),
+        max_retries=API_CONFIG["openrouter"]["sdk_max_retries"],
+    )
+
+
+def get_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> OpenAI:
+    """
+    获取共享的 OpenAI 兼容客户端
+
+    同一 (api_key, base_url) 在进程内只创建一次，所有 Agent、匹配器、
+    BOM提取和后端接口复用同一个连接池，避免每次调用重新建立 TLS 连接。
+
+    Args:
+        api_key: API密钥（默认读取 OPENROUTER_API_KEY）
+        base_url: 接口地址（默认 OpenRouter）
+
+    Returns:
+        OpenAI 客户端（线程安全，可并发调用）
+    """
+    api_key, base_url = _resolve(api_key, base_url)
+
+    key = (api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _new_client(api_key, base_url)
+            _clients[key] = client
+        return client
+
+
+@contextmanager
+def scoped_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None):
+    """
+    一次性客户端（with 结束时关闭连接池），不进入进程级缓存
+
+    用于请求中临时传入的API密钥（如 /api/test-model），避免每个测试过的密钥都留下一个连接池。
+    """
+    client = _new_client(*_resolve(api_key, base_url))
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+@asynccontextmanager
+async def async_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None):
+    """
+    异步客户端（async with 作用域内共享一个连接池）
+
+    异步连接绑定创建它的事件循环，因此不做进程级缓存；
+    在一次 asyncio.run 内并发发出的请求共用同一个连接池。
+    """
+    api_key, base_url = _resolve(api_key, base_url)
+    client = AsyncOpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        http_client=httpx.AsyncClient(**_pool_settings()),
+        max_retries=API_CONFIG["openrouter"]["sdk_max_retries"],
+    )
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+def close_openai_clients() -> None:
+    """关闭所有共享客户端（进程退出时调用）"""
+    with _clients_lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+        _clients.clear()
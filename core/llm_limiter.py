@@ -0,0 +1,219 @@
+"""AdaptiveRateLimiter: 进程级 LLM 请求限流（令牌桶 + 自适应并发上限）。"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+from config import PERFORMANCE_CONFIG
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """是否为服务端限流（HTTP 429）"""
+    return _status_code(error) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """是否为服务端过载/故障（HTTP 5xx）"""
+    status = _status_code(error)
+    return status is not None and status >= 500
+
+
+class SlotTiming:
+    """一次占用期间的计时：流式调用收到首个分片时调用 first_token()"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.first_token_latency: Optional[float] = None
+
+    def first_token(self) -> None:
+        if self.first_token_latency is None:
+            self.first_token_latency = time.monotonic() - self.start
+
+
+class AdaptiveRateLimiter:
+    """
+    同步线程与 asyncio 协程共用的限流器
+
+    - 令牌桶：平均 rate_per_second 个请求/秒，允许 burst 个突发
+    - 并发上限（AIMD）：遇到 429 减半；遇到 5xx 或流式首个分片等待超过 first_token_target 时减 1；
+      正常完成时缓慢增加（每完成约 limit 个请求 +1），范围 [min_concurrency, max_concurrency]
+    - 总耗时不参与调整：长JSON生成本身就需要很久，与服务端负载无关
+    - 记录排队等待时间等指标，供日志和接口返回
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float,
+        burst: int,
+        initial_concurrency: int,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        first_token_target: float = 30.0
+    ):
+        self.rate_per_second = float(rate_per_second)
+        self.burst = max(1, int(burst))
+        self.min_concurrency = max(1, int(min_concurrency))
+        self.max_concurrency = max(self.min_concurrency, int(max_concurrency))
+        self.first_token_target = float(first_token_target)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+        self._acquired = 0
+        self._throttled = 0
+        self._slow = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._waiting = 0
+
+    # ---------- 获取 / 释放 ----------
+    def _try_acquire_locked(self) -> float:
+        """尝试占用一个并发槽和一个令牌；成功返回 0，否则返回建议等待秒数（调用方持锁）"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+        if self._in_flight >= int(self.limit):
+            return 0.05  # 等待其他请求释放（同步路径会被 notify 提前唤醒）
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate_per_second
+        self._tokens -= 1
+        self._in_flight += 1
+        return 0.0
+
+    def _record_wait(self, waited: float) -> None:
+        self._acquired += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def acquire(self) -> None:
+        start = time.monotonic()
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    wait = self._try_acquire_locked()
+                    if wait == 0:
+                        break
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._waiting -= 1
+            self._record_wait(time.monotonic() - start)
+
+    async def acquire_async(self) -> None:
+        start = time.monotonic()
+        with self._cond:
+            self._waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire_locked()
+                if wait == 0:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            with self._cond:
+                self._waiting -= 1
+        with self._cond:
+            self._record_wait(time.monotonic() - start)
+
+    def release(
+        self,
+        first_token_latency: Optional[float] = None,
+        throttled: bool = False,
+        overloaded: bool = False
+    ) -> None:
+        """
+        Args:
+            first_token_latency: 流式调用的首个分片等待秒数（非流式调用为 None，不参与调整）
+            throttled: 请求被 429 限流
+            overloaded: 请求遇到 5xx
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self._throttled += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self._tokens = 0.0  # 暂停突发，按速率重新积累
+            elif overloaded or (first_token_latency is not None and first_token_latency > self.first_token_target):
+                self._slow += 1
+                self.limit = max(self.min_concurrency, self.limit - 1)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """同步调用：with limiter.slot() as timing: client.chat.completions.create(...)"""
+        self.acquire()
+        timing = SlotTiming()
+        throttled = overloaded = False
+        try:
+            yield timing
+        except BaseException as e:
+            throttled, overloaded = is_rate_limit_error(e), is_overload_error(e)
+            raise
+        finally:
+            self.release(timing.first_token_latency, throttled=throttled, overloaded=overloaded)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """异步调用：async with limiter.aslot() as timing: await client.chat.completions.create(...)"""
+        await self.acquire_async()
+        timing = SlotTiming()
+        throttled = overloaded = False
+        try:
+            yield timing
+        except BaseException as e:
+            throttled, overloaded = is_rate_limit_error(e), is_overload_error(e)
+            raise
+        finally:
+            self.release(timing.first_token_latency, throttled=throttled, overloaded=overloaded)
+
+    # ---------- 指标 ----------
+    def metrics(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "concurrency_limit": int(self.limit),
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "requests": self._acquired,
+                "throttled": self._throttled,
+                "slow": self._slow,
+                "queue_wait_avg": round(self._wait_total / self._acquired, 3) if self._acquired else 0.0,
+                "queue_wait_max": round(self._wait_max, 3),
+            }
+
+
+_limiter: Optional[AdaptiveRateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_llm_limiter() -> AdaptiveRateLimiter:
+    """进程内共享的限流器（多个任务同时运行时共同受限）"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveRateLimiter(
+                rate_per_second=PERFORMANCE_CONFIG["llm_requests_per_second"],
+                burst=PERFORMANCE_CONFIG["llm_burst"],
+                initial_concurrency=PERFORMANCE_CONFIG["llm_initial_concurrency"],
+                min_concurrency=PERFORMANCE_CONFIG["llm_min_concurrency"],
+                max_concurrency=PERFORMANCE_CONFIG["llm_max_concurrency"],
+                first_token_target=PERFORMANCE_CONFIG["llm_first_token_target"],
+            )
+        return _limiter
@@ -0,0 +1,190 @@
+"""LLM 调用的重试策略（指数退避 + 全抖动 + Retry-After）与按模型的熔断器。"""
+
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from config import PERFORMANCE_CONFIG
+
+# 错误类别
+TRANSPORT = "transport"      # 连接/超时/5xx：可重试，计入熔断
+RATE_LIMIT = "rate_limit"    # 429：可重试，优先遵循 Retry-After，不计入熔断
+CONTENT = "content"          # 响应无法解析为预期的JSON：换一次请求可能成功
+FATAL = "fatal"              # 参数/鉴权错误等：重试无意义
+CIRCUIT_OPEN = "circuit_open"
+
+_TRANSPORT_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "InternalServerError",
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+    "ReadError", "WriteError", "RemoteProtocolError", "TimeoutError", "ConnectionError",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """模型熔断中，调用被直接拒绝"""
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def classify_error(error: BaseException) -> str:
+    """把异常归类为 transport / rate_limit / content / fatal / circuit_open"""
+    if isinstance(error, CircuitOpenError):
+        return CIRCUIT_OPEN
+    if isinstance(error, (json.JSONDecodeError, ValueError)) and _status_code(error) is None:
+        return CONTENT
+
+    status = _status_code(error)
+    if status == 429:
+        return RATE_LIMIT
+    if status is not None:
+        if status in (408, 409) or status >= 500:
+            return TRANSPORT
+        return FATAL
+
+    for cls in type(error).__mro__:
+        if cls.__name__ in _TRANSPORT_ERROR_NAMES:
+            return TRANSPORT
+    return FATAL
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """读取响应头 Retry-After（秒数或HTTP日期）"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RetryPolicy:
+    """
+    重试策略
+
+    - 第 n 次重试前等待 uniform(0, min(max_delay, base_delay * 2**n))（全抖动，避免多任务同步重试）
+    - 服务端给出 Retry-After 时按其等待（上限 max_retry_after）
+    - fatal / circuit_open 不重试
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    max_retry_after: float = 120.0
+
+    @classmethod
+    def from_config(cls, max_attempts: Optional[int] = None) -> "RetryPolicy":
+        return cls(
+            max_attempts=max_attempts or PERFORMANCE_CONFIG["llm_retry_max_attempts"],
+            base_delay=PERFORMANCE_CONFIG["llm_retry_base_delay"],
+            max_delay=PERFORMANCE_CONFIG["llm_retry_max_delay"],
+        )
+
+    def should_retry(self, attempt: int, error_kind: str) -> bool:
+        """attempt 从 0 开始；返回是否还要进行下一次尝试"""
+        return attempt + 1 < self.max_attempts and error_kind not in (FATAL, CIRCUIT_OPEN)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    单个模型的熔断器
+
+    - closed：正常调用；连续 failure_threshold 次 transport 错误后 → open
+    - open：reset_timeout 秒内直接拒绝（CircuitOpenError）
+    - half_open：超时后放行一个试探请求，成功 → closed，失败 → open
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"模型 {self.name} 熔断中，{self.reset_timeout:.0f}秒内暂停调用")
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    raise CircuitOpenError(f"模型 {self.name} 正在试探恢复，暂停调用")
+                self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def record_neutral(self) -> None:
+        """不反映模型健康度的结果（如429、参数错误）：只释放试探名额"""
+        with self._lock:
+            self._probe_in_flight = False
+            if self.state == "half_open":
+                self.state = "closed"
+                self._failures = 0
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(model: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                model,
+                failure_threshold=PERFORMANCE_CONFIG["llm_breaker_failure_threshold"],
+                reset_timeout=PERFORMANCE_CONFIG["llm_breaker_reset_timeout"],
+            )
+            _breakers[model] = breaker
+        return breaker
+
+
+def record_call_outcome(breaker: CircuitBreaker, error: Optional[BaseException]) -> None:
+    """按错误类别更新熔断器"""
+    if error is None:
+        breaker.record_success()
+    elif classify_error(error) == TRANSPORT:
+        breaker.record_failure()
+    else:
+        breaker.record_neutral()
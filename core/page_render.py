@@ -0,0 +1,279 @@
+"""PageRenderCache: PDF 页面渲染一次、多处复用（按 PDF内容哈希/页码/DPI/格式 缓存）。"""
+
+from __future__ import annotations
+
+import base64
+import io
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from config import CACHE_CONFIG
+from core.pdf_rasterizer import PageRenderTask, rasterize_pages
+from core.stage_checkpoint import hash_file
+
+_RENDER_NAME = re.compile(r"^p(\d{4})_(\d+)dpi\.(\w+)$")
+_MIME = {"png": "image/png", "jpeg": "image/jpeg"}
+
+
+def _normalize_format(fmt: str) -> str:
+    fmt = fmt.lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in _MIME:
+        raise ValueError(f"不支持的图片格式: {fmt}")
+    return fmt
+
+
+class PayloadLRU:
+    """按总字节数淘汰的 base64 内存缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self._items: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[str]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value: str) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = value
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+class PageRenderCache:
+    """
+    页面渲染缓存
+
+    - 磁盘：{directory}/{pdf_sha256}/p{页码:04d}_{dpi}dpi.{格式}，总大小超过 max_bytes 时按访问时间淘汰
+    - 请求较低 DPI 时，若已有更高 DPI 的渲染，直接从缓存图缩小（不再光栅化 PDF）
+    - base64 载荷在内存中按 (PDF哈希/文件, 页码, DPI, 格式) 记忆化
+    - 同一页面并发请求时只渲染一次
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, payload_max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self._payloads = PayloadLRU(payload_max_bytes)
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._total_bytes = sum(p.stat().st_size for p in self.directory.glob("*/p*dpi.*"))
+
+    # ---------- 键 ----------
+    def pdf_digest(self, pdf_path: str) -> str:
+        """PDF 内容哈希（按路径+修改时间+大小记忆化）"""
+        stat = os.stat(pdf_path)
+        key = (str(Path(pdf_path).resolve()), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = hash_file(Path(pdf_path))
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+    def _render_path(self, digest: str, page_index: int, dpi: int, fmt: str) -> Path:
+        return self.directory / digest / f"p{page_index:04d}_{int(dpi)}dpi.{fmt}"
+
+    def _key_lock(self, key: Tuple) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    # ---------- 渲染 ----------
+    def page_count(self, pdf_path: str) -> int:
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+
+    def render(self, pdf_path: str, page_index: int, dpi: int, fmt: str = "png", doc=None) -> Path:
+        """
+        返回指定页面渲染图的缓存路径（不存在时渲染或从更高DPI缩小）
+
+        Args:
+            pdf_path: PDF文件路径
+            page_index: 页码（从0开始）
+            dpi: 分辨率
+            fmt: png / jpeg
+            doc: 已打开的 fitz 文档（批量渲染时复用）
+        """
+        fmt = _normalize_format(fmt)
+        digest = self.pdf_digest(pdf_path)
+        path = self._render_path(digest, page_index, dpi, fmt)
+
+        with self._key_lock((digest, page_index, int(dpi), fmt)):
+            if path.exists():
+                os.utime(path)
+                return path
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            source = self._find_larger_render(digest, page_index, dpi)
+            data = self._downsample(source, dpi, fmt) if source else self._rasterize(pdf_path, page_index, dpi, fmt, doc)
+
+            tmp_path = path.with_name(path.name + f".{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self._account(len(data))
+            return path
+
+    def render_document(self, pdf_path: str, dpi: int, fmt: str = "png") -> List[Path]:
+        """按页序返回整份PDF的渲染图路径（文档只打开一次）"""
+        with fitz.open(pdf_path) as doc:
+            return [self.render(pdf_path, i, dpi, fmt, doc=doc) for i in range(len(doc))]
+
+    def render_batch(self, documents: List[Tuple[str, int]], fmt: str = "png") -> Tuple[Dict[Tuple[str, int], List[Path]], List[Dict]]:
+        """
+        批量渲染多份PDF（未缓存的页面交给多进程光栅化器并行渲染）
+
+        Args:
+            documents: [(pdf_path, dpi), ...]
+
+        Returns:
+            ({(pdf_path, dpi): [按页序的渲染图路径]}, 新渲染页面的逐页耗时)
+        """
+        fmt = _normalize_format(fmt)
+        paths: Dict[Tuple[str, int], List[Path]] = {}
+        pending: List[PageRenderTask] = []
+
+        for pdf_path, dpi in documents:
+            digest = self.pdf_digest(pdf_path)
+            page_paths = []
+            for page_index in range(self.page_count(pdf_path)):
+                path = self._render_path(digest, page_index, dpi, fmt)
+                page_paths.append(path)
+                if path.exists():
+                    os.utime(path)
+                elif self._find_larger_render(digest, page_index, dpi):
+                    self.render(pdf_path, page_index, dpi, fmt)
+                else:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    pending.append(PageRenderTask(str(pdf_path), page_index, int(dpi), fmt, str(path)))
+            paths[(pdf_path, dpi)] = page_paths
+
+        timings = rasterize_pages(pending)
+        self._account(sum(t["bytes"] for t in timings))
+        return paths, timings
+
+    def _find_larger_render(self, digest: str, page_index: int, dpi: int) -> Optional[Tuple[Path, int]]:
+        """同一页面已缓存的、DPI 最接近且更高的渲染图（只用无损PNG作为源）"""
+        best = None
+        for candidate in (self.directory / digest).glob(f"p{page_index:04d}_*dpi.png"):
+            match = _RENDER_NAME.match(candidate.name)
+            if not match:
+                continue
+            src_dpi = int(match.group(2))
+            if src_dpi > dpi and (best is None or src_dpi < best[1]):
+                best = (candidate, src_dpi)
+        return best
+
+    @staticmethod
+    def _rasterize(pdf_path: str, page_index: int, dpi: int, fmt: str, doc=None) -> bytes:
+        own_doc = doc is None
+        if own_doc:
+            doc = fitz.open(pdf_path)
+        try:
+            zoom = dpi / 72
+            pix = doc[page_index].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            return pix.tobytes("jpeg" if fmt == "jpeg" else "png")
+        finally:
+            if own_doc:
+                doc.close()
+
+    @staticmethod
+    def _downsample(source: Tuple[Path, int], dpi: int, fmt: str) -> bytes:
+        from PIL import Image
+
+        src_path, src_dpi = source
+        with Image.open(src_path) as img:
+            scale = dpi / src_dpi
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            resized = img.convert("RGB").resize(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, format=fmt.upper())
+        return buffer.getvalue()
+
+    # ---------- 导出 / 载荷 ----------
+    def export_page(self, pdf_path: str, page_index: int, dpi: int, dest: Path, fmt: str = "png", doc=None) -> Path:
+        """把渲染图复制到任务输出目录（图片路径保持原有目录结构）"""
+        dest = Path(dest)
+        shutil.copyfile(self.render(pdf_path, page_index, dpi, fmt, doc=doc), dest)
+        return dest
+
+    def page_base64(self, pdf_path: str, page_index: int, dpi: int, fmt: str = "png") -> str:
+        """页面渲染图的 base64（内存记忆化）"""
+        fmt = _normalize_format(fmt)
+        key = ("page", self.pdf_digest(pdf_path), page_index, int(dpi), fmt)
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = base64.b64encode(self.render(pdf_path, page_index, dpi, fmt).read_bytes()).decode("ascii")
+            self._payloads.put(key, payload)
+        return payload
+
+    def region_base64(self, pdf_path: str, page_index: int, clip: Tuple[float, float, float, float], dpi: int) -> str:
+        """页面局部区域（clip，单位pt）的 PNG base64（只在内存中记忆化）"""
+        clip = tuple(round(v, 1) for v in clip)
+        key = ("region", self.pdf_digest(pdf_path), page_index, clip, int(dpi))
+        payload = self._payloads.get(key)
+        if payload is None:
+            zoom = dpi / 72
+            with fitz.open(pdf_path) as doc:
+                pix = doc[page_index].get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=fitz.Rect(*clip))
+                payload = base64.b64encode(pix.tobytes("png")).decode("ascii")
+            self._payloads.put(key, payload)
+        return payload
+
+    # ---------- 磁盘淘汰 ----------
+    def _account(self, size: int) -> None:
+        with self._lock:
+            self._total_bytes += size
+            if self._total_bytes <= self.max_bytes:
+                return
+            target = int(self.max_bytes * 0.9)
+            files = sorted(self.directory.glob("*/p*dpi.*"), key=lambda p: p.stat().st_mtime)
+            for path in files:
+                if self._total_bytes <= target:
+                    break
+                try:
+                    size = path.stat().st_size
+                    path.unlink()
+                    self._total_bytes -= size
+                except OSError:
+                    continue
+
+
+_renderer: Optional[PageRenderCache] = None
+_renderer_lock = threading.Lock()
+
+
+def get_page_renderer() -> PageRenderCache:
+    """进程内共享的页面渲染缓存"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = PageRenderCache(
+                CACHE_CONFIG["directory"] / "page_renders",
+                CACHE_CONFIG["page_renders_max_size"],
+                CACHE_CONFIG["image_payload_max_size"],
+            )
+        return _renderer
+
@@ -0,0 +1,224 @@
+"""页面分诊：用文字密度、表头关键词、线条密度和图幅在本地给图纸页面打标签，决定哪些页面需要视觉模型。"""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from core.bom_text_extractor import MIN_TEXT_WORDS, PART_CODE
+
+# 页面标签
+BOM = "bom"                      # 含BOM表（明细栏）
+ASSEMBLY_VIEW = "assembly_view"  # 装配视图（大量零件序号引线）
+DETAIL = "detail"                # 零件详图/剖视图
+TITLE_BLOCK = "title_block"      # 只有标题栏/封面，几乎没有图形
+UNKNOWN = "unknown"              # 扫描件等无法本地判断的页面（需要视觉模型）
+
+BOM_HEADER_TOKENS = ("序号", "代号", "名称", "数量")
+TITLE_BLOCK_TOKENS = ("设计", "审核", "工艺", "批准", "比例", "标准化", "日期")
+DETAIL_TOKENS = ("技术要求", "Ra", "±", "Φ", "φ", "⌀", "未注")
+ASSEMBLY_TOKENS = ("总装", "装配", "总图")
+
+# 图幅（长边，单位pt）
+_PAPER_SIZES = (("A0", 3370), ("A1", 2384), ("A2", 1684), ("A3", 1191), ("A4", 842))
+_BALLOON = re.compile(r"^\d{1,3}$")
+
+
+@dataclass
+class PageTriage:
+    page_index: int
+    labels: List[str]
+    paper: str
+    has_text_layer: bool
+    word_count: int
+    header_hits: int
+    part_codes: int
+    table_rulings: int
+    drawing_items: int
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def may_have_bom(self) -> bool:
+        """是否可能含BOM表（BOM 或无法判断的页面）"""
+        return BOM in self.labels or UNKNOWN in self.labels
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data["page"] = self.page_index + 1
+        return data
+
+
+def paper_size(width: float, height: float) -> str:
+    long_edge = max(width, height)
+    for name, size in _PAPER_SIZES:
+        if long_edge >= size * 0.9:
+            return name
+    return "A4"
+
+
+def _table_rulings(horizontal_segments: Sequence[tuple]) -> int:
+    """
+    等长且规则排列的水平线数量（表格网格的特征）
+
+    horizontal_segments: [(x0, x1, y), ...]；按 (x0, 长度) 分组，取最大一组的行数
+    """
+    groups = Counter((round(x0), round(x1 - x0)) for x0, x1, _ in horizontal_segments if x1 - x0 > 20)
+    return max(groups.values()) if groups else 0
+
+
+def classify_page(
+    page_index: int,
+    words: Sequence[tuple],
+    horizontal_segments: Sequence[tuple],
+    drawing_items: int,
+    width: float,
+    height: float,
+    has_images: bool = False
+) -> PageTriage:
+    """
+    根据页面特征打标签（可多标签，例如同一张总图上既有装配视图又有明细栏）
+
+    Args:
+        words: 文字层的词 (x0, y0, x1, y1, text, ...)
+        horizontal_segments: 水平线段 [(x0, x1, y), ...]
+        drawing_items: 绘图指令中的图元数量
+        has_images: 页面是否嵌入了位图（扫描件）
+    """
+    texts = [w[4] for w in words if str(w[4]).strip()]
+    joined = "".join(texts)
+    has_text_layer = len(texts) >= MIN_TEXT_WORDS
+    header_hits = sum(1 for token in BOM_HEADER_TOKENS if token in joined)
+    part_codes = sum(1 for t in texts if PART_CODE.search(t))
+    rulings = _table_rulings(horizontal_segments)
+    balloons = sum(1 for t in texts if _BALLOON.match(t))
+
+    triage = PageTriage(
+        page_index=page_index, labels=[], paper=paper_size(width, height),
+        has_text_layer=has_text_layer, word_count=len(texts), header_hits=header_hits,
+        part_codes=part_codes, table_rulings=rulings, drawing_items=drawing_items,
+    )
+
+    if not has_text_layer and drawing_items < 20:
+        # 没有文字层也没有矢量图形：扫描件或空白页
+        triage.labels.append(UNKNOWN if has_images else TITLE_BLOCK)
+        triage.reasons.append("无文字层且几乎无矢量图形")
+        return triage
+
+    if header_hits >= 3:
+        triage.labels.append(BOM)
+        triage.reasons.append(f"表头关键词 {header_hits}/4")
+    elif not has_text_layer and rulings >= 8:
+        # 文字转曲的图纸：只能靠规则排列的表格线判断
+        triage.labels.append(BOM)
+        triage.reasons.append(f"无文字层，检测到 {rulings} 条等长表格线")
+    elif has_text_layer and part_codes >= 3 and rulings >= 5:
+        triage.labels.append(BOM)
+        triage.reasons.append(f"{part_codes} 个零件代号 + {rulings} 条表格线")
+
+    if drawing_items >= 200:
+        if balloons >= 5 or any(token in joined for token in ASSEMBLY_TOKENS):
+            triage.labels.append(ASSEMBLY_VIEW)
+            triage.reasons.append(f"{balloons} 个序号标注")
+        elif any(token in joined for token in DETAIL_TOKENS) or drawing_items >= 500:
+            triage.labels.append(DETAIL)
+    elif not triage.labels:
+        title_hits = sum(1 for token in TITLE_BLOCK_TOKENS if token in joined)
+        triage.labels.append(TITLE_BLOCK if title_hits >= 2 or drawing_items < 50 else DETAIL)
+
+    if not triage.labels:
+        triage.labels.append(DETAIL)
+    return triage
+
+
+def _page_features(page) -> Dict:
+    words = page.get_text("words")
+    segments = []
+    drawing_items = 0
+    try:
+        drawings = page.get_drawings()
+    except Exception:
+        drawings = []
+    for drawing in drawings:
+        for item in drawing.get("items", []):
+            drawing_items += 1
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) < 0.5:
+                    segments.append((min(p1.x, p2.x), max(p1.x, p2.x), p1.y))
+            elif item[0] == "re":
+                rect = item[1]
+                segments.append((rect.x0, rect.x1, rect.y0))
+    return {
+        "words": words,
+        "horizontal_segments": segments,
+        "drawing_items": drawing_items,
+        "width": page.rect.width,
+        "height": page.rect.height,
+        "has_images": bool(page.get_images()),
+    }
+
+
+_triage_cache: Dict[str, List[PageTriage]] = {}
+_triage_lock = threading.Lock()
+
+
+def triage_pdf(pdf_path: str) -> List[PageTriage]:
+    """逐页分诊（按PDF内容哈希记忆化，文件分类与BOM提取阶段共用）"""
+    import fitz  # PyMuPDF
+    from core.page_render import get_page_renderer
+
+    digest = get_page_renderer().pdf_digest(pdf_path)
+    with _triage_lock:
+        cached = _triage_cache.get(digest)
+    if cached is not None:
+        return cached
+
+    with fitz.open(pdf_path) as doc:
+        result = [classify_page(i, **_page_features(page)) for i, page in enumerate(doc)]
+    with _triage_lock:
+        _triage_cache[digest] = result
+    return result
+
+
+def select_page_images(
+    image_hierarchy: Dict,
+    images: List[str],
+    wanted: Iterable[str],
+    enabled: bool = True
+) -> List[str]:
+    """
+    按页面标签挑选图片（image_hierarchy['page_labels'] 中记录的标签）
+
+    没有标签信息或挑选后为空时返回原列表。
+    """
+    if not enabled or not images:
+        return images
+    wanted = set(wanted) | {UNKNOWN}
+    labels_by_image: Dict[str, List[str]] = {}
+    page_labels = image_hierarchy.get("page_labels") or {}
+    for entries in [page_labels.get("product", [])] + list((page_labels.get("components") or {}).values()):
+        for entry in entries:
+            labels_by_image[entry.get("image")] = entry.get("labels", [])
+
+    selected = [img for img in images if img not in labels_by_image or wanted & set(labels_by_image[img])]
+    return selected or images
+
+
+def label_entries(triage: Optional[List[PageTriage]], images: List[str]) -> List[Dict]:
+    """把分诊结果与已渲染的页面图片对应起来（写入 image_hierarchy）"""
+    entries = []
+    for i, image in enumerate(images):
+        # 渲染失败的页面会被跳过，按文件名 page_001.png 中的页码对应
+        match = re.search(r"page_(\d+)", str(image))
+        page_number = int(match.group(1)) if match else i + 1
+        page = triage[page_number - 1] if triage and page_number <= len(triage) else None
+        entries.append({
+            "page": page_number,
+            "image": image,
+            "labels": page.labels if page else [UNKNOWN],
+            "has_text_layer": page.has_text_layer if page else False,
+        })
+    return entries
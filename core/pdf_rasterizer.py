@@ -0,0 +1,171 @@
+"""多进程 PDF 页面光栅化：每个工作进程只打开一次文档，页面按块分发到各核。"""
+
+from __future__ import annotations
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+from config import PERFORMANCE_CONFIG
+from utils.logger import print_warning
+
+
+@dataclass(frozen=True)
+class PageRenderTask:
+    pdf_path: str
+    page_index: int  # 从0开始
+    dpi: int
+    fmt: str         # png / jpeg
+    out_path: str
+
+
+# ---------- 工作进程 ----------
+_worker_docs: "OrderedDict[tuple, fitz.Document]" = OrderedDict()
+_WORKER_MAX_OPEN_DOCS = 4
+
+
+def _worker_document(pdf_path: str):
+    """工作进程内缓存已打开的文档（同一文档的多个页块只打开一次；文件被替换后重新打开）"""
+    key = (pdf_path, os.stat(pdf_path).st_mtime_ns)
+    doc = _worker_docs.get(key)
+    if doc is None:
+        doc = fitz.open(pdf_path)
+        _worker_docs[key] = doc
+        while len(_worker_docs) > _WORKER_MAX_OPEN_DOCS:
+            _, old = _worker_docs.popitem(last=False)
+            old.close()
+    else:
+        _worker_docs.move_to_end(key)
+    return doc
+
+
+def _render_task(doc, task: PageRenderTask) -> Dict:
+    start = time.perf_counter()
+    zoom = task.dpi / 72
+    pix = doc[task.page_index].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    data = pix.tobytes("jpeg" if task.fmt == "jpeg" else "png")
+    tmp_path = f"{task.out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, task.out_path)
+    return {
+        "pdf": os.path.basename(task.pdf_path),
+        "page": task.page_index + 1,
+        "dpi": task.dpi,
+        "width": pix.width,
+        "height": pix.height,
+        "bytes": len(data),
+        "seconds": round(time.perf_counter() - start, 4),
+        "worker": os.getpid(),
+    }
+
+
+def _render_chunk(tasks: List[PageRenderTask]) -> List[Dict]:
+    """渲染同一文档的一组页面（在工作进程中执行）"""
+    doc = _worker_document(tasks[0].pdf_path)
+    return [_render_task(doc, task) for task in tasks]
+
+
+def _render_chunk_local(tasks: List[PageRenderTask]) -> List[Dict]:
+    """在当前进程渲染（并行关闭、页数过少或工作进程异常时）"""
+    with fitz.open(tasks[0].pdf_path) as doc:
+        return [_render_task(doc, task) for task in tasks]
+
+
+# ---------- 进程池 ----------
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _worker_count() -> int:
+    configured = PERFORMANCE_CONFIG.get("pdf_render_workers", 0)
+    return int(configured) if configured else min(os.cpu_count() or 1, 8)
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """进程级共享的光栅化进程池（spawn 启动，避免继承父进程中已打开的 MuPDF 状态）"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool() -> None:
+    """工作进程崩溃后丢弃进程池，下次调用时重建"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def shutdown_rasterizer() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def _chunk_tasks(tasks: List[PageRenderTask], workers: int) -> List[List[PageRenderTask]]:
+    """按文档分组后切成连续页块；块数约为 workers 的 2 倍，便于多文档间均衡"""
+    by_pdf: Dict[str, List[PageRenderTask]] = defaultdict(list)
+    for task in tasks:
+        by_pdf[task.pdf_path].append(task)
+
+    chunk_size = max(1, math.ceil(len(tasks) / (workers * 2)))
+    chunks = []
+    for pdf_tasks in by_pdf.values():
+        pdf_tasks.sort(key=lambda t: t.page_index)
+        for i in range(0, len(pdf_tasks), chunk_size):
+            chunks.append(pdf_tasks[i:i + chunk_size])
+    return chunks
+
+
+def rasterize_pages(tasks: List[PageRenderTask], workers: Optional[int] = None) -> List[Dict]:
+    """
+    渲染一批页面到各自的 out_path
+
+    输出文件由任务决定，与完成顺序无关；返回的逐页耗时按 (PDF, 页码) 排序。
+    页数不超过 pdf_render_min_parallel_pages 或 workers <= 1 时在当前进程渲染。
+    单个页块在工作进程中失败时回退到当前进程重试一次。
+    """
+    if not tasks:
+        return []
+
+    workers = workers or _worker_count()
+    chunks = _chunk_tasks(tasks, workers)
+    timings: List[Dict] = []
+
+    if workers <= 1 or len(tasks) <= PERFORMANCE_CONFIG.get("pdf_render_min_parallel_pages", 2):
+        for chunk in chunks:
+            timings.extend(_render_chunk_local(chunk))
+    else:
+        pool = _get_pool(workers)
+        futures = {pool.submit(_render_chunk, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                timings.extend(future.result())
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    _discard_pool()
+                print_warning(f"页面光栅化进程失败，改为本进程渲染 {os.path.basename(chunk[0].pdf_path)}: {e}")
+                timings.extend(_render_chunk_local(chunk))
+
+    timings.sort(key=lambda t: (t["pdf"], t["page"], t["dpi"]))
+    return timings
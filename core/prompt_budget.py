@@ -0,0 +1,151 @@
+"""提示词预算：发送前估算 token、把表格压缩为列式文本、超预算时分批（不截断），并记录估算与实际用量。"""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import PERFORMANCE_CONFIG
+from utils.logger import get_current_task, print_info, print_warning
+
+# 中日韩文字及全角标点：约 1 token/字；其他字符约 4 字符/token
+_WIDE = re.compile(r"[　-〿一-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数（宁多勿少）"""
+    if not text:
+        return 0
+    wide = len(_WIDE.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def estimate_messages_tokens(messages: Sequence[Dict[str, Any]]) -> int:
+    """估算 chat messages 的输入 token（图片按 PERFORMANCE_CONFIG["prompt_image_tokens"] 计）"""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                total += estimate_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                total += PERFORMANCE_CONFIG["prompt_image_tokens"]
+    return total
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).replace("|", "/").replace("\n", " ").strip()
+
+
+def columnar_table(rows: Sequence[Dict[str, Any]], columns: Sequence[Tuple[str, str]]) -> str:
+    """
+    把记录列表压缩为列式文本：一行表头 + 每条记录一行，列之间用 | 分隔
+
+    Args:
+        rows: 记录列表
+        columns: [(字段名, 表头), ...]；只输出这些字段，所有记录都为空的列整列省略
+
+    Example:
+        BOM序号|代号|名称|数量
+        1|01.09.1140|刷辊组件-漆后|1
+    """
+    cells = [[_cell(row.get(field)) for field, _ in columns] for row in rows]
+    keep = [i for i in range(len(columns)) if any(line[i] for line in cells)]
+    if not keep:
+        return ""
+    lines = ["|".join(columns[i][1] for i in keep)]
+    lines.extend("|".join(line[i] for i in keep) for line in cells)
+    return "\n".join(lines)
+
+
+def split_to_budget(
+    items: List[Any],
+    render: Callable[[List[Any]], str],
+    budget: Optional[int] = None
+) -> List[List[Any]]:
+    """
+    按 token 预算把 items 分成若干批（每批 render 后的估算 token 不超过预算）
+
+    单个元素本身超过预算时单独成批；不截断任何元素。
+    """
+    budget = budget or PERFORMANCE_CONFIG["prompt_token_budget"]
+    if not items or estimate_tokens(render(items)) <= budget:
+        return [items]
+
+    # 每批从剩余全部元素开始，按超出比例缩小，直到不超过预算
+    batches: List[List[Any]] = []
+    start = 0
+    while start < len(items):
+        size = len(items) - start
+        while size > 1:
+            tokens = estimate_tokens(render(items[start:start + size]))
+            if tokens <= budget:
+                break
+            size = max(1, min(size - 1, size * budget // tokens))
+        batches.append(items[start:start + size])
+        start += size
+    return batches
+
+
+class TokenUsageLog:
+    """
+    按任务累计每次调用的估算/实际 token 用量（实际输入中命中提示词缓存的部分单独统计）
+
+    任务ID取自 utils.logger 的当前任务上下文；在线程池中调用时需经 bind_task_context 提交。
+    """
+
+    def __init__(self):
+        self._counters: Dict[Optional[str], Counter] = {}
+        self._lock = threading.Lock()
+
+    def record(self, label: str, estimated: int, usage: Optional[Dict[str, int]] = None) -> None:
+        actual = (usage or {}).get("prompt_tokens")
+        completion = (usage or {}).get("completion_tokens")
+        cached = (usage or {}).get("cached_tokens") or 0
+        if actual is None:
+            print_info(f"🧮 [{label}] 估算输入 {estimated} tokens")
+        else:
+            print_info(
+                f"🧮 [{label}] 估算输入 {estimated} tokens，实际输入 {actual}"
+                f"（缓存命中 {cached} / 未缓存 {actual - cached}）/ 输出 {completion} tokens"
+            )
+        with self._lock:
+            counter = self._counters.setdefault(get_current_task(), Counter())
+            counter["calls"] += 1
+            counter["estimated_prompt_tokens"] += estimated
+            if actual is not None:
+                counter["measured_calls"] += 1
+                counter["prompt_tokens"] += actual
+                counter["completion_tokens"] += completion or 0
+                counter["cached_prompt_tokens"] += cached
+
+    def stats(self, task_id: Optional[str] = None) -> Dict[str, int]:
+        task_id = task_id if task_id is not None else get_current_task()
+        with self._lock:
+            return dict(self._counters.get(task_id, Counter()))
+
+
+_usage_log = TokenUsageLog()
+
+
+def get_token_usage_log() -> TokenUsageLog:
+    """进程内共享的 token 用量记录"""
+    return _usage_log
+
+
+def warn_if_over_budget(label: str, estimated: int, budget: Optional[int] = None) -> bool:
+    """无法拆分的调用超过预算时给出提示（不截断），返回是否超预算"""
+    budget = budget or PERFORMANCE_CONFIG["prompt_token_budget"]
+    if estimated <= budget:
+        return False
+    print_warning(f"🧮 [{label}] 估算输入 {estimated} tokens 超过预算 {budget}（内容完整发送，未截断）")
+    return True
@@ -0,0 +1,38 @@
+"""提示词前缀缓存：静态 system 提示词按模型加缓存断点（cache_control），供应商据此复用已处理的前缀。"""
+
+from __future__ import annotations
+
+from typing import Any, Dict
+
+from config import PERFORMANCE_CONFIG
+
+# 需要显式缓存断点的模型前缀（OpenRouter 模型名）；OpenAI/DeepSeek 等为自动前缀缓存，无需标注
+_EXPLICIT_CACHE_PREFIXES = ("anthropic/", "google/gemini")
+
+
+def supports_cache_breakpoint(model: str) -> bool:
+    """
+    PERFORMANCE_CONFIG["llm_prompt_cache"]：
+    - auto：只对需要显式断点的模型（Anthropic/Gemini）标注
+    - always：所有模型都标注（供应商不识别时会忽略）
+    - off：不标注
+    """
+    mode = PERFORMANCE_CONFIG["llm_prompt_cache"]
+    if mode == "off":
+        return False
+    return mode == "always" or model.startswith(_EXPLICIT_CACHE_PREFIXES)
+
+
+def cached_text_part(text: str, model: str) -> Dict[str, Any]:
+    """文本内容块；支持时在块末尾打缓存断点（块之前的内容都参与缓存）"""
+    part: Dict[str, Any] = {"type": "text", "text": text}
+    if supports_cache_breakpoint(model):
+        part["cache_control"] = {"type": "ephemeral"}
+    return part
+
+
+def system_message(system_prompt: str, model: str) -> Dict[str, Any]:
+    """静态 system 提示词消息（放在 messages 最前面，逐字节不变才能命中缓存）"""
+    if not supports_cache_breakpoint(model):
+        return {"role": "system", "content": system_prompt}
+    return {"role": "system", "content": [cached_text_part(system_prompt, model)]}
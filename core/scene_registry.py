@@ -0,0 +1,77 @@
+"""任务内的3D场景注册表：每个GLB只解析一次，爆炸视图与GLB清单共用同一个场景，用完显式释放并记录峰值内存。"""
+
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+
+def scene_nbytes(scene) -> int:
+    """场景几何数据（顶点/面片等数组）占用的字节数（估算）"""
+    total = 0
+    for geometry in getattr(scene, "geometry", {}).values():
+        for attr in ("vertices", "faces", "entities"):
+            total += getattr(getattr(geometry, attr, None), "nbytes", 0) or 0
+    return total
+
+
+class SceneRegistry:
+    """
+    按GLB路径登记已加载的 trimesh.Scene
+
+    - acquire：已加载则复用，否则加载（force="scene"）
+    - release / release_all：显式释放，大场景用完立即释放
+    - stats：加载次数、复用次数、常驻字节、峰值字节
+    """
+
+    def __init__(self):
+        self._scenes: Dict[str, Tuple[object, int]] = {}
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._reuses = 0
+        self._resident_bytes = 0
+        self._peak_bytes = 0
+
+    @staticmethod
+    def _key(glb_path) -> str:
+        return str(Path(glb_path).resolve())
+
+    def acquire(self, glb_path):
+        key = self._key(glb_path)
+        with self._lock:
+            entry = self._scenes.get(key)
+            if entry is not None:
+                self._reuses += 1
+                return entry[0]
+
+        import trimesh
+
+        scene = trimesh.load(str(glb_path), force="scene")
+        nbytes = scene_nbytes(scene)
+        with self._lock:
+            self._scenes[key] = (scene, nbytes)
+            self._loads += 1
+            self._resident_bytes += nbytes
+            self._peak_bytes = max(self._peak_bytes, self._resident_bytes)
+        return scene
+
+    def release(self, glb_path) -> None:
+        with self._lock:
+            entry = self._scenes.pop(self._key(glb_path), None)
+            if entry is not None:
+                self._resident_bytes -= entry[1]
+
+    def release_all(self) -> None:
+        with self._lock:
+            self._scenes.clear()
+            self._resident_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "loads": self._loads,
+                "reuses": self._reuses,
+                "resident_bytes": self._resident_bytes,
+                "peak_bytes": self._peak_bytes,
+            }
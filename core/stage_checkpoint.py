@@ -0,0 +1,168 @@
+"""StageCheckpointStore: 按输入指纹保存/复用工作流阶段产物。"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from utils.time_utils import beijing_now
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_directory(path: Path) -> str:
+    """目录指纹：相对路径 + 文件内容哈希（与遍历顺序无关）"""
+    digest = hashlib.sha256()
+    for file in sorted(p for p in path.rglob("*") if p.is_file()):
+        digest.update(file.relative_to(path).as_posix().encode("utf-8"))
+        digest.update(hash_file(file).encode("ascii"))
+    return digest.hexdigest()
+
+
+def hash_value(value: Any) -> str:
+    """
+    初始输入的指纹
+
+    - 目录 / 文件路径：按内容哈希（文件名不变但内容改变时指纹也会变）
+    - 其他值：按规范化 JSON 哈希
+    """
+    if isinstance(value, (str, Path)) and str(value):
+        path = Path(value)
+        if path.is_dir():
+            return hash_directory(path)
+        if path.is_file():
+            return hash_file(path)
+    try:
+        payload = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    except TypeError:
+        # 混合类型的键无法排序，退化为按插入顺序序列化
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+    return hash_bytes(payload.encode("utf-8"))
+
+
+def hash_sources(paths: Iterable[Path]) -> str:
+    """源文件集合的指纹（用于提示词版本）"""
+    digest = hashlib.sha256()
+    for path in sorted(Path(p) for p in paths):
+        if path.is_file():
+            digest.update(path.name.encode("utf-8"))
+            digest.update(hash_file(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+class StageCheckpointStore:
+    """
+    阶段检查点存储
+
+    每个阶段在 checkpoint_dir 下保存两个文件：
+    - <stage>.json：清单（指纹、产物哈希、产物引用的文件）
+    - <stage>.pkl：产物本身（pickle，保证 int 键等类型原样恢复）
+
+    指纹 = 阶段名 + 阶段版本 + 全局参数（模型、提示词版本等）+ 各输入的指纹，
+    上游输出的指纹由上游阶段指纹与其产物哈希组成，因此任一上游变化都会使下游失效。
+    """
+
+    def __init__(self, checkpoint_dir: Path, extra: Optional[Dict[str, Any]] = None):
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.extra = dict(extra or {})
+        self._lock = threading.Lock()
+
+    def fingerprint(self, stage_name: str, version: str, input_fingerprints: Dict[str, str]) -> str:
+        payload = {
+            "stage": stage_name,
+            "version": version,
+            "extra": self.extra,
+            "inputs": input_fingerprints,
+        }
+        return hash_bytes(json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+
+    def load(self, stage_name: str, fingerprint: str) -> Optional[Tuple[Any, str]]:
+        """
+        指纹一致且产物引用的文件仍存在时返回 (产物, 产物哈希)，否则返回 None
+        """
+        manifest_path = self.checkpoint_dir / f"{stage_name}.json"
+        artifact_path = self.checkpoint_dir / f"{stage_name}.pkl"
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if manifest.get("fingerprint") != fingerprint:
+            return None
+        if any(not Path(p).is_file() for p in manifest.get("files", [])):
+            return None
+
+        try:
+            data = artifact_path.read_bytes()
+        except OSError:
+            return None
+        if hash_bytes(data) != manifest.get("artifact_sha256"):
+            return None
+        try:
+            return pickle.loads(data), manifest["artifact_sha256"]
+        except Exception:
+            return None
+
+    def save(self, stage_name: str, fingerprint: str, result: Any) -> str:
+        """保存产物并返回产物哈希"""
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        artifact_sha256 = hash_bytes(data)
+        manifest = {
+            "stage": stage_name,
+            "fingerprint": fingerprint,
+            "artifact_sha256": artifact_sha256,
+            "files": sorted(self._referenced_files(result)),
+            "created_at": beijing_now().isoformat(),
+        }
+
+        artifact_path = self.checkpoint_dir / f"{stage_name}.pkl"
+        manifest_path = self.checkpoint_dir / f"{stage_name}.json"
+        with self._lock:
+            # 先写临时文件再替换，避免中断后留下半个检查点
+            tmp_artifact = artifact_path.with_suffix(".pkl.tmp")
+            tmp_artifact.write_bytes(data)
+            os.replace(tmp_artifact, artifact_path)
+            tmp_manifest = manifest_path.with_suffix(".json.tmp")
+            with open(tmp_manifest, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_manifest, manifest_path)
+        return artifact_sha256
+
+    def invalidate(self, stage_name: str) -> None:
+        for suffix in (".json", ".pkl"):
+            path = self.checkpoint_dir / f"{stage_name}{suffix}"
+            if path.exists():
+                path.unlink()
+
+    @classmethod
+    def _referenced_files(cls, value: Any) -> set:
+        """产物中引用的已存在文件（GLB、页面图片等），复用前需确认它们还在"""
+        files = set()
+        if isinstance(value, dict):
+            for v in value.values():
+                files |= cls._referenced_files(v)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                files |= cls._referenced_files(v)
+        elif isinstance(value, (str, Path)):
+            text = str(value)
+            if 0 < len(text) < 1024 and ("/" in text or "\\" in text) and os.path.isfile(text):
+                files.add(str(Path(text).resolve()))
+        return files
@@ -0,0 +1,253 @@
+"""StageScheduler: 按输入/输出依赖关系并发执行工作流阶段。"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from core.stage_checkpoint import StageCheckpointStore, hash_value
+from utils.logger import bind_task_context, print_info, print_warning
+from utils.time_utils import beijing_now
+
+
+@dataclass
+class Stage:
+    """
+    工作流中的一个阶段
+
+    - func 以关键字参数接收 inputs 中声明的上下文值
+    - 单个输出时直接返回值；多个输出时按 outputs 顺序返回元组
+    - step 为所属的工作流步骤号（resume_from 按它判断是否强制重跑）
+    - version 在阶段逻辑或产物格式变化时递增，使旧检查点失效
+    - checkpoint_if 返回 False 时本次结果不写入检查点（如存在失败项）
+    """
+
+    name: str
+    func: Callable[..., Any]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    step: int = 0
+    version: str = "1"
+    checkpoint: bool = True
+    checkpoint_if: Optional[Callable[[Any], bool]] = None
+
+
+@dataclass
+class StageTiming:
+    name: str
+    status: str = "pending"  # pending | running | success | reused | failed | cancelled
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    elapsed_seconds: float = 0.0
+    thread: str = ""
+    error: Optional[str] = None
+
+
+class StageScheduler:
+    """
+    依赖图执行器
+
+    规则：
+    - 某阶段的所有输入都已就绪（初始上下文或上游阶段输出）后立即提交到线程池
+    - 互不依赖的阶段并发执行
+    - 任一阶段失败后不再提交新阶段，等待运行中的阶段结束后抛出首个异常
+    - 提供 checkpoints 时，输入指纹与检查点一致的阶段直接复用产物；
+      step >= resume_from 的阶段总是重新执行
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        max_workers: int = 3,
+        checkpoints: Optional[StageCheckpointStore] = None,
+        resume_from: Optional[int] = None
+    ):
+        self.stages = list(stages)
+        self.max_workers = max(1, int(max_workers))
+        self.checkpoints = checkpoints
+        self.resume_from = resume_from
+        self._fingerprints: Dict[str, str] = {}
+        self.timings: Dict[str, StageTiming] = {s.name: StageTiming(name=s.name) for s in self.stages}
+        self._lock = threading.Lock()
+        self._validate()
+
+    # ---------- 校验 ----------
+    def _validate(self) -> None:
+        names = [s.name for s in self.stages]
+        if len(names) != len(set(names)):
+            raise ValueError(f"阶段名称重复: {names}")
+
+        producers: Dict[str, str] = {}
+        for stage in self.stages:
+            for out in stage.outputs:
+                if out in producers:
+                    raise ValueError(f"输出 {out} 同时由 {producers[out]} 和 {stage.name} 产生")
+                producers[out] = stage.name
+        self._producers = producers
+
+        # 拓扑排序检测环
+        deps = self._stage_dependencies()
+        visited: Dict[str, int] = {}
+
+        def _visit(name: str, path: List[str]) -> None:
+            state = visited.get(name, 0)
+            if state == 1:
+                raise ValueError(f"阶段依赖存在环: {' -> '.join(path + [name])}")
+            if state == 2:
+                return
+            visited[name] = 1
+            for dep in deps[name]:
+                _visit(dep, path + [name])
+            visited[name] = 2
+
+        for name in names:
+            _visit(name, [])
+
+    def _stage_dependencies(self) -> Dict[str, set]:
+        return {
+            stage.name: {self._producers[i] for i in stage.inputs if i in self._producers}
+            for stage in self.stages
+        }
+
+    # ---------- 执行 ----------
+    def run(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        执行所有阶段
+
+        Args:
+            context: 初始上下文（不由任何阶段产生的输入必须在此提供）
+
+        Returns:
+            包含所有阶段输出的上下文字典
+        """
+        context = dict(context)
+        missing = [
+            f"{stage.name}.{inp}"
+            for stage in self.stages
+            for inp in stage.inputs
+            if inp not in self._producers and inp not in context
+        ]
+        if missing:
+            raise ValueError(f"缺少初始输入: {', '.join(missing)}")
+
+        if self.checkpoints is not None:
+            initial_keys = {inp for stage in self.stages for inp in stage.inputs if inp not in self._producers}
+            self._fingerprints = {key: hash_value(context[key]) for key in sorted(initial_keys)}
+
+        deps = self._stage_dependencies()
+        done: set = set()
+        pending = {stage.name: stage for stage in self.stages}
+        running: Dict[Future, Stage] = {}
+        first_error: Optional[BaseException] = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as executor:
+            while pending or running:
+                if first_error is None:
+                    ready = [s for name, s in pending.items() if deps[name] <= done]
+                    for stage in ready:
+                        del pending[stage.name]
+                        kwargs = {inp: context[inp] for inp in stage.inputs}
+                        running[executor.submit(bind_task_context(self._run_stage), stage, kwargs)] = stage
+
+                if not running:
+                    break
+
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    try:
+                        result, output_fingerprint = future.result()
+                        self._store_outputs(stage, result, context)
+                    except BaseException as e:  # noqa: BLE001 - 保留首个异常向上抛出
+                        if first_error is None:
+                            first_error = e
+                        continue
+                    if output_fingerprint is not None:
+                        for key in stage.outputs:
+                            self._fingerprints[key] = f"{output_fingerprint}:{key}"
+                    done.add(stage.name)
+
+        for name in pending:
+            self.timings[name].status = "cancelled"
+
+        if first_error is not None:
+            raise first_error
+        return context
+
+    def _run_stage(self, stage: Stage, kwargs: Dict[str, Any]):
+        """执行（或复用）单个阶段，返回 (产物, 输出指纹)"""
+        timing = self.timings[stage.name]
+        with self._lock:
+            timing.status = "running"
+            timing.started_at = beijing_now().isoformat()
+            timing.thread = threading.current_thread().name
+        start = time.perf_counter()
+
+        fingerprint = None
+        if self.checkpoints is not None:
+            fingerprint = self.checkpoints.fingerprint(
+                stage.name, stage.version, {inp: self._fingerprints[inp] for inp in stage.inputs}
+            )
+            forced = self.resume_from is not None and stage.step >= self.resume_from
+            if stage.checkpoint and not forced:
+                cached = self.checkpoints.load(stage.name, fingerprint)
+                if cached is not None:
+                    result, artifact_sha256 = cached
+                    with self._lock:
+                        timing.status = "reused"
+                        timing.elapsed_seconds = time.perf_counter() - start
+                        timing.finished_at = beijing_now().isoformat()
+                    print_info(f"♻️  阶段复用检查点: {stage.name}")
+                    return result, f"{fingerprint}:{artifact_sha256}"
+
+        print_info(f"▶️  阶段开始: {stage.name}")
+        try:
+            result = stage.func(**kwargs)
+        except BaseException as e:
+            with self._lock:
+                timing.status = "failed"
+                timing.error = str(e)
+                timing.elapsed_seconds = time.perf_counter() - start
+                timing.finished_at = beijing_now().isoformat()
+            print_warning(f"阶段失败: {stage.name} ({timing.elapsed_seconds:.1f}秒): {e}")
+            raise
+        with self._lock:
+            timing.status = "success"
+            timing.elapsed_seconds = time.perf_counter() - start
+            timing.finished_at = beijing_now().isoformat()
+        print_info(f"⏹️  阶段完成: {stage.name} ({timing.elapsed_seconds:.1f}秒)")
+
+        if fingerprint is None:
+            return result, None
+        return result, self._checkpoint_result(stage, fingerprint, result)
+
+    def _checkpoint_result(self, stage: Stage, fingerprint: str, result: Any) -> str:
+        """写入检查点并返回输出指纹；不保存时以产物内容计算指纹"""
+        keep = stage.checkpoint and (stage.checkpoint_if is None or stage.checkpoint_if(result))
+        if keep:
+            try:
+                return f"{fingerprint}:{self.checkpoints.save(stage.name, fingerprint, result)}"
+            except Exception as e:
+                print_warning(f"保存检查点失败: {stage.name}: {e}")
+        else:
+            self.checkpoints.invalidate(stage.name)
+        return f"{fingerprint}:{hash_value(result)}"
+
+    @staticmethod
+    def _store_outputs(stage: Stage, result: Any, context: Dict[str, Any]) -> None:
+        if not stage.outputs:
+            return
+        if len(stage.outputs) == 1:
+            context[stage.outputs[0]] = result
+            return
+        if not isinstance(result, tuple) or len(result) != len(stage.outputs):
+            raise ValueError(f"阶段 {stage.name} 应返回 {len(stage.outputs)} 个输出")
+        for key, value in zip(stage.outputs, result):
+            context[key] = value
+
+    def timing_report(self) -> List[Dict[str, Any]]:
+        """按声明顺序返回各阶段的起止时间"""
+        return [self.timings[s.name].__dict__.copy() for s in self.stages]
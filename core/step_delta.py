@@ -0,0 +1,178 @@
+"""按 step_id 的增量输出协议：Agent 只返回新增字段，本地合并到原步骤。"""
+
+from __future__ import annotations
+
+import copy
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 发送给增强类 Agent（焊接/安全）的步骤字段；mesh_id 等大字段不发送
+PROMPT_STEP_FIELDS = (
+    "step_id", "step_number", "title", "operation", "tools_required", "quality_check", "welding",
+)
+PROMPT_PART_FIELDS = ("bom_seq", "bom_code", "name", "quantity")
+
+
+def ensure_step_ids(steps: List[Dict], prefix: str) -> List[Dict]:
+    """
+    保证每个步骤都有唯一的 step_id（缺失或重复时按 {prefix}_step_{序号} 补齐）
+
+    返回新的步骤列表，不修改传入的步骤。
+    """
+    result = []
+    seen = set()
+    for idx, step in enumerate(steps):
+        step_copy = dict(step)
+        step_id = str(step_copy.get("step_id") or "").strip()
+        if not step_id or step_id in seen:
+            base = f"{prefix}_step_{step_copy.get('step_number') or idx + 1}"
+            step_id = base
+            suffix = 2
+            while step_id in seen:
+                step_id = f"{base}_{suffix}"
+                suffix += 1
+            step_copy["step_id"] = step_id
+        seen.add(step_id)
+        result.append(step_copy)
+    return result
+
+
+def compact_steps_for_prompt(steps: List[Dict]) -> List[Dict]:
+    """只保留增强类 Agent 需要阅读的字段"""
+    compact = []
+    for step in steps:
+        item = {k: step[k] for k in PROMPT_STEP_FIELDS if k in step}
+        parts = step.get("parts_used")
+        if parts:
+            item["parts_used"] = [
+                {k: part[k] for k in PROMPT_PART_FIELDS if k in part} if isinstance(part, dict) else part
+                for part in parts
+            ]
+        compact.append(item)
+    return compact
+
+
+def merge_step_deltas(
+    steps: List[Dict],
+    deltas: Any,
+    field: str,
+    validate: Optional[Callable[[Any], bool]] = None
+) -> Tuple[List[Dict], Dict[str, Any]]:
+    """
+    把 [{"step_id": ..., field: value}, ...] 合并到步骤中
+
+    - step_id 不在原步骤中的增量被拒绝
+    - 同一 step_id 出现多次时只采用第一条
+    - validate 返回 False 的值被拒绝
+
+    Returns:
+        (合并后的新步骤列表, {"applied": int, "unknown_step_ids": [...], "invalid_step_ids": [...]})
+    """
+    merged = [copy.deepcopy(step) for step in steps]
+    index = {str(step.get("step_id")): step for step in merged if step.get("step_id")}
+    report = {"applied": 0, "unknown_step_ids": [], "invalid_step_ids": []}
+
+    if not isinstance(deltas, list):
+        return merged, report
+
+    applied_ids = set()
+    for delta in deltas:
+        if not isinstance(delta, dict):
+            continue
+        step_id = str(delta.get("step_id") or "")
+        if step_id not in index:
+            report["unknown_step_ids"].append(step_id)
+            continue
+        if step_id in applied_ids:
+            continue
+        value = delta.get(field)
+        if value is None or (validate is not None and not validate(value)):
+            report["invalid_step_ids"].append(step_id)
+            continue
+        index[step_id][field] = value
+        applied_ids.add(step_id)
+        report["applied"] += 1
+
+    return merged, report
+
+
+def overlay_step_fields(base_steps: List[Dict], enriched_steps: List[Dict], fields: Tuple[str, ...]) -> List[Dict]:
+    """
+    把 enriched_steps 中指定字段按 step_id 覆盖到 base_steps 上
+
+    用于合并多个 Agent 在同一批基础步骤上独立产生的结果：
+    每个 Agent 只拥有自己的字段，合并结果与完成顺序无关。
+    """
+    deltas = [
+        {"step_id": step.get("step_id"), **{f: step[f] for f in fields if f in step}}
+        for step in enriched_steps
+    ]
+    merged = [copy.deepcopy(step) for step in base_steps]
+    for field in fields:
+        merged, _ = merge_step_deltas(merged, [d for d in deltas if field in d], field)
+    return merged
+
+
+def splice_steps(
+    steps: List[Dict],
+    additions: Any,
+    prefix: str,
+    anchor_field: str = "insert_after_step_id"
+) -> Tuple[List[Dict], Dict[str, Any]]:
+    """
+    把新增步骤按 display_order 插入到已有步骤之间
+
+    - 已有步骤缺少 display_order 时按 1000 步进补齐
+    - 新增步骤的 anchor_field 为空时插到最前面；指向未知 step_id 时追加到末尾
+    - 插入到同一步骤之后的多个新增步骤保持返回顺序
+    - 插入后按 display_order 排序，重新编号 step_number、重排 display_order（1000 步进），
+      step_id 统一按 {prefix}_step_{step_number} 重新生成（用于步骤尚未被下游引用的阶段）
+
+    Returns:
+        (合并后的新步骤列表, {"inserted": int, "unknown_anchors": [...]})
+    """
+    merged = [copy.deepcopy(step) for step in steps]
+    for idx, step in enumerate(merged):
+        if not isinstance(step.get("display_order"), (int, float)):
+            step["display_order"] = (idx + 1) * 1000
+    report = {"inserted": 0, "unknown_anchors": []}
+    if not isinstance(additions, list):
+        return merged, report
+
+    ordered = sorted(merged, key=lambda s: s["display_order"])
+    next_order = {}
+    for current, following in zip(ordered, ordered[1:] + [None]):
+        next_order[str(current.get("step_id"))] = (
+            current["display_order"], following["display_order"] if following else current["display_order"] + 1000
+        )
+    head = ordered[0]["display_order"] if ordered else 1000
+
+    groups: Dict[Optional[str], List[Dict]] = {}
+    for addition in additions:
+        if not isinstance(addition, dict) or not addition.get("parts_used"):
+            continue
+        anchor = str(addition.get(anchor_field) or "") or None
+        if anchor is not None and anchor not in next_order:
+            report["unknown_anchors"].append(anchor)
+            anchor = "__tail__"
+        groups.setdefault(anchor, []).append(addition)
+
+    tail = ordered[-1]["display_order"] if ordered else 0
+    for anchor, group in groups.items():
+        if anchor is None:
+            low, high = head - 1000, head
+        elif anchor == "__tail__":
+            low, high = tail, tail + 1000
+        else:
+            low, high = next_order[anchor]
+        for n, addition in enumerate(group, 1):
+            step = {k: v for k, v in addition.items() if k not in (anchor_field, "step_id")}
+            step["display_order"] = low + (high - low) * n / (len(group) + 1)
+            merged.append(step)
+            report["inserted"] += 1
+
+    merged.sort(key=lambda s: s["display_order"])
+    for idx, step in enumerate(merged):
+        step["step_number"] = idx + 1
+        step["display_order"] = (idx + 1) * 1000
+        step.pop("step_id", None)
+    return ensure_step_ids(merged, prefix), report
@@ -0,0 +1,329 @@
+"""结构化输出：按模型能力请求 JSON 输出（response_format），并容错解析/修复截断或夹杂文字的 JSON 响应。"""
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import PERFORMANCE_CONFIG
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",(\s*[\]}])")
+_FENCE_MARK = re.compile(r"```(?:json|JSON)?")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+@dataclass
+class ParseResult:
+    """
+    value: 解析结果（失败时为 None）
+    repaired: 是否经过修复（去掉代码块/多余文字/尾逗号，或补全截断）
+    truncated: 响应被截断，value 只包含截断前完整的元素
+    recovered: 截断时各数组保留的元素数 {"$.assembly_steps": 7}（路径从根 "$" 开始）
+    error: 无法解析时的错误信息
+    """
+
+    value: Any = None
+    repaired: bool = False
+    truncated: bool = False
+    recovered: Dict[str, int] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.value is not None
+
+    def summary(self) -> str:
+        items = ", ".join(f"{path}: {count} 项" for path, count in self.recovered.items())
+        return f"响应被截断，已保留完整元素（{items}）" if self.truncated else "响应格式已修复"
+
+
+@dataclass
+class _Frame:
+    kind: str
+    path: str
+    items: int = 0
+    expect_key: bool = True
+    key: str = ""
+
+    def child_path(self) -> str:
+        if self.kind == "{":
+            return f"{self.path}.{self.key}" if self.path else self.key
+        return f"{self.path}[{self.items}]"
+
+
+def _cut_points(text: str, start: int) -> Tuple[Optional[int], Dict[int, Tuple[int, List[_Frame]]], List[_Frame]]:
+    """
+    从 start 处的 { 或 [ 开始扫描
+
+    Returns:
+        (完整JSON的结束位置或None, {深度: (可截断位置, 截断时的栈快照)}, 扫描结束时的栈)
+        可截断位置之前的内容在补齐括号后是合法JSON，且当前层的最后一个元素完整。
+    """
+    stack: List[_Frame] = []
+    safe: Dict[int, Tuple[int, List[_Frame]]] = {}
+    in_string = escape = False
+    string_start = 0
+
+    def snapshot(extra_item: bool) -> List[_Frame]:
+        frames = [_Frame(f.kind, f.path, f.items + 1, f.expect_key, f.key) for f in stack]
+        if not extra_item:
+            frames[-1].items -= 1
+        return frames
+
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+                top = stack[-1] if stack else None
+                if top and top.kind == "{" and top.expect_key:
+                    top.key = text[string_start + 1:i]
+            continue
+
+        if c == '"':
+            in_string = True
+            string_start = i
+        elif c in "{[":
+            path = stack[-1].child_path() if stack else "$"
+            stack.append(_Frame(c, path))
+            for depth in [d for d in safe if d >= len(stack)]:
+                del safe[depth]
+        elif c in "}]":
+            if not stack:
+                return None, safe, stack
+            stack.pop()
+            if not stack:
+                return i + 1, safe, stack
+            # 子元素刚好闭合：父层在此处可截断（父层元素数 = 已数的逗号数 + 1）
+            safe[len(stack)] = (i + 1, snapshot(extra_item=True))
+        elif c == "," and stack:
+            stack[-1].items += 1
+            stack[-1].expect_key = True
+            safe[len(stack)] = (i, snapshot(extra_item=False))
+        elif c == ":" and stack:
+            stack[-1].expect_key = False
+    return None, safe, stack
+
+
+def _close(fragment: str, frames: List[_Frame]) -> str:
+    fragment = fragment.rstrip().rstrip(",")
+    return fragment + "".join(_CLOSERS[f.kind] for f in reversed(frames))
+
+
+def _loads(candidate: str) -> Any:
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        cleaned = _TRAILING_COMMA.sub(r"\1", candidate)
+        cleaned = "".join(ch for ch in cleaned if ord(ch) >= 32 or ch in "\n\r\t")
+        return json.loads(cleaned)
+
+
+def _repair_truncated(text: str, start: int, safe: Dict, stack: List[_Frame]) -> Optional[ParseResult]:
+    """
+    截断修复：在最外层数组的最后一个完整元素处截断并补齐括号（只保留完整的元素）；
+    没有数组时退到最深的可截断位置
+    """
+    array_depths = [depth for depth, frame in enumerate(stack, 1) if frame.kind == "[" and depth in safe]
+    candidates = array_depths[:1] + sorted((depth for depth in safe if depth <= len(stack)), reverse=True)
+    for depth in candidates:
+        position, frames = safe[depth]
+        try:
+            value = _loads(_close(text[start:position], frames))
+        except json.JSONDecodeError:
+            continue
+        recovered = {frame.path: frame.items for frame in frames if frame.kind == "["}
+        return ParseResult(value=value, repaired=True, truncated=True, recovered=recovered)
+    return None
+
+
+def parse_json_tolerant(text: Optional[str], expect: Optional[str] = None) -> ParseResult:
+    """
+    容错解析模型返回的 JSON
+
+    依次尝试：直接解析 → 去掉 ```json 代码块 → 从第一个 {/[ 开始解析并忽略之后的多余文字
+    （顺带去掉尾逗号/控制字符）→ 截断修复。
+
+    Args:
+        text: 模型响应
+        expect: "object" / "array"，指定期望的顶层类型（决定从哪个括号开始解析）
+
+    Returns:
+        ParseResult
+    """
+    if not text or not text.strip():
+        return ParseResult(error="空响应")
+    content = text.strip()
+
+    try:
+        value = json.loads(content)
+        if expect is None or isinstance(value, dict if expect == "object" else list):
+            return ParseResult(value=value)
+    except json.JSONDecodeError:
+        pass
+
+    fence = _FENCE.search(content)
+    if fence and fence.group(1).strip():
+        content = fence.group(1).strip()
+
+    openers = {"object": "{", "array": "["}.get(expect, "{[")
+    starts = [content.find(ch) for ch in openers if content.find(ch) >= 0]
+    if not starts:
+        return ParseResult(error="未找到JSON")
+    start = min(starts)
+
+    end, safe, stack = _cut_points(content, start)
+    if end is not None:
+        try:
+            return ParseResult(value=_loads(content[start:end]), repaired=True)
+        except json.JSONDecodeError as e:
+            return ParseResult(error=f"JSON解析失败: line {e.lineno} column {e.colno} (char {e.pos})")
+
+    repaired = _repair_truncated(content, start, safe, stack)
+    return repaired or ParseResult(error="JSON不完整且无法修复")
+
+
+# ---------- 流式增量解析 ----------
+class MalformedStreamError(ValueError):
+    """流式响应明显不是预期的JSON，提前中止（按内容错误重试）"""
+
+
+class IncrementalJSONParser:
+    """
+    流式响应的增量解析器
+
+    每收到一段文本调用 feed()；fields 中的数组（顶层对象的字段）每完整一个元素就回调
+    on_item(字段名, 序号, 元素)。出现以下情况时抛出 MalformedStreamError：
+    - 开头 max_preamble 个字符内没有出现 JSON（代码块标记不计）
+    - 括号不匹配
+    - 目标数组的元素无法解析
+    """
+
+    def __init__(self, fields, on_item, max_preamble: int = 400):
+        self.targets = {f"$.{name}": name for name in fields}
+        self.on_item = on_item
+        self.max_preamble = max_preamble
+        self.buffer = ""
+        self.items: Dict[str, int] = {}
+        self._pos = 0
+        self._started = False
+        self._done = False
+        self._stack: List[_Frame] = []
+        self._starts: List[int] = []
+        self._in_string = self._escape = False
+        self._string_start = 0
+
+    def feed(self, chunk: str) -> None:
+        if not chunk or self._done:
+            return
+        self.buffer += chunk
+        if not self._started and not self._find_start():
+            return
+        self._scan()
+
+    def _find_start(self) -> bool:
+        text = self.buffer
+        positions = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+        if positions:
+            self._pos = min(positions)
+            self._started = True
+            return True
+        preamble = _FENCE_MARK.sub("", text).strip()
+        if len(preamble) > self.max_preamble:
+            raise MalformedStreamError(f"响应开头 {len(preamble)} 个字符内没有JSON")
+        return False
+
+    def _scan(self) -> None:
+        text = self.buffer
+        stack = self._stack
+        while self._pos < len(text) and not self._done:
+            i = self._pos
+            c = text[i]
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    top = stack[-1] if stack else None
+                    if top and top.kind == "{" and top.expect_key:
+                        top.key = text[self._string_start + 1:i]
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                path = stack[-1].child_path() if stack else "$"
+                stack.append(_Frame(c, path))
+                self._starts.append(i)
+            elif c in "}]":
+                if not stack or _CLOSERS[stack[-1].kind] != c:
+                    raise MalformedStreamError(f"第 {i} 个字符处括号不匹配")
+                stack.pop()
+                start = self._starts.pop()
+                if not stack:
+                    self._done = True
+                elif stack[-1].kind == "[" and stack[-1].path in self.targets:
+                    self._emit(stack[-1], text[start:i + 1])
+            elif c == "," and stack:
+                stack[-1].items += 1
+                stack[-1].expect_key = True
+            elif c == ":" and stack:
+                stack[-1].expect_key = False
+
+    def _emit(self, frame: _Frame, raw: str) -> None:
+        try:
+            item = _loads(raw)
+        except json.JSONDecodeError as e:
+            raise MalformedStreamError(f"数组元素无法解析: {e}") from e
+        name = self.targets[frame.path]
+        self.items[name] = self.items.get(name, 0) + 1
+        self.on_item(name, frame.items, item)
+
+
+# ---------- 请求端：response_format ----------
+_unsupported_models: set = set()
+_unsupported_lock = threading.Lock()
+
+
+def response_format_params(model: str, schema: Optional[Dict] = None, name: str = "result") -> Dict[str, Any]:
+    """
+    请求结构化输出的参数（合并到 chat.completions.create 的参数中）
+
+    PERFORMANCE_CONFIG["llm_response_format"]：
+    - json_schema：有 schema 时按 schema 约束，否则退为 json_object
+    - json_object：只要求输出合法的JSON对象
+    - off：不请求
+    曾拒绝 response_format 的模型不再请求。
+    """
+    mode = PERFORMANCE_CONFIG["llm_response_format"]
+    with _unsupported_lock:
+        if mode == "off" or model in _unsupported_models:
+            return {}
+    if mode == "json_schema" and schema:
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": re.sub(r"[^A-Za-z0-9_-]", "_", name) or "result", "strict": False, "schema": schema},
+        }}
+    return {"response_format": {"type": "json_object"}}
+
+
+def is_response_format_error(model: str, error: BaseException) -> bool:
+    """请求因 response_format 不受支持而失败时记录该模型并返回 True（调用方去掉参数后重试）"""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status not in (400, 422) or "response_format" not in str(error):
+        return False
+    with _unsupported_lock:
+        _unsupported_models.add(model)
+    return True
@@ -6,9 +6,12 @@ Gemini 2.5 Flash 视觉模型封装
 
 import os
 import json
-import base64
 from typing import Dict, List, Optional, Union
-from openai import OpenAI
+from core.llm_cache import cached_chat_completion
+from core.llm_client import get_openai_client
+from core.image_payload import prepare_image_data_url
+from core.prompt_cache import system_message
+from core.structured_output import parse_json_tolerant
 
 
 class GeminiVisionModel:
@@ -26,10 +29,7 @@ class GeminiVisionModel:
         if not self.api_key:
             raise ValueError("请设置OPENROUTER_API_KEY环境变量或传入api_key参数")
 
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=self.api_key
-        )
+        self.client = get_openai_client(self.api_key)
 
         # ✅ Bug修复：从config.py读取模型名称
         if model_name:
@@ -51,9 +51,7 @@ class GeminiVisionModel:
         Returns:
             base64编码的图片数据URL
         """
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-            return f"data:image/png;base64,{encoded_string}"
+        return prepare_image_data_url(image_path)
     
     def analyze_engineering_drawing(
         self,
@@ -98,10 +96,7 @@ class GeminiVisionModel:
         
         # 构建消息
         messages = [
-            {
-                "role": "system",
-                "content": system_prompt
-            },
+            system_message(system_prompt, self.model_name),
             {
                 "role": "user",
                 "content": user_content
@@ -110,47 +105,30 @@ class GeminiVisionModel:
         
         try:
             # 调用API
-            completion = self.client.chat.completions.create(
+            response = cached_chat_completion(
+                self.client,
+                model=self.model_name,
+                messages=messages,
+                temperature=0.1,  # 降低温度，提高确定性
+                validate=lambda text: isinstance(parse_json_tolerant(text, expect="object").value, dict),  # 解析不出JSON的响应不缓存
                 extra_headers={
                     "HTTP-Referer": "https://mecagent.com",
                     "X-Title": "MecAgent Assembly Planning"
-                },
-                model=self.model_name,
-                messages=messages,
-                temperature=0.1  # 降低温度，提高确定性
+                }
             )
             
             # 获取响应
-            response_content = completion.choices[0].message.content
+            response_content = response.content
             
-            # 尝试解析JSON结果
-            try:
-                # 提取JSON部分
-                json_start = response_content.find('{')
-                json_end = response_content.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = response_content[json_start:json_end]
-                    parsed_result = json.loads(json_str)
-                else:
-                    parsed_result = {"raw_content": response_content}
-            except json.JSONDecodeError as e:
-                # JSON解析失败，尝试修复
-                print(f"⚠️ JSON解析失败: {e}")
-                
-                # 尝试提取```json代码块
-                if "```json" in response_content:
-                    json_start = response_content.find("```json") + 7
-                    json_end = response_content.find("```", json_start)
-                    if json_end > json_start:
-                        json_str = response_content[json_start:json_end].strip()
-                        try:
-                            parsed_result = json.loads(json_str)
-                        except:
-                            parsed_result = {"raw_content": response_content, "parse_error": str(e)}
-                    else:
-                        parsed_result = {"raw_content": response_content, "parse_error": str(e)}
-                else:
-                    parsed_result = {"raw_content": response_content, "parse_error": str(e)}
+            # 解析JSON结果（容错：代码块/多余文字/尾逗号，截断时保留完整的元素）
+            parse = parse_json_tolerant(response_content, expect="object")
+            if parse.ok:
+                parsed_result = parse.value
+                if parse.repaired:
+                    print(f"⚠️ {parse.summary()}")
+            else:
+                print(f"⚠️ JSON解析失败: {parse.error}")
+                parsed_result = {"raw_content": response_content, "parse_error": parse.error}
             
             # 保存输出结果到临时文件
             import datetime
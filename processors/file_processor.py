@@ -6,7 +6,7 @@
 
 import os
 import json
-import re
+import shutil
 import tempfile
 import subprocess
 from pathlib import Path
@@ -14,6 +14,8 @@ from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 import fitz  # PyMuPDF
 from PIL import Image
+from core.page_render import get_page_renderer
+from processors.glb_names import decode_name, fix_scene_names
 from utils.time_utils import beijing_now
 
 
@@ -28,6 +30,7 @@ class PDFProcessor:
             dpi: 图片渲染DPI，推荐300-400
         """
         self.dpi = dpi
+        self.last_page_timings: List[Dict] = []  # 最近一次 pdf_to_images 的逐页渲染耗时
     
     def pdf_to_images(self, pdf_path: str, output_dir: Optional[str] = None) -> List[str]:
         """
@@ -46,27 +49,18 @@ class PDFProcessor:
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        # 打开PDF文件
-        pdf_document = fitz.open(pdf_path)
+        # 各页由多进程光栅化器并行渲染（已缓存的页面直接复用），再按页序复制到输出目录
+        rendered, timings = get_page_renderer().render_batch([(pdf_path, self.dpi)])
+        self.last_page_timings = timings
+        page_paths = rendered[(pdf_path, self.dpi)]
         image_paths = []
-        
-        try:
-            for page_num in range(len(pdf_document)):
-                page = pdf_document[page_num]
-                
-                # 设置渲染参数
-                mat = fitz.Matrix(self.dpi / 72, self.dpi / 72)  # 缩放矩阵
-                pix = page.get_pixmap(matrix=mat)
-                
-                # 保存图片
-                image_path = output_dir / f"page_{page_num + 1:03d}.png"
-                pix.save(str(image_path))
-                image_paths.append(str(image_path))
-                
-                print(f"已转换第 {page_num + 1}/{len(pdf_document)} 页")
-        
-        finally:
-            pdf_document.close()
+
+        for page_num, rendered_path in enumerate(page_paths):
+            image_path = output_dir / f"page_{page_num + 1:03d}.png"
+            shutil.copyfile(rendered_path, image_path)
+            image_paths.append(str(image_path))
+
+            print(f"已转换第 {page_num + 1}/{len(page_paths)} 页")
         
         return image_paths
     
@@ -218,62 +212,12 @@ class ModelProcessor:
                 scene.apply_scale(scale_factor)
                 print(f"   📏 应用缩放因子: {scale_factor}")
 
-            # 尝试修复节点/几何名称的编码（常见场景：latin1字节需按GBK/GB18030解码）
-            def _decode_name(name: str) -> str:
-                if not name:
-                    return name
-                # ✅ 如果已经包含中文，直接返回（避免重复编解码导致丢失）
-                if re.search(r'[\u4e00-\u9fff]', str(name)):
-                    return str(name)
-                try:
-                    raw_bytes = str(name).encode("latin1", errors="ignore")
-                except Exception:
-                    return str(name)
-                for enc in ("gbk", "gb18030"):
-                    try:
-                        decoded = raw_bytes.decode(enc)
-                        if decoded:
-                            return decoded
-                    except Exception:
-                        continue
-                return str(name)
-
+            # 导出前在内存中一次性修复名称编码（latin1误读的GBK/GB18030字节）并重新绑定graph，只导出一次
             if isinstance(scene, self.trimesh.Scene):
-                # 先修复 geometry 名称，避免导出 GLB 时出现乱码，使用官方 graph.update 保持引用一致
-                new_geometry = {}
-                name_map = {}
-                for old_name, geom in scene.geometry.items():
-                    fixed_name = _decode_name(old_name)
-                    if fixed_name in new_geometry and new_geometry[fixed_name] is not geom:
-                        fixed_name = f"{fixed_name}_{len(new_geometry)}"
-                    new_geometry[fixed_name] = geom
-                    name_map[old_name] = fixed_name
-                scene.geometry = new_geometry
-
-                # 同步 graph 引用的 geometry 名称，避免直接赋值导致绑定失效
-                for node in list(scene.graph.nodes_geometry):
-                    try:
-                        transform, geom_name = scene.graph[node]
-                        fixed_geom_name = name_map.get(geom_name, _decode_name(geom_name))
-                        scene.graph.update(
-                            frame_from=None,
-                            frame_to=node,
-                            matrix=transform,
-                            geometry=fixed_geom_name
-                        )
-                    except Exception:
-                        continue
-
-                # 绑定完整性自检：节点绑定数量应与 geometry 数量接近
-                with_geom = [n for n in scene.graph.nodes if scene.graph[n][1] is not None]
-                if scene.geometry and len(with_geom) / len(scene.geometry) < 0.95:
-                    raise ValueError(
-                        f"节点与geometry绑定缺失：with_geom={len(with_geom)}, geometry={len(scene.geometry)}"
-                    )
+                fix_scene_names(scene)
             else:
                 # 单网格场景，尝试修复元数据名称
-                mesh_name = _decode_name(getattr(scene, "metadata", {}).get("name", "mesh_0"))
-                scene.metadata["name"] = mesh_name
+                scene.metadata["name"] = decode_name(getattr(scene, "metadata", {}).get("name", "mesh_0"))
 
             # 确保输出目录存在
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -338,7 +282,8 @@ class ModelProcessor:
     def generate_glb_inventory(
         self,
         glb_path: str,
-        output_path: Optional[str] = None
+        output_path: Optional[str] = None,
+        scenes=None
     ) -> Dict:
         """
         生成 GLB 节点/几何清单，便于调试缺件问题。
@@ -346,6 +291,7 @@ class ModelProcessor:
         Args:
             glb_path: GLB 文件路径
             output_path: 如提供则写入文件，否则仅返回字典
+            scenes: 任务内的场景注册表（core.scene_registry.SceneRegistry），提供时复用已加载的场景
 
         Returns:
             {
@@ -359,7 +305,7 @@ class ModelProcessor:
             }
         """
         try:
-            scene = self.trimesh.load(glb_path, force='scene')
+            scene = scenes.acquire(glb_path) if scenes is not None else self.trimesh.load(glb_path, force='scene')
             if not isinstance(scene, self.trimesh.Scene):
                 return {
                     "success": False,
@@ -426,7 +372,8 @@ class ModelProcessor:
         self,
         glb_path: str,
         assembly_spec: Dict,
-        output_dir: str
+        output_dir: str,
+        scenes=None
     ) -> Dict:
         """
         生成爆炸动画数据
@@ -435,6 +382,7 @@ class ModelProcessor:
             glb_path: GLB文件路径
             assembly_spec: 装配规程JSON
             output_dir: 输出目录
+            scenes: 任务内的场景注册表，提供时复用已加载的场景（只读，不修改场景）
 
         Returns:
             包含manifest.json路径和爆炸数据的字典
@@ -442,8 +390,8 @@ class ModelProcessor:
         try:
             import numpy as np
 
-            # 加载GLB文件
-            scene = self.trimesh.load(glb_path)
+            # 加载GLB文件（有场景注册表时同一GLB在任务内只解析一次）
+            scene = scenes.acquire(glb_path) if scenes is not None else self.trimesh.load(glb_path)
 
             if not isinstance(scene, self.trimesh.Scene):
                 # 单个网格，无法分解
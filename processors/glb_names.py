@@ -0,0 +1,79 @@
+"""场景/GLB 名称编码修复：在导出前对内存中的场景一次性完成名称解码与 graph 重新绑定。"""
+
+from __future__ import annotations
+
+import re
+from typing import Dict
+
+_CJK = re.compile(r"[\u4e00-\u9fff]")
+
+
+def decode_name(name) -> str:
+    """把被按 latin1/cp1252 误读的中文名称（GB18030/GBK/UTF-8 字节）还原；已含中文时原样返回"""
+    if not name:
+        return name
+    name = str(name)
+    if _CJK.search(name):
+        return name
+
+    candidates = []
+    for raw_enc in ("latin1", "cp1252"):
+        try:
+            raw_bytes = name.encode(raw_enc, errors="ignore")
+        except Exception:
+            continue
+        for target in ("gb18030", "gbk", "utf-8"):
+            try:
+                decoded = raw_bytes.decode(target, errors="ignore")
+            except Exception:
+                continue
+            if decoded and _CJK.search(decoded):
+                return decoded
+            candidates.append(decoded)
+    return candidates[0] if candidates and candidates[0] else name
+
+
+def fix_scene_names(scene) -> Dict[str, str]:
+    """
+    修复 trimesh.Scene 的 geometry 名称并同步 graph 引用（原地修改）
+
+    Returns:
+        {旧名称: 新名称}
+
+    Raises:
+        ValueError: 重新绑定后节点与 geometry 的绑定缺失
+    """
+    name_map: Dict[str, str] = {}
+    new_geometry = {}
+    for old_name, geom in scene.geometry.items():
+        base = decode_name(old_name) or str(old_name)
+        candidate = base
+        idx = 1
+        while candidate in new_geometry and new_geometry[candidate] is not geom:
+            idx += 1
+            candidate = f"{base}_{idx}"
+        new_geometry[candidate] = geom
+        name_map[old_name] = candidate
+
+    if not name_map:
+        return name_map
+    scene.geometry = new_geometry
+
+    # 使用 graph.update 同步 geometry 引用，直接赋值会导致绑定失效
+    for node in list(scene.graph.nodes_geometry):
+        try:
+            transform, geom_name = scene.graph[node]
+            scene.graph.update(
+                frame_from=None,
+                frame_to=node,
+                matrix=transform,
+                geometry=name_map.get(geom_name, decode_name(geom_name))
+            )
+        except Exception:
+            continue
+
+    # 绑定完整性自检：节点绑定数量应与 geometry 数量接近
+    with_geom = [n for n in scene.graph.nodes if scene.graph[n][1] is not None]
+    if scene.geometry and len(with_geom) / len(scene.geometry) < 0.95:
+        raise ValueError(f"节点与geometry绑定缺失：with_geom={len(with_geom)}, geometry={len(scene.geometry)}")
+    return name_map
@@ -0,0 +1,245 @@
+"""STEP 并行网格化：所有组件/产品的 STEP 同时提交，在预启动的常驻子进程中转换（超时、内存上限、崩溃只影响该文件）。"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from config import PERFORMANCE_CONFIG
+from processors.step_to_glb_converter import StepToGlbConverter
+from utils.logger import bind_task_context, print_info, print_warning
+
+
+@dataclass(frozen=True)
+class TessellationJob:
+    key: Any          # 调用方用于取回结果的键，如 ("component", 3) / ("product", None)
+    step_path: str
+    output_path: str
+    scale_factor: float = 0.001
+
+
+def _failure(error_type: str, error: str, **details) -> Dict:
+    """结构化的失败结果（写入 convert_result，error_type: timeout / memory_limit / crashed / exception / conversion）"""
+    return {"success": False, "error": error, "error_type": error_type, "message": "转换失败", **details}
+
+
+# ---------- 子进程 ----------
+def _limit_memory(memory_mb: int) -> None:
+    if memory_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:  # 非 POSIX 平台不限制
+        return
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_loop(conn, memory_mb: int) -> None:
+    """
+    常驻子进程入口：先导入 trimesh/cascadio（预热），再逐个处理父进程发来的任务
+
+    任务为 (step_path, output_path, scale_factor)，收到 None 或管道关闭时退出。
+    子进程内不查缓存，缓存由父进程处理。
+    """
+    _limit_memory(memory_mb)
+    try:
+        import cascadio  # noqa: F401  预热 STEP 加载器
+    except ImportError:
+        pass
+    converter = StepToGlbConverter()
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        step_path, output_path, scale_factor = job
+        start = time.perf_counter()
+        try:
+            result = converter.convert(step_path, output_path, scale_factor, use_cache=False)
+        except MemoryError:
+            result = _failure("memory_limit", f"转换超出内存上限 {memory_mb}MB", memory_limit_mb=memory_mb)
+        except Exception as e:
+            result = _failure("exception", str(e))
+        if not result.get("success"):
+            result.setdefault("error_type", "conversion")
+        result["worker_pid"] = os.getpid()
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        conn.send(result)
+    conn.close()
+
+
+class _Worker:
+    """一个常驻转换子进程（spawn 启动，不继承父进程的线程/锁状态）"""
+
+    def __init__(self, memory_mb: int):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_loop, args=(child_conn, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(5)
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class TessellationWorkerPool:
+    """
+    预启动的转换子进程池
+
+    - 空闲子进程已完成导入，任务到来时直接转换
+    - 超时：杀掉该子进程；崩溃/超内存：丢弃该子进程；其余任务不受影响，下次按需补充
+    - 每个子进程处理 step_tessellation_worker_max_jobs 个任务后回收，避免内存碎片累积
+    """
+
+    def __init__(self):
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+
+    def prestart(self, count: int) -> None:
+        """补足 count 个空闲子进程（子进程在后台完成导入）"""
+        memory_mb = PERFORMANCE_CONFIG["step_tessellation_memory_mb"]
+        with self._lock:
+            self._idle = [w for w in self._idle if w.alive()]
+            missing = count - len(self._idle)
+            self._idle.extend(_Worker(memory_mb) for _ in range(max(missing, 0)))
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.kill()
+        return _Worker(PERFORMANCE_CONFIG["step_tessellation_memory_mb"])
+
+    def _checkin(self, worker: _Worker) -> None:
+        if worker.jobs >= PERFORMANCE_CONFIG["step_tessellation_worker_max_jobs"] or not worker.alive():
+            worker.stop()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def run(self, step_path: str, output_path: str, scale_factor: float) -> Dict:
+        """在子进程中转换一个STEP，超过 step_tessellation_timeout 秒时杀掉子进程"""
+        timeout = PERFORMANCE_CONFIG["step_tessellation_timeout"]
+        memory_mb = PERFORMANCE_CONFIG["step_tessellation_memory_mb"]
+        name = os.path.basename(step_path)
+        worker = self._checkout()
+        worker.jobs += 1
+        try:
+            worker.conn.send((step_path, output_path, scale_factor))
+            # 子进程退出时管道关闭，poll 同样返回 True
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                print_warning(f"STEP转换超时（{timeout}秒），已终止: {name}")
+                return _failure("timeout", f"转换超时（{timeout}秒）", timeout=timeout)
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.kill()
+            exitcode = worker.process.exitcode
+            print_warning(f"STEP转换进程异常退出 (exitcode={exitcode}): {name}")
+            hint = f"，可能超出内存上限 {memory_mb}MB" if memory_mb > 0 else "，STEP文件可能已损坏"
+            return _failure("crashed", f"转换进程异常退出 (exitcode={exitcode}){hint}", exitcode=exitcode)
+
+        if result.get("error_type") == "memory_limit":
+            # 超内存后子进程状态不可信，直接回收
+            worker.kill()
+        else:
+            self._checkin(worker)
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+
+_pool = TessellationWorkerPool()
+
+
+def run_isolated(step_path: str, output_path: str, scale_factor: float) -> Dict:
+    """在常驻子进程中转换一个STEP（StepToGlbConverter.convert 的 runner）"""
+    return _pool.run(step_path, output_path, scale_factor)
+
+
+# ---------- 调度 ----------
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _worker_count() -> int:
+    configured = PERFORMANCE_CONFIG["step_tessellation_workers"]
+    return int(configured) if configured else min(os.cpu_count() or 1, 4)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """进程级共享的调度线程池（线程数即同时运行的转换子进程上限，所有任务共享）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_worker_count(), thread_name_prefix="step-tessellation")
+        return _executor
+
+
+def prestart_workers() -> None:
+    """预启动转换子进程（服务启动时调用，首个任务无需等待导入）"""
+    if PERFORMANCE_CONFIG["step_tessellation_isolated"] and PERFORMANCE_CONFIG["step_tessellation_prefork"]:
+        count = _worker_count()
+        _pool.prestart(count)
+        print_info(f"已预启动 {count} 个STEP转换子进程")
+
+
+def shutdown_tessellation() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+    _pool.shutdown()
+
+
+def default_runner():
+    """StepToGlbConverter.convert 的 runner：开启隔离时在子进程中转换，否则在当前进程"""
+    return run_isolated if PERFORMANCE_CONFIG["step_tessellation_isolated"] else None
+
+
+def _run_job(converter: StepToGlbConverter, job: TessellationJob) -> Dict:
+    return converter.convert(job.step_path, job.output_path, job.scale_factor, runner=default_runner())
+
+
+def submit_conversions(jobs: List[TessellationJob], converter: Optional[StepToGlbConverter] = None) -> Dict[Any, Future]:
+    """
+    一次提交全部转换任务，返回 {job.key: Future}
+
+    缓存查询/写入在父进程完成（命中缓存的任务不占用子进程）；调用方可按完成顺序
+    （as_completed）或按需（future.result()）取结果，先完成的GLB可以先进入匹配。
+    """
+    converter = converter or StepToGlbConverter()
+    executor = _get_executor()
+    # 绑定任务上下文：GLB缓存命中/写入统计记到提交任务名下
+    return {job.key: executor.submit(bind_task_context(_run_job), converter, job) for job in jobs}
@@ -1,18 +1,24 @@
-"""STEP 转 GLB 转换器，附带编码检测与GLB名称修复。"""
+"""STEP 转 GLB 转换器，附带编码检测；repair_glb_names 用于修复旧GLB文件的名称编码。"""
 
 from __future__ import annotations
 
-import re
+import os
 import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
 import chardet
 import trimesh
 
+from config import CACHE_CONFIG
+from core.glb_cache import get_glb_cache
 from processors.file_processor import ModelProcessor
+from processors.glb_names import fix_scene_names
 from utils.logger import print_info, print_warning
 
+# 转换器版本：修改转换/名称修复逻辑时递增，使旧的GLB转换缓存失效
+CONVERTER_VERSION = "2"
+
 
 class StepToGlbConverter:
     def __init__(self, model_processor: Optional[ModelProcessor] = None):
@@ -32,8 +38,49 @@ class StepToGlbConverter:
         "iso-2022-cn": "gb18030",
     }
 
-    def convert(self, step_path: str, output_path: str, scale_factor: float = 0.001) -> dict:
-        """将STEP转换为GLB，自动探测并转换编码，完成后修复GLB名称。"""
+    def convert(
+        self,
+        step_path: str,
+        output_path: str,
+        scale_factor: float = 0.001,
+        use_cache: bool = True,
+        runner: Optional[Callable[[str, str, float], dict]] = None
+    ) -> dict:
+        """
+        将STEP转换为GLB（相同STEP内容/缩放因子/转换器版本命中缓存时直接复用GLB与parts_info）
+
+        Args:
+            runner: 实际执行转换的函数 runner(step_path, output_path, scale_factor)，
+                默认在当前进程转换（processors.step_tessellation.run_isolated 在子进程中转换）
+
+        Returns:
+            转换结果；命中缓存时带 cache_hit=True
+        """
+        runner = runner or self._convert
+        if not (use_cache and CACHE_CONFIG["glb_conversions_enable"]):
+            return runner(step_path, output_path, scale_factor)
+
+        cache = get_glb_cache()
+        key = cache.make_key(step_path, scale_factor, self.converter_version())
+        with cache.key_lock(key):
+            cached = cache.fetch(key, output_path)
+            if cached is not None:
+                print_info(f"♻️  GLB转换缓存命中: {Path(step_path).name} ({cached.get('parts_count', 0)} 个零件)")
+                return cached
+            result = runner(step_path, output_path, scale_factor)
+            if result.get("success"):
+                cache.store(key, output_path, result)
+            return result
+
+    def converter_version(self) -> str:
+        """参与缓存键的转换器版本（含转换方式与trimesh版本）"""
+        method = "trimesh" if getattr(self.model_processor, "use_trimesh", True) else "blender"
+        return f"{CONVERTER_VERSION}-{method}-{trimesh.__version__}"
+
+    def _convert(self, step_path: str, output_path: str, scale_factor: float) -> dict:
+        """将STEP转换为GLB，自动探测并转换编码（名称修复在导出前完成，只导出一次）。"""
+        # 输出文件可能是GLB缓存条目的硬链接，先删除再写入，避免原地覆盖缓存内容
+        Path(output_path).unlink(missing_ok=True)
         tmp_file: Optional[Path] = None
         encoding = None
         confidence = 0.0
@@ -65,93 +112,45 @@ class StepToGlbConverter:
                 scale_factor=scale_factor
             )
 
-            # 成功后尝试修复GLB内的名称
+            # 名称编码已在导出前修复（processors.glb_names），不再重新加载/导出GLB
             if result.get("success"):
                 result["encoding_detected"] = encoding or "unknown"
                 result["encoding_confidence"] = confidence
-                self._fix_glb_names(Path(output_path))
 
             return result
         finally:
             if tmp_file and tmp_file.exists():
                 tmp_file.unlink(missing_ok=True)
 
-    # ---------- 内部工具 ----------
-    def _fix_glb_names(self, glb_path: Path) -> None:
-        """二次修复GLB内部的名称编码，避免乱码。"""
+    # ---------- 修复工具 ----------
+    @staticmethod
+    def repair_glb_names(glb_path: Path) -> bool:
+        """
+        修复旧GLB文件内部的名称编码（重新加载并导出；新转换在导出前已修复，无需调用）
+
+        Returns:
+            是否重新导出了文件
+        """
+        glb_path = Path(glb_path)
         try:
             scene = trimesh.load(glb_path, force="scene")
         except Exception as e:
             print_warning(f"GLB名称修复时加载失败: {e}")
-            return
+            return False
 
         if not isinstance(scene, trimesh.Scene):
-            return
-
-        def decode_name(name: str) -> str:
-            if not name:
-                return name
-            if re.search(r"[\u4e00-\u9fff]", name):
-                return name
+            return False
 
-            candidates = []
-            # 尝试将现有字符串当作latin1/cp1252字节再按常见中文编码解码
-            for raw_enc in ("latin1", "cp1252"):
-                try:
-                    raw_bytes = str(name).encode(raw_enc, errors="ignore")
-                except Exception:
-                    continue
-                for target in ("gb18030", "gbk", "utf-8"):
-                    try:
-                        decoded = raw_bytes.decode(target, errors="ignore")
-                        if decoded and re.search(r"[\u4e00-\u9fff]", decoded):
-                            return decoded
-                        candidates.append(decoded)
-                    except Exception:
-                        continue
-            return candidates[0] if candidates else str(name)
-
-        name_map = {}
-        new_geometry = {}
-
-        # 先修复 geometry 名称
-        for old_name, geom in scene.geometry.items():
-            fixed = decode_name(old_name) or str(old_name)
-            base = fixed
-            idx = 1
-            candidate = base
-            while candidate in new_geometry and new_geometry[candidate] is not geom:
-                idx += 1
-                candidate = f"{base}_{idx}"
-            new_geometry[candidate] = geom
-            name_map[old_name] = candidate
-
-        if name_map:
-            scene.geometry = new_geometry
-
-            # 更新 graph 引用的 geometry 名称，使用 graph.update 保证绑定不会失效
-            for node in list(scene.graph.nodes_geometry):
-                try:
-                    transform, geom_name = scene.graph[node]
-                    fixed_geom_name = name_map.get(geom_name, geom_name)
-                    scene.graph.update(
-                        frame_from=None,
-                        frame_to=node,
-                        matrix=transform,
-                        geometry=fixed_geom_name
-                    )
-                except Exception:
-                    continue
-
-            # 绑定完整性自检
-            with_geom = [n for n in scene.graph.nodes if scene.graph[n][1] is not None]
-            if scene.geometry and len(with_geom) / len(scene.geometry) < 0.95:
-                print_warning(
-                    f"GLB名称修复后绑定缺失：with_geom={len(with_geom)}, geometry={len(scene.geometry)}"
-                )
-                return
-
-            # 重新导出覆盖
-            glb_path.parent.mkdir(parents=True, exist_ok=True)
-            glb_path.write_bytes(scene.export(file_type="glb"))
-            print_info(f"🔤 已修复GLB名称编码: {glb_path.name}")
+        try:
+            if not fix_scene_names(scene):
+                return False
+        except ValueError as e:
+            print_warning(f"GLB名称修复后{e}")
+            return False
+
+        # 先写临时文件再替换（glb_path 可能是GLB转换缓存的硬链接，不能原地覆盖）
+        tmp_path = glb_path.with_name(glb_path.name + ".tmp")
+        tmp_path.write_bytes(scene.export(file_type="glb"))
+        os.replace(tmp_path, glb_path)
+        print_info(f"🔤 已修复GLB名称编码: {glb_path.name}")
+        return True
@@ -4,6 +4,8 @@ Agent 2: BOM-3D匹配智能体提示词
 用于AI智能匹配代码匹配失败的零件
 """
 
+from core.prompt_budget import columnar_table
+
 # AI智能匹配系统提示词
 AI_MATCHING_SYSTEM_PROMPT = """# 角色定位
 
@@ -469,16 +471,9 @@ AI_MATCHING_SYSTEM_PROMPT = """# 角色定位
 - **如果无法匹配，返回空数组[]**
 """
 
-# 用户查询模板
-AI_MATCHING_USER_QUERY = """请对以下未匹配的零件进行智能匹配，**使用COT（Chain of Thought）推理，目标是100%匹配率**。
-
-## 未匹配的3D零件（{parts_count}个）
-
-{unmatched_parts}
-
-## 未匹配的BOM项（{bom_count}个）
-
-{unmatched_bom}
+# 任务说明（静态，拼接在角色定位之后作为 system 提示词，保证每次请求的前缀逐字节相同以命中提示词缓存）
+AI_MATCHING_TASK_GUIDE = """
+# 📋 任务说明（未匹配的3D零件和BOM项见用户消息）
 
 ## 🧠 COT推理要求
 
@@ -509,7 +504,7 @@ AI_MATCHING_USER_QUERY = """请对以下未匹配的零件进行智能匹配，*
 
 ## 📋 输出格式
 
-必须为所有{parts_count}个3D零件都输出匹配结果！
+必须为用户消息中列出的每一个3D零件都输出匹配结果！
 
 - 如果某个3D零件与某个BOM项匹配，输出匹配对
 - 如果某个3D零件无法匹配任何BOM项，也要输出（bom_code为null，confidence为0）
@@ -519,26 +514,38 @@ AI_MATCHING_USER_QUERY = """请对以下未匹配的零件进行智能匹配，*
 严格按照以下JSON格式输出（包含COT推理过程）：
 
 ```json
-{{
-  "cot_analysis": {{
-    "total_unmatched_bom": {bom_count},
-    "total_unmatched_3d": {parts_count},
+{
+  "cot_analysis": {
+    "total_unmatched_bom": 未匹配BOM项数量,
+    "total_unmatched_3d": 未匹配3D零件数量,
     "analysis_steps": [
-      {{
+      {
         "bom_code": "...",
         "step1_extract": "...",
         "step2_candidates": ["...", "...", "..."],
         "step3_comparison": "...",
         "step4_confidence": 0.88,
         "step5_decision": "..."
-      }}
+      }
     ]
-  }},
+  },
   "ai_matched_pairs": [...]
-}}
+}
 ```
+"""
+
+# 用户查询模板（只含本次请求的数据）
+AI_MATCHING_USER_QUERY = """请对以下未匹配的零件进行智能匹配，**使用COT（Chain of Thought）推理，目标是100%匹配率**。
+
+## 未匹配的3D零件（{parts_count}个）
+
+{unmatched_parts}
+
+## 未匹配的BOM项（{bom_count}个）
+
+{unmatched_bom}
 
-**现在开始COT推理，直接输出JSON：**
+**请按系统提示中的COT推理要求和输出格式，现在开始COT推理，直接输出JSON：**
 """
 
 
@@ -556,19 +563,18 @@ def build_ai_matching_prompt(
     Returns:
         (system_prompt, user_query) 元组
     """
-    # 格式化未匹配的零件（简化格式，只保留关键信息）
-    # ✅ 传递所有未匹配的零件，Gemini 2.5 Flash支持100万token输入
-    parts_text = ""
-    for i, part in enumerate(unmatched_parts, 1):  # 传所有零件！
-        parts_text += f"{i}. {part.get('node_name')} | {part.get('geometry_name')}\n"
-
-    # 格式化未匹配的BOM（简化格式）
-    # ✅ 传递所有未匹配的BOM
-    bom_text = ""
-    for i, bom in enumerate(unmatched_bom, 1):  # 传所有BOM！
-        bom_text += f"{i}. {bom.get('code')} | {bom.get('name')} | {bom.get('product_code', '')}\n"
-
-    system_prompt = AI_MATCHING_SYSTEM_PROMPT
+    # 格式化未匹配的零件和BOM（列式表格，只保留匹配需要的字段，全部传入不截断；
+    # 超出token预算时由调用方按零件分批）
+    parts_text = columnar_table(
+        [{**part, 'index': i} for i, part in enumerate(unmatched_parts, 1)],
+        [('index', '#'), ('node_name', 'node_name'), ('geometry_name', 'geometry_name')]
+    )
+    bom_text = columnar_table(
+        [{**bom, 'index': i} for i, bom in enumerate(unmatched_bom, 1)],
+        [('index', '#'), ('code', 'code'), ('name', 'name'), ('product_code', 'product_code')]
+    )
+
+    system_prompt = AI_MATCHING_SYSTEM_PROMPT + AI_MATCHING_TASK_GUIDE  # 静态前缀
     user_query = AI_MATCHING_USER_QUERY.format(
         unmatched_parts=parts_text,
         unmatched_bom=bom_text,
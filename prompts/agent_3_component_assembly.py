@@ -4,6 +4,8 @@ Agent 3 - 组件装配工艺工程师
 V3.0 - 专业化提示词重构版（强调BOM 100%覆盖）
 """
 
+from core.prompt_budget import columnar_table
+
 COMPONENT_ASSEMBLY_SYSTEM_PROMPT = """# 🎯 角色定位
 
 你是一位经验丰富的**组件装配工艺工程师**，专门负责为单个组件编写详细的装配作业指导书。
@@ -459,8 +461,9 @@ COMPONENT_ASSEMBLY_SYSTEM_PROMPT = """# 🎯 角色定位
 **如果无法覆盖所有BOM零件，说明装配步骤不完整，需要重新生成！**
 """
 
-# 用户查询模板
-COMPONENT_ASSEMBLY_USER_QUERY = """请为以下组件生成装配步骤：
+# 任务说明（静态，拼接在角色定位之后作为 system 提示词，保证每次请求的前缀逐字节相同以命中提示词缓存）
+COMPONENT_ASSEMBLY_TASK_GUIDE = """
+# 📋 任务说明（组件信息、零件清单、装配规划建议见用户消息）
 
 ## 📸 视觉分析任务
 
@@ -482,20 +485,6 @@ COMPONENT_ASSEMBLY_USER_QUERY = """请为以下组件生成装配步骤：
    - 内部零件先装，外部零件后装
    - 基准件最先装，紧固件最后装
 
-## 组件信息
-
-- **组件代号**: {component_code}
-- **组件名称**: {component_name}
-- **基准件**: {base_part_name} ({base_part_code})
-
-## 组件内零件清单（从BOM表提取）
-
-{parts_list}
-
-## 装配规划建议
-
-{assembly_hints}
-
 ## 📝 输出要求
 
 **在生成装配步骤时，请：**
@@ -513,7 +502,7 @@ COMPONENT_ASSEMBLY_USER_QUERY = """请为以下组件生成装配步骤：
 
 ## 要求
 
-1. **⚠️ 必须100%覆盖所有BOM零件**：装配步骤必须包含上述零件清单中的**每一个**零件，一个都不能少
+1. **⚠️ 必须100%覆盖所有BOM零件**：装配步骤必须包含用户消息零件清单中的**每一个**零件，一个都不能少
 2. **充分利用视觉信息**：根据图纸上的零件编号和位置关系确定装配顺序
 3. 从基准件开始装配
 4. **步骤数量不限制**：根据实际装配需要生成足够的步骤，确保所有零件都被覆盖（通常需要8-20个步骤，甚至更多）
@@ -529,7 +518,7 @@ COMPONENT_ASSEMBLY_USER_QUERY = """请为以下组件生成装配步骤：
 **在输出JSON之前，你必须完成以下验证：**
 
 1. **BOM全覆盖验证**：
-   - [ ] 列出零件清单中的所有BOM序号（共{total_parts}个）
+   - [ ] 列出零件清单中的所有BOM序号（总数见零件清单标题）
    - [ ] 逐一检查每个BOM序号是否出现在某个步骤的parts_used中
    - [ ] 计算每个零件在所有步骤中使用的总数量，确保与零件清单中的数量一致
    - [ ] **如果有任何零件遗漏，立即添加新步骤或修改现有步骤来包含它**
@@ -545,38 +534,38 @@ COMPONENT_ASSEMBLY_USER_QUERY = """请为以下组件生成装配步骤：
 ## 📋 JSON输出格式
 
 ```json
-{{
+{
   "component_code": "组件代号",
   "component_name": "组件名称",
-  "visual_analysis": {{
+  "visual_analysis": {
     "base_part_drawing_number": "基准件在图纸上的序号（如①、1）",
     "assembly_sequence_reasoning": "根据图纸观察到的装配顺序推理（2-3句话，说明为什么这样排序）"
-  }},
+  },
   "assembly_steps": [
-    {{
-      "step_id": "{component_code}_step_{{步骤号}}（如：01.03.4178_step_1，全局唯一ID）",
+    {
+      "step_id": "组件代号_step_步骤号（如：01.03.4178_step_1，全局唯一ID）",
       "step_number": 1,
       "action": "操作动作（安装/固定/连接/调整）",
       "description": "详细操作说明（工人能听懂的大白话，引用图纸编号）",
       "position_description": "零件的位置关系描述（如'在图纸①号零件的右侧'）",
       "parts_used": [
-        {{
+        {
           "bom_seq": "零件在BOM表中的序号（如1、2、3...）",
           "bom_name": "零件名称",
           "quantity": 数量（数字类型）,
           "drawing_number": "零件在图纸上的序号（如①、②）"
-        }}
+        }
       ],
       "tools": ["所需工具1", "所需工具2"],
       "warnings": ["注意事项1", "注意事项2"]
-    }}
+    }
   ],
   "quality_checks": [
     "质量检查项1（可引用图纸编号）",
     "质量检查项2"
   ],
   "estimated_time_minutes": 预计装配时间（分钟）
-}}
+}
 ```
 
 **重要提示**：
@@ -586,8 +575,26 @@ COMPONENT_ASSEMBLY_USER_QUERY = """请为以下组件生成装配步骤：
 - 工具名称要具体（如"M8内六角扳手"而不是"扳手"）
 - 注意事项要实用，不要写废话
 - 充分利用图纸上的视觉信息，让装配步骤更直观
+"""
+
+# 用户查询模板（只含本次请求的数据）
+COMPONENT_ASSEMBLY_USER_QUERY = """请为以下组件生成装配步骤：
+
+## 组件信息
+
+- **组件代号**: {component_code}
+- **组件名称**: {component_name}
+- **基准件**: {base_part_name} ({base_part_code})
+
+## 组件内零件清单（从BOM表提取，共{total_parts}个）
 
-现在开始生成装配步骤！
+{parts_list}
+
+## 装配规划建议
+
+{assembly_hints}
+
+请按系统提示中的要求和强制自检清单，以JSON输出格式生成装配步骤，现在开始！
 """
 
 
@@ -602,14 +609,11 @@ def build_component_assembly_prompt(component_plan, parts_list):
     Returns:
         (system_prompt, user_query) 元组
     """
-    # 格式化零件清单（显示BOM序号）
-    parts_text = ""
-    for i, part in enumerate(parts_list, 1):
-        seq = part.get('seq', str(i))  # 使用BOM序号，如果没有则用索引
-        code = part.get('code', '')
-        name = part.get('name', '')
-        qty = part.get('qty', 0)
-        parts_text += f"BOM序号{seq}: {code} - {name} (数量: {qty})\n"
+    # 格式化零件清单（列式表格：表头一行 + 每个零件一行，只保留Agent需要的字段）
+    parts_text = columnar_table(
+        [{**part, 'seq': part.get('seq', str(i)), 'qty': part.get('qty', 0)} for i, part in enumerate(parts_list, 1)],
+        [('seq', 'BOM序号'), ('code', '代号'), ('name', '名称'), ('qty', '数量')]
+    )
 
     # 格式化装配提示（来自Agent 1的视觉分析）
     hints = component_plan.get('assembly_steps', [])
@@ -618,7 +622,7 @@ def build_component_assembly_prompt(component_plan, parts_list):
     # ✅ 提取Agent 1的视觉分析信息
     base_part_drawing_number = component_plan.get('base_part_drawing_number', '未标注')
 
-    system_prompt = COMPONENT_ASSEMBLY_SYSTEM_PROMPT
+    system_prompt = COMPONENT_ASSEMBLY_SYSTEM_PROMPT + COMPONENT_ASSEMBLY_TASK_GUIDE  # 静态前缀
     user_query = COMPONENT_ASSEMBLY_USER_QUERY.format(
         component_code=component_plan.get('component_code', ''),
         component_name=component_plan.get('component_name', ''),
@@ -635,3 +639,85 @@ def build_component_assembly_prompt(component_plan, parts_list):
 
     return system_prompt, user_query
 
+
+
+COMPONENT_GAP_FILL_SYSTEM_PROMPT = """# 🎯 角色定位
+
+你是一位经验丰富的**组件装配工艺工程师**。同事已经为组件编写了装配步骤，但漏掉了部分BOM零件。
+你的任务是**只补充缺失零件的装配步骤**，不修改、不重复已有步骤。
+
+## ⚠️ 规则
+
+1. 只为"未覆盖的BOM项"生成新步骤，每个未覆盖的零件都必须出现在某个新步骤的parts_used中
+2. 不要输出已有步骤，不要在新步骤中重复使用已有步骤已覆盖的零件
+3. insert_after_step_id：新步骤插入到哪个已有步骤之后（按BOM序号升序找到合适位置；插到最前面时填null）
+4. 组件默认以焊接为主（除非BOM/图纸明确说明是螺栓/销轴）
+5. 每个零件使用BOM序号（bom_seq，字符串），不要编造BOM项
+6. 只输出JSON，不要markdown，不要解释
+
+## 📋 JSON输出格式
+
+{
+  "additional_steps": [
+    {
+      "insert_after_step_id": "已有步骤的step_id（插到最前面时为null）",
+      "action": "操作动作（安装/固定/连接/调整）",
+      "description": "详细操作说明（工人能听懂的大白话，引用图纸编号）",
+      "position_description": "零件的位置关系描述",
+      "parts_used": [
+        {
+          "bom_seq": "BOM序号",
+          "bom_name": "零件名称",
+          "quantity": 数量（数字类型）,
+          "drawing_number": "零件在图纸上的序号（如①、②）"
+        }
+      ],
+      "tools": ["所需工具1"],
+      "warnings": ["注意事项1"]
+    }
+  ]
+}
+"""
+
+
+COMPONENT_GAP_FILL_USER_QUERY = """组件：{component_code} - {component_name}
+
+## 已有步骤（step_id | 动作 | 已用BOM序号）
+{existing_steps}
+
+## 未覆盖的BOM项（需要补充）
+{missing_parts}
+
+按系统提示中的JSON输出格式，只输出新增步骤。
+"""
+
+
+def build_component_gap_fill_prompt(component_plan, existing_steps, missing_parts):
+    """
+    构建覆盖率补全提示词（只要求为未覆盖的BOM项生成新增步骤）
+
+    Args:
+        component_plan: 组件装配规划（来自Agent 1）
+        existing_steps: 已生成的装配步骤（只发送 step_id、动作和已用BOM序号）
+        missing_parts: 未覆盖的BOM项（含 seq/code/name/qty）
+
+    Returns:
+        (system_prompt, user_query) 元组
+    """
+    steps_text = "\n".join(
+        f"{step.get('step_id')} | {step.get('action') or step.get('title', '')} | "
+        + ",".join(str(part.get("bom_seq", "")) for part in step.get("parts_used", []) if isinstance(part, dict))
+        for step in existing_steps
+    )
+
+    missing_text = columnar_table(
+        missing_parts, [('seq', 'BOM序号'), ('code', '代号'), ('name', '名称'), ('qty', '数量')]
+    )
+
+    user_query = COMPONENT_GAP_FILL_USER_QUERY.format(
+        component_code=component_plan.get('component_code', ''),
+        component_name=component_plan.get('component_name', ''),
+        existing_steps=steps_text or "（无）",
+        missing_parts=missing_text
+    )
+    return COMPONENT_GAP_FILL_SYSTEM_PROMPT, user_query
@@ -4,6 +4,8 @@
 用于生成产品级装配步骤（组件之间如何装配）
 """
 
+from core.prompt_budget import columnar_table
+
 # 产品总装配专家系统提示词
 PRODUCT_ASSEMBLY_SYSTEM_PROMPT = """# 🎯 角色定位
 你是一位资深的**产品总装工艺工程师**，专门负责将预装配好的组件拼装成最终产品。
@@ -427,8 +429,9 @@ PRODUCT_ASSEMBLY_SYSTEM_PROMPT = """# 🎯 角色定位
 **如果无法覆盖所有产品级零件，说明装配步骤不完整，需要重新生成！**
 """
 
-# 用户查询模板
-PRODUCT_ASSEMBLY_USER_QUERY = """请生成产品总装配步骤（将预装配好的组件拼装成产品）：
+# 任务说明（静态，拼接在角色定位之后作为 system 提示词，保证每次请求的前缀逐字节相同以命中提示词缓存）
+PRODUCT_ASSEMBLY_TASK_GUIDE = """
+# 📋 任务说明（产品信息、组件清单、产品级零件清单、装配规划建议见用户消息）
 
 ## 📸 视觉分析任务
 
@@ -450,26 +453,9 @@ PRODUCT_ASSEMBLY_USER_QUERY = """请生成产品总装配步骤（将预装配
    - 基准组件最先装，其他组件依次装配
    - 对称组件要同步安装
 
-## 产品信息
-
-- **产品名称**: {product_name}
-- **基准组件**: {base_component_name} ({base_component_code})
-
-## 组件清单（已预装配完成）
-
-{components_list}
-
-## 产品级零件清单（需要在总装时使用的零件，从BOM表提取）
-
-{product_bom_list}
-
-## 装配规划建议
-
-{assembly_sequence}
-
 ## 要求
 
-1. **⚠️ 必须100%覆盖所有产品级零件**：装配步骤必须包含上述产品级零件清单中的**每一个**零件，一个都不能少
+1. **⚠️ 必须100%覆盖所有产品级零件**：装配步骤必须包含用户消息产品级零件清单中的**每一个**零件，一个都不能少
 2. **充分利用视觉信息**：根据图纸上的组件编号和位置关系确定装配顺序
 3. 从基准组件开始装配
 4. **步骤数量不限制**：根据实际装配需要生成足够的步骤，确保所有组件和零件都被覆盖（通常需要5-15个步骤，甚至更多）
@@ -489,7 +475,7 @@ PRODUCT_ASSEMBLY_USER_QUERY = """请生成产品总装配步骤（将预装配
 **在输出JSON之前，你必须完成以下验证：**
 
 1. **产品级BOM全覆盖验证**：
-   - [ ] 列出产品级零件清单中的所有BOM代号（共{total_product_bom}个）
+   - [ ] 列出产品级零件清单中的所有BOM代号（总数见清单标题）
    - [ ] 逐一检查每个BOM代号是否出现在某个步骤的fasteners中
    - [ ] 计算每个零件在所有步骤中使用的总数量，确保与零件清单中的数量一致
    - [ ] **如果有任何零件遗漏，立即添加新步骤或修改现有步骤来包含它**
@@ -508,8 +494,29 @@ PRODUCT_ASSEMBLY_USER_QUERY = """请生成产品总装配步骤（将预装配
    - [ ] **⚠️ 使用bom_seq而不是bom_code**
 
 **如果自检发现产品级BOM未全覆盖，或者components/fasteners字段缺失/混淆，说明装配步骤不完整，必须重新生成！**
+"""
+
+# 用户查询模板（只含本次请求的数据）
+PRODUCT_ASSEMBLY_USER_QUERY = """请生成产品总装配步骤（将预装配好的组件拼装成产品）：
 
-现在开始生成总装配步骤！
+## 产品信息
+
+- **产品名称**: {product_name}
+- **基准组件**: {base_component_name} ({base_component_code})
+
+## 组件清单（已预装配完成）
+
+{components_list}
+
+## 产品级零件清单（需要在总装时使用的零件，从BOM表提取，共{total_product_bom}个）
+
+{product_bom_list}
+
+## 装配规划建议
+
+{assembly_sequence}
+
+请按系统提示中的要求和强制自检清单，现在开始生成总装配步骤！
 """
 
 
@@ -525,27 +532,18 @@ def build_product_assembly_prompt(product_plan, components_list, product_bom=Non
     Returns:
         (system_prompt, user_query) 元组
     """
-    # 格式化组件清单（包含Agent 1的视觉分析信息）
-    components_text = ""
-    for i, comp in enumerate(components_list, 1):
-        comp_code = comp.get('component_code', '')
-        comp_name = comp.get('component_name', '')
-        drawing_number = comp.get('drawing_number', '')
-
-        if drawing_number:
-            components_text += f"{i}. {comp_code} - {comp_name} (图纸序号: {drawing_number}, 已预装配)\n"
-        else:
-            components_text += f"{i}. {comp_code} - {comp_name} (已预装配)\n"
+    # 格式化组件清单（列式表格，包含Agent 1的视觉分析信息；组件均已预装配）
+    components_text = columnar_table(
+        [{**comp, 'index': i} for i, comp in enumerate(components_list, 1)],
+        [('index', '序号'), ('component_code', '组件代号'), ('component_name', '组件名称'), ('drawing_number', '图纸序号')]
+    )
 
-    # ✅ 格式化产品级BOM清单（显示BOM序号）
-    product_bom_text = ""
+    # ✅ 格式化产品级BOM清单（列式表格，显示BOM序号）
     if product_bom:
-        for i, item in enumerate(product_bom, 1):
-            seq = item.get('seq', str(i))
-            code = item.get('code', '')
-            name = item.get('name', '')
-            product_code = item.get('product_code', '')
-            product_bom_text += f"BOM序号{seq}: {code} - {name} ({product_code})\n"
+        product_bom_text = columnar_table(
+            [{**item, 'seq': item.get('seq', str(i))} for i, item in enumerate(product_bom, 1)],
+            [('seq', 'BOM序号'), ('code', '代号'), ('name', '名称'), ('product_code', '产品代号')]
+        )
     else:
         product_bom_text = "（无产品级零件）"
 
@@ -565,7 +563,7 @@ def build_product_assembly_prompt(product_plan, components_list, product_bom=Non
     # ✅ 提取Agent 1的视觉分析信息
     base_component_drawing_number = product_plan.get('base_component_drawing_number', '未标注')
 
-    system_prompt = PRODUCT_ASSEMBLY_SYSTEM_PROMPT
+    system_prompt = PRODUCT_ASSEMBLY_SYSTEM_PROMPT + PRODUCT_ASSEMBLY_TASK_GUIDE  # 静态前缀
     user_query = PRODUCT_ASSEMBLY_USER_QUERY.format(
         product_name=product_plan.get('product_name', ''),
         base_component_name=product_plan.get('base_component_name', ''),
@@ -3,6 +3,8 @@
 Agent 5: 焊接工艺智能体提示词
 """
 
+from core.step_delta import compact_steps_for_prompt
+
 # 焊接工艺专家系统提示词
 WELDING_SYSTEM_PROMPT = """# 角色定位
 
@@ -92,26 +94,20 @@ WELDING_SYSTEM_PROMPT = """# 角色定位
 
 ## 核心原则
 
-1. **步骤级嵌入**：为每个需要焊接的步骤添加welding字段，而不是单独列出焊接要求
+1. **步骤级嵌入**：为每个需要焊接的步骤给出welding信息（按step_id对应），而不是单独列出焊接要求
 2. **工人友好**：使用通俗语言，避免专业术语（如"焊脚高度6mm"而不是"焊脚尺寸a=6"）
 3. **安全第一**：每个焊接步骤都要有具体的安全提示
 4. **质量保证**：明确焊接质量要求和检验方法
 
 ## 输出格式
 
-严格按照以下JSON格式输出（返回增强后的装配步骤）：
+严格按照以下JSON格式输出（**只返回需要焊接的步骤的焊接信息**，不要重复输出装配步骤本身）：
 
 ```json
 {
-  "enhanced_steps": [
+  "welding_additions": [
     {
-      "step_number": 1,
-      "title": "步骤标题",
-      "parts_used": [...],
-      "tools_required": [...],
-      "operation": "操作说明",
-      "quality_check": "质量检查",
-      "estimated_time_minutes": 10,
+      "step_id": "01.03.4178_step_1",
       "welding": {
         "required": true,
         "welding_type": "角焊",
@@ -121,15 +117,6 @@ WELDING_SYSTEM_PROMPT = """# 角色定位
         "quality_requirements": "焊缝饱满、连续，无气孔、夹渣、裂纹",
         "safety_notes": "佩戴焊接面罩和防护手套，确保通风良好，周围无易燃物"
       }
-    },
-    {
-      "step_number": 2,
-      "title": "另一个步骤",
-      "parts_used": [...],
-      "operation": "操作说明",
-      "quality_check": "质量检查",
-      "estimated_time_minutes": 15
-      // ⚠️ 如果不需要焊接，不添加welding字段
     }
   ]
 }
@@ -137,10 +124,10 @@ WELDING_SYSTEM_PROMPT = """# 角色定位
 
 **⚠️ 关键要求**：
 
-1. **步骤级嵌入**：
-   - 为每个需要焊接的步骤添加`welding`字段
-   - 不需要焊接的步骤不添加`welding`字段
-   - 保持原有步骤的所有字段不变
+1. **按step_id增量输出**：
+   - `step_id` 必须原样复制输入步骤中的 `step_id`，不要自己编造
+   - 只为需要焊接的步骤输出一条记录；不需要焊接的步骤不要输出
+   - 不要输出 title、operation、parts_used 等原有字段（系统会自动合并）
 
 2. **焊接位置要具体**：
    - 说明是哪两个零件之间的焊接（如"零件①与零件②的连接处"）
@@ -159,13 +146,14 @@ WELDING_SYSTEM_PROMPT = """# 角色定位
 ## 重要提醒
 
 - **只输出JSON，不要输出其他内容**
-- **保持原有字段不变**：不要修改或删除原有的字段
+- **只输出新增的welding信息**：原有步骤字段由系统保留，不需要重复输出
 - **焊接信息要完整**：type、method、size、position、quality、safety都要有
 - **质量要求要明确**：说明焊缝的外观要求和检验方法
 """
 
-# 用户查询模板
-WELDING_USER_QUERY = """请为以下装配步骤添加焊接要点（如果涉及焊接）。
+# 任务说明（静态，拼接在角色定位之后作为 system 提示词，保证每次请求的前缀逐字节相同以命中提示词缓存）
+WELDING_TASK_GUIDE = """
+# 📋 任务说明（装配步骤见用户消息）
 
 ## 📸 视觉分析任务
 
@@ -186,10 +174,6 @@ WELDING_USER_QUERY = """请为以下装配步骤添加焊接要点（如果涉
    - 焊后处理要求（如打磨、清理等）
    - 无损检测要求
 
-## 装配步骤
-
-{assembly_steps_json}
-
 ## 要求
 
 请按照以下5个步骤思考，为装配步骤添加焊接要点：
@@ -227,8 +211,8 @@ WELDING_USER_QUERY = """请为以下装配步骤添加焊接要点（如果涉
 **在输出JSON之前，你必须完成以下验证：**
 
 1. **焊接步骤识别验证**：
-   - [ ] 所有涉及焊接的步骤都添加了welding字段
-   - [ ] 不需要焊接的步骤没有添加welding字段
+   - [ ] 所有涉及焊接的步骤都在welding_additions中有一条记录
+   - [ ] 不需要焊接的步骤没有出现在welding_additions中
    - [ ] welding.required字段正确设置为true
 
 2. **焊接信息完整性验证**：
@@ -240,13 +224,21 @@ WELDING_USER_QUERY = """请为以下装配步骤添加焊接要点（如果涉
    - [ ] 使用工人能看懂的语言（如"焊缝高度6mm"而不是"焊脚尺寸a=6"）
    - [ ] 避免专业术语和英文缩写
 
-4. **原有字段保持验证**：
-   - [ ] 原有步骤的所有字段都保持不变
-   - [ ] 没有修改或删除任何原有字段
+4. **step_id验证**：
+   - [ ] 每条记录的step_id都原样来自用户消息中的装配步骤
+   - [ ] 没有重复输出装配步骤的原有字段
 
 **如果自检发现任何问题，必须重新生成！**
+"""
+
+# 用户查询模板（只含本次请求的数据）
+WELDING_USER_QUERY = """请为以下装配步骤添加焊接要点（如果涉及焊接）。
+
+## 装配步骤
+
+{assembly_steps_json}
 
-现在开始为装配步骤添加焊接要点！
+请按系统提示中的要求和强制自检清单，现在开始为装配步骤添加焊接要点！
 """
 
 
@@ -262,10 +254,10 @@ def build_welding_prompt(assembly_steps: list) -> tuple:
     """
     import json
 
-    # ✅ 将装配步骤转换为JSON字符串
-    steps_json = json.dumps(assembly_steps, ensure_ascii=False, indent=2)
+    # ✅ 将装配步骤转换为紧凑JSON字符串（只含阅读所需字段，不缩进，按step_id增量输出）
+    steps_json = json.dumps(compact_steps_for_prompt(assembly_steps), ensure_ascii=False, separators=(",", ":"))
 
-    system_prompt = WELDING_SYSTEM_PROMPT
+    system_prompt = WELDING_SYSTEM_PROMPT + WELDING_TASK_GUIDE  # 静态前缀
     user_query = WELDING_USER_QUERY.format(
         assembly_steps_json=steps_json
     )
@@ -3,6 +3,8 @@
 Agent 6: 安全FAQ智能体提示词
 """
 
+from core.step_delta import compact_steps_for_prompt
+
 # 安全FAQ专家系统提示词
 SAFETY_FAQ_SYSTEM_PROMPT = """# 角色定位
 
@@ -87,7 +89,7 @@ SAFETY_FAQ_SYSTEM_PROMPT = """# 角色定位
 - 强调安全操作规程的遵守
 
 ### 步骤4：添加安全警告
-- 为每个有风险的步骤添加safety_warnings字段
+- 为每个有风险的步骤输出safety_warnings
 - 每条警告要简洁明了，说明具体的风险和预防措施
 - 使用工人能看懂的语言
 
@@ -98,32 +100,20 @@ SAFETY_FAQ_SYSTEM_PROMPT = """# 角色定位
 
 ## 核心原则
 
-1. **步骤级嵌入**：为每个有风险的步骤添加safety_warnings字段，而不是单独列出安全警告
+1. **步骤级嵌入**：为每个有风险的步骤给出safety_warnings（按step_id对应），而不是单独列出安全警告
 2. **工人友好**：使用通俗语言，避免专业术语
 3. **具体可操作**：说明具体的风险和预防措施，而不是泛泛而谈
 4. **不重复显示**：安全警告只在下方"安全"标签页中统一显示，不在当前步骤详情中重复显示
 
 ## 输出格式
 
-严格按照以下JSON格式输出（返回增强后的装配步骤）：
+严格按照以下JSON格式输出（**只返回有安全风险的步骤的安全警告**，不要重复输出装配步骤本身）：
 
 ```json
 {
-  "enhanced_steps": [
+  "safety_additions": [
     {
-      "step_number": 1,
-      "title": "点焊定位",
-      "parts_used": [...],
-      "tools_required": [...],
-      "operation": "操作说明",
-      "quality_check": "质量检查",
-      "estimated_time_minutes": 10,
-      "welding": {
-        "required": true,
-        "welding_type": "点焊",
-        "welding_method": "CO2气保焊",
-        ...
-      },
+      "step_id": "01.03.4178_step_1",
       "safety_warnings": [
         "佩戴焊接面罩和防护手套，防止弧光灼伤眼睛和皮肤",
         "确保工件夹紧牢固，防止点焊时位移造成伤害",
@@ -132,25 +122,11 @@ SAFETY_FAQ_SYSTEM_PROMPT = """# 角色定位
       ]
     },
     {
-      "step_number": 2,
-      "title": "螺栓连接",
-      "parts_used": [...],
-      "operation": "操作说明",
-      "quality_check": "质量检查",
-      "estimated_time_minutes": 15,
+      "step_id": "01.03.4178_step_2",
       "safety_warnings": [
         "佩戴安全帽和防护眼镜，防止零件坠落和飞溅",
         "使用扭力扳手时注意力度，防止扳手滑脱伤人"
       ]
-    },
-    {
-      "step_number": 3,
-      "title": "简单装配",
-      "parts_used": [...],
-      "operation": "操作说明",
-      "quality_check": "质量检查",
-      "estimated_time_minutes": 5
-      // ⚠️ 如果没有明显安全风险，不添加safety_warnings字段
     }
   ]
 }
@@ -158,10 +134,10 @@ SAFETY_FAQ_SYSTEM_PROMPT = """# 角色定位
 
 **⚠️ 关键要求**：
 
-1. **步骤级嵌入**：
-   - 为每个有风险的步骤添加`safety_warnings`字段
-   - 没有明显风险的步骤不添加`safety_warnings`字段
-   - 保持原有步骤的所有字段不变
+1. **按step_id增量输出**：
+   - `step_id` 必须原样复制输入步骤中的 `step_id`，不要自己编造
+   - 只为有风险的步骤输出一条记录；没有明显风险的步骤不要输出
+   - 不要输出 title、operation、welding 等原有字段（系统会自动合并）
 
 2. **安全警告要具体**：
    - ✅ 说"佩戴焊接面罩和防护手套，防止弧光灼伤眼睛和皮肤"
@@ -180,13 +156,14 @@ SAFETY_FAQ_SYSTEM_PROMPT = """# 角色定位
 ## 重要提醒
 
 - **只输出JSON，不要输出其他内容**
-- **保持原有字段不变**：不要修改或删除原有的字段（包括welding字段）
+- **只输出新增的safety_warnings**：原有步骤字段（包括welding字段）由系统保留，不需要重复输出
 - **警告要简洁明了**：每条警告一句话，说明风险和预防措施
 - **不要过度警告**：只针对有明显风险的步骤添加警告
 """
 
-# 用户查询模板
-SAFETY_FAQ_USER_QUERY = """请为以下装配步骤添加安全警告（如果有安全风险）。
+# 任务说明（静态，拼接在角色定位之后作为 system 提示词，保证每次请求的前缀逐字节相同以命中提示词缓存）
+SAFETY_FAQ_TASK_GUIDE = """
+# 📋 任务说明（装配步骤见用户消息）
 
 ## 📸 视觉分析任务
 
@@ -207,10 +184,6 @@ SAFETY_FAQ_USER_QUERY = """请为以下装配步骤添加安全警告（如果
    - 高空位置（容易坠落）
    - 密闭空间（通风不良）
 
-## 装配步骤
-
-{assembly_steps_json}
-
 ## 要求
 
 请按照以下5个步骤思考，为装配步骤添加安全警告：
@@ -252,8 +225,8 @@ SAFETY_FAQ_USER_QUERY = """请为以下装配步骤添加安全警告（如果
 **在输出JSON之前，你必须完成以下验证：**
 
 1. **风险步骤识别验证**：
-   - [ ] 所有涉及焊接、吊装、高空、重物搬运的步骤都添加了safety_warnings字段
-   - [ ] 没有明显风险的步骤没有添加safety_warnings字段
+   - [ ] 所有涉及焊接、吊装、高空、重物搬运的步骤都在safety_additions中有一条记录
+   - [ ] 没有明显风险的步骤没有出现在safety_additions中
 
 2. **安全警告完整性验证**：
    - [ ] 每个safety_warnings字段都是字符串数组
@@ -265,13 +238,21 @@ SAFETY_FAQ_USER_QUERY = """请为以下装配步骤添加安全警告（如果
    - [ ] 避免专业术语和英文缩写
    - [ ] 每条警告简洁明了（一句话）
 
-4. **原有字段保持验证**：
-   - [ ] 原有步骤的所有字段都保持不变（包括welding字段）
-   - [ ] 没有修改或删除任何原有字段
+4. **step_id验证**：
+   - [ ] 每条记录的step_id都原样来自用户消息中的装配步骤
+   - [ ] 没有重复输出装配步骤的原有字段
 
 **如果自检发现任何问题，必须重新生成！**
+"""
+
+# 用户查询模板（只含本次请求的数据）
+SAFETY_FAQ_USER_QUERY = """请为以下装配步骤添加安全警告（如果有安全风险）。
+
+## 装配步骤
+
+{assembly_steps_json}
 
-现在开始为装配步骤添加安全警告！
+请按系统提示中的要求和强制自检清单，现在开始为装配步骤添加安全警告！
 """
 
 
@@ -289,10 +270,10 @@ def build_safety_faq_prompt(
     """
     import json
 
-    # ✅ 将装配步骤转换为JSON字符串
-    steps_json = json.dumps(assembly_steps, ensure_ascii=False, indent=2)
+    # ✅ 将装配步骤转换为紧凑JSON字符串（只含阅读所需字段，不缩进，按step_id增量输出）
+    steps_json = json.dumps(compact_steps_for_prompt(assembly_steps), ensure_ascii=False, separators=(",", ":"))
 
-    system_prompt = SAFETY_FAQ_SYSTEM_PROMPT
+    system_prompt = SAFETY_FAQ_SYSTEM_PROMPT + SAFETY_FAQ_TASK_GUIDE  # 静态前缀
     user_query = SAFETY_FAQ_USER_QUERY.format(
         assembly_steps_json=steps_json
     )
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""BOM 文字层提取回归测试（使用仓库自带的测试图纸）"""
+
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fitz")
+
+from core.bom_text_extractor import extract_pdf_bom
+
+PDF_DIR = Path(__file__).resolve().parent.parent / "测试-pdf"
+
+
+def test_component_drawing_with_material_code_column_resolves_locally():
+    """表头为"序号 物料代码 代号 名称 数量 单重 总重 备注"时，物料代码不应并入序号列"""
+    page = extract_pdf_bom(str(PDF_DIR / "组件图2.pdf"))[1]
+
+    assert page.status == "resolved"
+    assert [row["seq"] for row in page.rows] == [str(i) for i in range(1, 11)]
+    first = page.rows[0]
+    assert first["code"] == "01.01.01.11511"
+    assert first["product_code"] == "T-SPV250-Z602-02-01-Q355B"
+    assert first["name"] == "方形板-机加"
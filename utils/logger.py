@@ -6,7 +6,11 @@
 
 import sys
 import io
-from typing import Optional
+import contextvars
+import functools
+import itertools
+import threading
+from typing import Callable, Optional
 from collections import deque
 
 # 设置标准输出为UTF-8编码
@@ -19,14 +23,44 @@ if sys.platform == 'win32':
 # 每个任务一个日志队列，最多保留1000条日志
 _log_buffers = {}
 _current_task_id = None
+# ✅ 当前线程/协程所属的任务（多个任务并发时互不覆盖；提交到线程池时用 bind_task_context 传递）
+_task_context: contextvars.ContextVar = contextvars.ContextVar("task_id", default=None)
+
+# ✅ 结构化事件缓冲区（流式生成的装配步骤等，通过SSE/WebSocket推送给前端）
+# 每条事件带单调递增的 seq，消费方按 seq 续读（缓冲区满后旧事件被丢弃，长度不再变化）
+_event_buffers = {}
+_event_seqs = {}
+_event_runs = {}  # 任务ID -> 当前运行的令牌（resume 重跑复用同一任务ID）
+_event_lock = threading.Lock()
 
 
 def set_current_task(task_id: Optional[str]):
     """设置当前任务ID，用于日志路由"""
     global _current_task_id
     _current_task_id = task_id
+    _task_context.set(task_id)
     if task_id and task_id not in _log_buffers:
         _log_buffers[task_id] = deque(maxlen=1000)
+    with _event_lock:
+        if task_id and task_id not in _event_buffers:
+            _event_buffers[task_id] = deque(maxlen=1000)
+            _event_seqs[task_id] = itertools.count(1)
+
+
+def get_current_task() -> Optional[str]:
+    """获取当前任务ID（优先取当前上下文中的任务，未设置时回退到最近一次设置的任务）"""
+    task_id = _task_context.get()
+    return task_id if task_id is not None else _current_task_id
+
+
+def bind_task_context(func: Callable) -> Callable:
+    """
+    把当前上下文（任务ID、LLM缓存开关等 contextvars）绑定到 func
+
+    线程池的工作线程不会继承提交方的 contextvars，每次 submit 前单独调用一次
+    （同一个上下文副本不能在多个线程中同时进入）。
+    """
+    return functools.partial(contextvars.copy_context().run, func)
 
 
 def get_task_logs(task_id: str, clear: bool = False) -> list:
@@ -39,10 +73,53 @@ def get_task_logs(task_id: str, clear: bool = False) -> list:
     return logs
 
 
+def emit_task_event(event: dict):
+    """向当前任务推送一条结构化事件（如 {"type": "step", ...}）"""
+    task_id = get_current_task()
+    with _event_lock:
+        if task_id and task_id in _event_buffers:
+            _event_buffers[task_id].append({**event, "seq": next(_event_seqs[task_id])})
+
+
+def get_task_events(task_id: str, after_seq: int = 0) -> list:
+    """获取任务中 seq 大于 after_seq 的结构化事件"""
+    with _event_lock:
+        if task_id not in _event_buffers:
+            return []
+        return [event for event in _event_buffers[task_id] if event["seq"] > after_seq]
+
+
+def begin_task_run(task_id: str) -> object:
+    """
+    登记任务的一次运行（新任务或 resume 重跑），返回运行令牌
+
+    事件缓冲区与 seq 在重跑间延续，已连接的客户端按 seq 继续读取；
+    旧运行安排的清理凭令牌判断，不会删除新运行正在使用的缓冲区。
+    """
+    token = object()
+    with _event_lock:
+        _event_runs[task_id] = token
+        if task_id not in _event_buffers:
+            _event_buffers[task_id] = deque(maxlen=1000)
+            _event_seqs[task_id] = itertools.count(1)
+    return token
+
+
+def clear_task_events(task_id: str, run_token: Optional[object] = None):
+    """任务结束后释放事件缓冲区（传入 run_token 时仅当该运行仍是最新一次时释放）"""
+    with _event_lock:
+        if run_token is not None and _event_runs.get(task_id) is not run_token:
+            return
+        _event_buffers.pop(task_id, None)
+        _event_seqs.pop(task_id, None)
+        _event_runs.pop(task_id, None)
+
+
 def _append_to_buffer(message: str):
     """将日志添加到当前任务的缓冲区"""
-    if _current_task_id and _current_task_id in _log_buffers:
-        _log_buffers[_current_task_id].append(message)
+    task_id = get_current_task()
+    if task_id and task_id in _log_buffers:
+        _log_buffers[task_id].append(message)
 
 
 def safe_print(*args, **kwargs):